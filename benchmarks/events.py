@@ -0,0 +1,130 @@
+########
+# Copyright (c) 2016 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+############
+
+"""Compares clash.output.Event with the previous dict based event.
+
+Usage: python benchmarks/events.py [number_of_events] [repeat]
+"""
+
+import sys
+import timeit
+
+from clash import output
+
+
+class DictEvent(dict):
+
+    # the previous implementation, reduced to what __str__ uses
+
+    def __init__(self, event):
+        self.update(event)
+
+    __str__ = output.Event.__str__.im_func
+
+    @property
+    def context(self):
+        return self.get('context', {})
+
+    @property
+    def operation(self):
+        return self.context.get('operation')
+
+    @property
+    def node_name(self):
+        return self.context.get('node_name')
+
+    @property
+    def source_node_name(self):
+        return self.context.get('source_name')
+
+    @property
+    def target_node_name(self):
+        return self.context.get('target_name')
+
+    @property
+    def workflow_id(self):
+        return self.context.get('workflow_id')
+
+    @property
+    def level(self):
+        return self.get('level')
+
+    @property
+    def event_type(self):
+        return self.get('event_type')
+
+    @property
+    def message(self):
+        return self.get('message', {}).get('text', '').encode('utf-8')
+
+
+def _event(index):
+    return {
+        'event_type': 'task_succeeded',
+        'type': 'cloudify_event',
+        'timestamp': '2016-01-01 00:00:00.000+0000',
+        'message_code': None,
+        'context': {
+            'blueprint_id': 'blueprint',
+            'deployment_id': 'deployment',
+            'execution_id': 'execution',
+            'workflow_id': 'install',
+            'task_id': 'task{}'.format(index),
+            'task_name': 'script_runner.tasks.run',
+            'task_target': None,
+            'task_current_retries': 0,
+            'task_total_retries': -1,
+            'operation': 'cloudify.interfaces.lifecycle.create',
+            'plugin': 'script',
+            'node_name': 'node{}'.format(index % 100),
+            'node_id': 'node{}_abcde'.format(index % 100)
+        },
+        'message': {
+            'text': u"Task succeeded 'script_runner.tasks.run'",
+            'arguments': None
+        }
+    }
+
+
+def _best(func, repeat):
+    return min(timeit.Timer(func).repeat(repeat=repeat, number=1))
+
+
+def main():
+    number_of_events = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    events = [_event(i) for i in range(number_of_events)]
+    print '{} events, best of {} runs'.format(number_of_events, repeat)
+    print '{:<12}{:>12}{:>12}{:>14}'.format('', 'construct', 'render',
+                                            'bytes/event')
+    for name, event_cls in [('dict', DictEvent), ('slots', output.Event)]:
+        def construct():
+            for event in events:
+                event_cls(event)
+
+        def render():
+            for event in events:
+                str(event_cls(event))
+        size = sys.getsizeof(event_cls(events[0]))
+        if hasattr(event_cls(events[0]), '__dict__'):
+            size += sys.getsizeof(event_cls(events[0]).__dict__)
+        print '{:<12}{:>10.2f}ms{:>10.2f}ms{:>14}'.format(
+            name, _best(construct, repeat) * 1000,
+            _best(render, repeat) * 1000, size)
+
+
+if __name__ == '__main__':
+    main()
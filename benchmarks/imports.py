@@ -0,0 +1,61 @@
+########
+# Copyright (c) 2016 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+############
+
+"""Reports cumulative import times while running a clash command, similar
+to ``python -X importtime`` (which python 2.7 does not have).
+
+Usage: python benchmarks/imports.py CONFIG_PATH [COMMAND ARGS...]
+"""
+
+import __builtin__
+import sys
+import time
+
+_original_import = __builtin__.__import__
+_times = {}
+
+
+def _timed_import(name, *args, **kwargs):
+    already_imported = name in sys.modules
+    start = time.time()
+    try:
+        return _original_import(name, *args, **kwargs)
+    finally:
+        if not already_imported and name in sys.modules:
+            _times[name] = time.time() - start
+
+
+def main():
+    config_path, argv = sys.argv[1], sys.argv[2:]
+    __builtin__.__import__ = _timed_import
+    start = time.time()
+    try:
+        from clash import loader
+        loader.Loader(config_path, argv=argv).dispatch()
+    except SystemExit:
+        pass
+    finally:
+        __builtin__.__import__ = _original_import
+    total = time.time() - start
+    top = sorted(_times.items(), key=lambda item: item[1], reverse=True)
+    sys.stderr.write('{:>10} | module\n'.format('cumulative'))
+    for name, duration in top[:25]:
+        sys.stderr.write('{:>8.1f}ms | {}\n'.format(duration * 1000, name))
+    sys.stderr.write('total: {:.1f}ms\n'.format(total * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+########
+# Copyright (c) 2016 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+############
+
+"""Measures Loader construction time for a config with many commands.
+
+Usage: python benchmarks/startup.py [number_of_commands] [repeat]
+"""
+
+import os
+import shutil
+import sys
+from contextlib import contextmanager
+import tempfile
+import timeit
+
+import yaml
+from path import path
+
+from clash import cache
+from clash import config
+from clash import loader
+
+
+def completer(*args, **kwargs):
+    return []
+
+
+def _command(index):
+    return {
+        'workflow': 'workflow{}'.format(index),
+        'args': [
+            {'name': 'arg1',
+             'completer': '{}:completer'.format(__name__)},
+            {'name': '--arg2', 'default': 'default'},
+            {'name': ['-a', '--arg3']}
+        ],
+        'parameters': {
+            'param1': {'arg': 'arg1'},
+            'param2': {'arg': 'arg2'},
+            'param3': {'arg': 'arg3'}
+        }
+    }
+
+
+def _write_config(workdir, number_of_commands):
+    namespaces = {}
+    for index in range(number_of_commands):
+        namespace = namespaces.setdefault(
+            'namespace{}'.format(index % 10), {})
+        namespace['command{}'.format(index)] = _command(index)
+    user_config_path = workdir / 'user_config.yaml'
+    user_config_path.write_text(yaml.safe_dump({
+        'current': 'main',
+        'configurations': {'main': {'storage_dir': str(workdir)}}
+    }))
+    config_path = workdir / 'config.yaml'
+    config_path.write_text(yaml.safe_dump({
+        'name': 'startup',
+        'blueprint_path': 'blueprint.yaml',
+        'user_config_path': str(user_config_path),
+        'commands': namespaces
+    }))
+    return config_path
+
+
+@contextmanager
+def _parsed_config(config_path):
+    # excludes config parsing so only the command tree build is measured
+    parsed = config.Config(config_path)
+    original = config.Config
+    config.Config = lambda _: parsed
+    try:
+        yield
+    finally:
+        config.Config = original
+
+
+def _best(func, repeat, setup='pass'):
+    timer = timeit.Timer(func, setup=setup)
+    return min(timer.repeat(repeat=repeat, number=1))
+
+
+def main():
+    number_of_commands = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    workdir = path(tempfile.mkdtemp(prefix='clash-startup-benchmark-'))
+    try:
+        config_path = _write_config(workdir, number_of_commands)
+        cache_dir = workdir / 'cache'
+        os.environ[cache.CACHE_DIR] = cache_dir
+        cases = [
+            ('eager', dict(argv=['status'], lazy=False)),
+            ('lazy status', dict(argv=['status'])),
+            ('lazy command', dict(argv=['namespace1', 'command1'])),
+        ]
+
+        def clear_cache():
+            shutil.rmtree(cache_dir, ignore_errors=True)
+
+        print '{} commands, best of {} runs'.format(number_of_commands,
+                                                    repeat)
+        print '{:<15}{:>12}{:>12}{:>15}'.format('', 'cold cache',
+                                                'warm cache', 'command tree')
+        for name, kwargs in cases:
+            def create():
+                loader.Loader(config_path, **kwargs)
+            cold = _best(create, repeat, setup=clear_cache)
+            warm = _best(create, repeat)
+            with _parsed_config(config_path):
+                tree = _best(create, repeat, setup=clear_cache)
+            print '{:<15}{:>10.2f}ms{:>10.2f}ms{:>13.2f}ms'.format(
+                name, cold * 1000, warm * 1000, tree * 1000)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
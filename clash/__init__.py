@@ -16,3 +16,5 @@
 
 from clash.loader import dispatch  # noqa
 from clash.state import ctx  # noqa
+
+__version__ = '0.17'
@@ -0,0 +1,164 @@
+########
+# Copyright (c) 2016 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+############
+
+import hashlib
+import json
+import os
+import stat
+import tempfile
+
+from path import path
+
+CACHE_DIR = 'CLASH_CACHE_DIR'
+
+
+def cache_dir():
+    return path(os.environ.get(CACHE_DIR, '~/.cache/clash')).expanduser()
+
+
+def sha1(content):
+    return hashlib.sha1(content).hexdigest()
+
+
+class Cache(object):
+
+    def __init__(self, cache_path):
+        self.cache_path = path(cache_path)
+        self._entries = None
+        self._dirty = False
+
+    @classmethod
+    def for_config(cls, config_path):
+        name = '{}.json'.format(sha1(str(config_path)))
+        return cls(cache_dir() / 'configs' / name)
+
+    @property
+    def entries(self):
+        if self._entries is None:
+            try:
+                self._entries = json.loads(self.cache_path.text())
+            except (IOError, OSError, ValueError):
+                self._entries = {}
+        return self._entries
+
+    def get(self, key, sources):
+        entry = self.entries.get(key)
+        if not entry:
+            return None
+        fingerprints = entry['sources']
+        if set(fingerprints) != set(str(s) for s in sources):
+            return None
+        for source, fingerprint in fingerprints.items():
+            unchanged, current = _refresh(source, fingerprint)
+            if not unchanged:
+                return None
+            if current != fingerprint:
+                # touched but unchanged, remember the new mtime
+                fingerprints[source] = current
+                self._dirty = True
+        return entry['value']
+
+    def set(self, key, sources, value):
+        self.entries[key] = {
+            'sources': {str(s): _fingerprint(s) for s in sources},
+            'value': value
+        }
+        self._dirty = True
+
+    def save(self):
+        if not self._dirty:
+            return
+        self._dirty = False
+        try:
+            self.cache_path.dirname().makedirs_p()
+            write_atomic(self.cache_path, json.dumps(self.entries))
+        except (IOError, OSError):
+            # caching is best effort
+            pass
+
+
+def write_atomic(target, content):
+    # readers (possibly other clash processes) either see the previous
+    # content or the new one, never a partially written file
+    # symlinks are followed so the file they point to is replaced, not the
+    # link. the temp file gets the mode of the file it replaces
+    target = path(target).realpath()
+    fd, temp_path = tempfile.mkstemp(dir=target.dirname(),
+                                     prefix='.{}-'.format(target.basename()))
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(content)
+        try:
+            mode = stat.S_IMODE(target.stat().st_mode)
+        except OSError:
+            mode = _default_mode()
+        os.chmod(temp_path, mode)
+        os.rename(temp_path, target)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def _default_mode():
+    # the mode open() creates files with
+    umask = os.umask(0)
+    os.umask(umask)
+    return 0o666 & ~umask
+
+
+def dir_fingerprint(directory, exclude=()):
+    # stat based, a changed file is expected to change its size or mtime.
+    # symlinks are followed, like shutil.copytree does by default. excluded
+    # dirs and files, e.g. a storage dir nested in the directory, are
+    # skipped
+    directory = path(directory)
+    exclude = set(path(e).realpath() for e in exclude if e)
+    entries = []
+    for root, dirs, files in os.walk(directory, followlinks=True):
+        dirs[:] = sorted(d for d in dirs
+                         if (path(root) / d).realpath() not in exclude)
+        for name in sorted(files):
+            file_path = path(root) / name
+            if file_path.realpath() in exclude:
+                continue
+            try:
+                stat = file_path.stat()
+            except OSError:
+                continue
+            entries.append([str(directory.relpathto(file_path)),
+                            stat.st_mtime, stat.st_size])
+    return sha1(json.dumps(entries))
+
+
+def _fingerprint(source):
+    source = path(source)
+    if not source.isfile():
+        return None
+    stat = source.stat()
+    return [stat.st_mtime, stat.st_size, sha1(source.bytes())]
+
+
+def _refresh(source, fingerprint):
+    source = path(source)
+    if not source.isfile() or fingerprint is None:
+        return not source.isfile() and fingerprint is None, None
+    stat = source.stat()
+    mtime, size, digest = fingerprint
+    if [stat.st_mtime, stat.st_size] == [mtime, size]:
+        return True, fingerprint
+    if stat.st_size != size or sha1(source.bytes()) != digest:
+        return False, None
+    return True, [stat.st_mtime, size, digest]
@@ -0,0 +1,81 @@
+########
+# Copyright (c) 2016 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+############
+
+import argparse
+import os
+
+import argcomplete
+
+
+def requested(argv=None):
+    return argv is None and '_ARGCOMPLETE' in os.environ
+
+
+def build_index(parser):
+    index = {}
+
+    def walk(current_parser, words):
+        commands = []
+        options = []
+        for action in current_parser._actions:
+            if isinstance(action, argparse._SubParsersAction):
+                for name, subparser in action.choices.items():
+                    commands.append(name)
+                    walk(subparser, words + [name])
+            elif action.option_strings and action.help != argparse.SUPPRESS:
+                options += action.option_strings
+        index[' '.join(words)] = {'commands': commands, 'options': options}
+    walk(parser, [])
+    return index
+
+
+def index_completions(index, words, prefix):
+    if '--' in words or '=' in prefix:
+        return None
+    entry = index.get(' '.join(words))
+    if entry is None:
+        return None
+    # positionals and option values may have completers, those need the
+    # actual parser
+    if not entry['commands'] and not prefix.startswith('-'):
+        return None
+    return [c for c in entry['options'] + entry['commands']
+            if c.startswith(prefix)]
+
+
+def autocomplete(index, parser_factory):
+    finder = _CompletionFinder()
+    finder.index = index
+    finder.parser_factory = parser_factory
+    finder(argparse.ArgumentParser(add_help=False))
+
+
+class _CompletionFinder(argcomplete.CompletionFinder):
+
+    index = None
+    parser_factory = None
+
+    def _get_completions(self, comp_words, cword_prefix, cword_prequote,
+                         last_wordbreak_pos):
+        completions = index_completions(self.index, comp_words[1:],
+                                        cword_prefix)
+        if completions is None:
+            self._parser = self.parser_factory()
+            return super(_CompletionFinder, self)._get_completions(
+                comp_words, cword_prefix, cword_prequote, last_wordbreak_pos)
+        completions = self.filter_completions(completions)
+        return self.quote_completions(completions, cword_prequote,
+                                      last_wordbreak_pos)
@@ -14,20 +14,29 @@
 # limitations under the License.
 ############
 
+import copy
 import json
+from contextlib import contextmanager
 
 import yaml
 from path import path
 
+from clash import cache
 from clash import functions
+from clash import lock
 
 
 class Config(object):
 
     def __init__(self, config_path):
         config_path = path(config_path).expanduser().abspath()
-        self.config = json.loads(json.dumps(yaml.safe_load(
-            config_path.text())))
+        self.cache = cache.Cache.for_config(config_path)
+        self.config = self.cache.get('config', [config_path])
+        if self.config is None:
+            self.config = json.loads(json.dumps(yaml.safe_load(
+                config_path.text())))
+            self.cache.set('config', [config_path], self.config)
+        self.config_path = config_path
         self.config_dir = config_path.dirname()
 
     @property
@@ -46,7 +55,8 @@ class Config(object):
 
     @property
     def user_config(self):
-        return UserConfig(self.user_config_path)
+        return UserConfig(self.user_config_path, cache=self.cache,
+                          lock_timeout=self.lock_timeout)
 
     @property
     def blueprint_path(self):
@@ -72,6 +82,14 @@ class Config(object):
     def event_cls(self):
         return self.config.get('event_cls')
 
+    @property
+    def event_log(self):
+        return self.config.get('event_log')
+
+    @property
+    def output(self):
+        return self.config.get('output', {})
+
     @property
     def hooks(self):
         return ConfigHooks(self.config.get('hooks', {}))
@@ -84,6 +102,22 @@ class Config(object):
     def command_after_init_on_apply(self):
         return self.config.get('command_after_init_on_apply')
 
+    @property
+    def lock_timeout(self):
+        return lock.lock_timeout(default=self.config.get('lock_timeout'))
+
+    @property
+    def storage(self):
+        return self.config.get('storage', 'file')
+
+    @property
+    def history(self):
+        return self.config.get('history', False)
+
+    @property
+    def preload(self):
+        return self.config.get('preload', False)
+
 
 class ConfigHooks(object):
 
@@ -101,24 +135,78 @@ class ConfigHooks(object):
 
 class UserConfig(object):
 
-    def __init__(self, user_config_path):
+    def __init__(self, user_config_path, cache=None, lock_timeout=None):
         self.user_config_path = user_config_path
+        self.lock = lock.FileLock('{}.lock'.format(user_config_path),
+                                  timeout=lock_timeout)
         self._user_config = None
+        self._cache = cache
+        self._transactions = 0
+        self._dirty = False
 
     @property
     def user_config(self):
         if self._user_config:
             return self._user_config
+        return self._read()
+
+    @user_config.setter
+    def user_config(self, value):
+        self._user_config = value
+        self._dirty = True
+        if not self._transactions:
+            self.flush()
+
+    def _read(self, cached=True):
         if not self.user_config_path.exists():
             return {}
-        result = yaml.safe_load(self.user_config_path.text())
+        sources = [self.user_config_path]
+        result = None
+        # the cache keeps its own copy, setters modify the read value in
+        # place and a rolled back transaction must not leak into the cache
+        if cached and self._cache:
+            result = copy.deepcopy(self._cache.get('user_config', sources))
+        if result is None:
+            result = yaml.safe_load(self.user_config_path.text())
+            if self._cache:
+                self._cache.set('user_config', sources,
+                                copy.deepcopy(result))
         self._user_config = result
         return result
 
-    @user_config.setter
-    def user_config(self, value):
-        self._user_config = value
-        self.user_config_path.write_text(yaml.safe_dump(value))
+    @contextmanager
+    def transaction(self):
+        # mutations are buffered and written once by the outermost
+        # transaction, or discarded if it raises
+        self._transactions += 1
+        try:
+            yield self
+        except BaseException:
+            if self._transactions == 1:
+                self._user_config = None
+                self._dirty = False
+            raise
+        finally:
+            self._transactions -= 1
+        if not self._transactions:
+            self.flush()
+
+    @contextmanager
+    def locked(self):
+        # read-modify-write under an exclusive lock so concurrent clash
+        # processes don't lose each other's updates
+        with self.lock.exclusive():
+            if not self._dirty:
+                self._read(cached=False)
+            yield self
+            self.flush()
+
+    def flush(self):
+        if not self._dirty:
+            return
+        self._dirty = False
+        cache.write_atomic(self.user_config_path,
+                           yaml.safe_dump(self._user_config))
 
     @property
     def configurations(self):
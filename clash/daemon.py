@@ -0,0 +1,274 @@
+########
+# Copyright (c) 2016 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+############
+
+import errno
+import json
+import os
+import signal
+import socket
+import struct
+import sys
+import threading
+import traceback
+
+from clash import cache
+
+DAEMON = 'CLASH_DAEMON'
+
+_HEADER = struct.Struct('!cI')
+_STDOUT = 'o'
+_STDERR = 'e'
+_EXIT = 'x'
+
+
+def enabled():
+    return os.environ.get(DAEMON) not in (None, '', '0')
+
+
+def socket_path():
+    return cache.cache_dir() / 'daemon.sock'
+
+
+def forward(config_path, argv):
+    # returns the exit code of the command or None if no daemon is running
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(socket_path())
+    except socket.error as e:
+        client.close()
+        if e.errno in (errno.ENOENT, errno.ECONNREFUSED):
+            return None
+        raise
+    try:
+        request = {
+            'config_path': str(config_path),
+            'argv': argv,
+            'cwd': os.getcwd(),
+            'env': dict(os.environ)
+        }
+        client.sendall(json.dumps(request) + '\n')
+        streams = {_STDOUT: sys.stdout, _STDERR: sys.stderr}
+        while True:
+            channel, data = _read_frame(client)
+            if channel is None:
+                # daemon went away mid command
+                return 1
+            if channel == _EXIT:
+                return int(data)
+            streams[channel].write(data)
+            streams[channel].flush()
+    finally:
+        client.close()
+
+
+def serve():
+    from clash import loader as _loader
+    # the point of the daemon: commands forked from it don't pay for
+    # importing the cloudify stack
+    from cloudify.workflows import local  # noqa
+    from clash import output  # noqa
+
+    # requests change the working directory, modules imported later on
+    # (e.g. by commands) must not be looked up relative to it
+    sys.path[:] = [os.path.abspath(p) for p in sys.path]
+    for loaded in sys.modules.values():
+        if isinstance(getattr(loaded, '__path__', None), list):
+            loaded.__path__[:] = [os.path.abspath(p)
+                                  for p in loaded.__path__]
+
+    path = socket_path()
+    path.dirname().makedirs_p()
+    os.chmod(path.dirname(), 0o700)
+    if path.exists():
+        path.remove()
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(path)
+    os.chmod(path, 0o600)
+    server.listen(16)
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit())
+    loaders = _Loaders(_loader.Loader)
+    try:
+        while True:
+            try:
+                connection, _ = server.accept()
+            except socket.error as e:
+                if e.errno == errno.EINTR:
+                    continue
+                raise
+            try:
+                request = json.loads(connection.makefile().readline())
+                _apply_environment(request)
+                loader = loaders.get(request['config_path'])
+            except Exception:
+                _send_error(connection)
+                connection.close()
+                continue
+            if os.fork() == 0:
+                server.close()
+                # commands wait for their own subprocesses
+                signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                _handle(connection, loader, request['argv'])
+            connection.close()
+    finally:
+        server.close()
+        path.remove_p()
+
+
+def _apply_environment(request):
+    os.environ.clear()
+    os.environ.update(request['env'])
+    os.chdir(request['cwd'])
+
+
+def _handle(connection, loader, argv):
+    code = 1
+    pump = _OutputPump(connection)
+    try:
+        sys.argv = sys.argv[:1] + argv
+        loader.reload(argv=argv)
+        loader.dispatch(argv)
+        code = 0
+    except SystemExit as e:
+        code = e.code
+        if code is not None and not isinstance(code, int):
+            print >> sys.stderr, code
+            code = 1
+        code = code or 0
+    except BaseException:
+        traceback.print_exc()
+    finally:
+        pump.close()
+        _write_frame(connection, _EXIT, str(code))
+        connection.close()
+        os._exit(0)
+
+
+def _send_error(connection):
+    try:
+        _write_frame(connection, _STDERR, traceback.format_exc())
+        _write_frame(connection, _EXIT, '1')
+    except socket.error:
+        pass
+
+
+class _Loaders(object):
+
+    def __init__(self, loader_cls):
+        self._loader_cls = loader_cls
+        self._loaders = {}
+
+    def get(self, config_path):
+        # a warm loader is reused until one of the files it was built from
+        # changes
+        entry = self._loaders.get(config_path)
+        if entry:
+            fingerprint, loader = entry
+            if fingerprint == self._fingerprint(loader):
+                return loader
+        loader = self._loader_cls(config_path, argv=[])
+        self._loaders[config_path] = (self._fingerprint(loader), loader)
+        return loader
+
+    @staticmethod
+    def _fingerprint(loader):
+        user_config = loader.config.user_config
+        sources = [loader.config.config_path,
+                   user_config.user_config_path,
+                   user_config.macros_path,
+                   loader.config.blueprint_path]
+        result = []
+        for source in sources:
+            try:
+                stat = os.stat(source)
+                result.append((str(source), stat.st_mtime, stat.st_size))
+            except (OSError, TypeError):
+                result.append((str(source), None, None))
+        return result
+
+
+class _OutputPump(object):
+
+    # file descriptors 1 and 2 are redirected so output of subprocesses
+    # (e.g. scripts run by the script plugin) is forwarded as well
+
+    def __init__(self, connection):
+        self._connection = connection
+        self._lock = threading.Lock()
+        self._threads = []
+        devnull = os.open(os.devnull, os.O_RDONLY)
+        os.dup2(devnull, 0)
+        os.close(devnull)
+        for fd, channel in [(1, _STDOUT), (2, _STDERR)]:
+            read_fd, write_fd = os.pipe()
+            os.dup2(write_fd, fd)
+            os.close(write_fd)
+            thread = threading.Thread(target=self._pump,
+                                      args=(read_fd, channel))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def _pump(self, read_fd, channel):
+        while True:
+            data = os.read(read_fd, 65536)
+            if not data:
+                break
+            with self._lock:
+                _write_frame(self._connection, channel, data)
+        os.close(read_fd)
+
+    def close(self):
+        sys.stdout.flush()
+        sys.stderr.flush()
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, 1)
+        os.dup2(devnull, 2)
+        os.close(devnull)
+        for thread in self._threads:
+            thread.join()
+
+
+def _write_frame(connection, channel, data):
+    connection.sendall(_HEADER.pack(channel, len(data)) + data)
+
+
+def _read_frame(connection):
+    header = _recv(connection, _HEADER.size)
+    if header is None:
+        return None, None
+    channel, length = _HEADER.unpack(header)
+    return channel, _recv(connection, length)
+
+
+def _recv(connection, length):
+    chunks = []
+    while length:
+        chunk = connection.recv(length)
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        length -= len(chunk)
+    return ''.join(chunks)
+
+
+def main():
+    serve()
+
+
+if __name__ == '__main__':
+    main()
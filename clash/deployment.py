@@ -0,0 +1,86 @@
+########
+# Copyright (c) 2016 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+############
+
+
+class Snapshot(object):
+
+    # the plan nodes and node instance state of a deployment, taken before
+    # it is re-initialized
+
+    def __init__(self, env):
+        self.nodes = _nodes(env.plan)
+        self.instances = {}
+        for instance in env.storage.get_node_instances():
+            self.instances.setdefault(instance.node_id, []).append({
+                'id': instance.id,
+                'runtime_properties': instance.runtime_properties,
+                'state': instance.state
+            })
+        for instances in self.instances.values():
+            instances.sort(key=lambda i: i['id'])
+
+
+def affected_nodes(snapshot, plan):
+    # nodes that were added or changed and, transitively, the nodes that
+    # have relationships to them
+    nodes = _nodes(plan)
+    affected = set(node_id for node_id, node in nodes.items()
+                   if snapshot.nodes.get(node_id) != node)
+    while True:
+        dependents = set(
+            node_id for node_id, node in nodes.items()
+            if node_id not in affected and
+            any(r['target_id'] in affected
+                for r in node.get('relationships', [])))
+        if not dependents:
+            return sorted(affected)
+        affected |= dependents
+
+
+def restore(snapshot, env, affected):
+    # node instances of unaffected nodes get the runtime properties and
+    # state they had before. instances are matched by their order as
+    # instance ids are generated anew when the plan is prepared
+    batch = getattr(env.storage, 'batch', None)
+    if batch is None:
+        return _restore(snapshot, env, affected)
+    # storages that support it write all restored instances at once
+    with batch():
+        return _restore(snapshot, env, affected)
+
+
+def _restore(snapshot, env, affected):
+    restored = []
+    instances = {}
+    for instance in env.storage.get_node_instances():
+        instances.setdefault(instance.node_id, []).append(instance)
+    for node_id, node_instances in instances.items():
+        previous = snapshot.instances.get(node_id, [])
+        if node_id in affected or len(previous) != len(node_instances):
+            continue
+        node_instances.sort(key=lambda i: i.id)
+        for instance, previous_instance in zip(node_instances, previous):
+            env.storage.update_node_instance(
+                instance.id,
+                version=instance.version,
+                runtime_properties=previous_instance['runtime_properties'],
+                state=previous_instance['state'])
+        restored.append(node_id)
+    return sorted(restored)
+
+
+def _nodes(plan):
+    return {node['id']: node for node in plan['nodes']}
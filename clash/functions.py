@@ -14,61 +14,293 @@
 # limitations under the License.
 ############
 
+import json
 import os
+import threading
+import time
+from contextlib import contextmanager
 
-from dsl_parser import functions as dsl_functions
+import argh
 
+from clash import cache
 from clash import module
 
-_RAW = object()
+_FUNC_CACHE_POLICIES = ['invocation', 'process', 'storage']
+_FUNC_CACHE_FILE = '.func_cache.json'
 
 
 def parse_parameters(loader, parameters, args):
+    return compile_parameters(parameters).evaluate(loader=loader, args=args)
 
-    def env(func_args):
-        if not isinstance(func_args, list):
-            func_args = [func_args]
-        return os.environ.get(*func_args)
-
-    def func(func_args):
-        kwargs = func_args.get('kwargs', {})
-        for value in kwargs.values():
-            if dsl_functions.parse(value) != value:
-                return _RAW
-        kwargs['loader'] = loader
-        function = module.load_attribute(func_args['name'])
-        return function(**kwargs)
-
-    functions = {
-        'env': env,
-        'arg': lambda func_args: args[func_args],
-        'user_config': lambda func_args: getattr(loader.user_config,
-                                                 func_args),
-        'loader': lambda func_args: getattr(loader, func_args),
-        'func': func
-    }
-    for name, process in functions.items():
-        dsl_functions.register(_function(process), name)
+
+def compile_parameters(parameters):
+    return Template(parameters)
+
+
+class Template(object):
+
+    # parameters are compiled once into a tree in which only function
+    # calls are evaluated per invocation. evaluating builds new containers
+    # and never modifies the compiled parameters, so templates can be
+    # shared between invocations and threads
+
+    def __init__(self, parameters):
+        self.parameters = parameters
+        self._root = None
+        self._lock = threading.Lock()
+
+    def evaluate(self, loader, args):
+        return self._compiled().evaluate(_Context(loader=loader, args=args))
+
+    def _compiled(self):
+        # compiled lazily, on first evaluation
+        if self._root is None:
+            with self._lock:
+                if self._root is None:
+                    self._root = _compile(self.parameters, call=False)
+        return self._root
+
+
+class _Context(object):
+
+    def __init__(self, loader, args):
+        self.loader = loader
+        self.args = args
+
+
+def _is_function(name):
+    # dsl_parser is only imported (e.g. not by env list and completion)
+    # when a template has a single key dict that is not a runtime function
+    return name in _RUNTIME_FUNCTIONS or name in _dsl_function_names()
+
+
+def _dsl_function_names():
+    from dsl_parser import functions as dsl_functions
+    return dsl_functions.TEMPLATE_FUNCTIONS
+
+
+def _compile(value, call=True):
+    # like dsl_parser's evaluation, a function is a dict with a single
+    # known key and the top level value is never a function
+    if isinstance(value, dict):
+        if call and len(value) == 1:
+            name, args = next(value.iteritems())
+            if _is_function(name):
+                return _Call(name, _compile(args), raw=value)
+        items = [(k, _compile(v)) for k, v in value.iteritems()]
+        if all(isinstance(v, _Static) for _, v in items):
+            return _Static(value)
+        return _Dict(items)
+    if isinstance(value, list):
+        items = [_compile(v) for v in value]
+        if all(isinstance(v, _Static) for v in items):
+            return _Static(value)
+        return _List(items)
+    return _Static(value)
+
+
+class _Static(object):
+
+    def __init__(self, value):
+        self.value = value
+
+    def evaluate(self, context):
+        return _copy(self.value)
+
+
+class _Dict(object):
+
+    def __init__(self, items):
+        self.items = items
+
+    def evaluate(self, context):
+        return {k: v.evaluate(context) for k, v in self.items}
+
+
+class _List(object):
+
+    def __init__(self, items):
+        self.items = items
+
+    def evaluate(self, context):
+        return [v.evaluate(context) for v in self.items]
+
+
+class _Call(object):
+
+    def __init__(self, name, args, raw):
+        self.name = name
+        self.args = args
+        self.raw = raw
+
+    def evaluate(self, context):
+        # nested functions are evaluated first
+        args = self.args.evaluate(context)
+        if self.name in _RUNTIME_FUNCTIONS:
+            result = _RUNTIME_FUNCTIONS[self.name](context, args)
+        else:
+            result = _dsl_function(self.name, args, self.raw)
+        if isinstance(result, (dict, list)):
+            # functions may return values that contain functions
+            result = _compile(result).evaluate(context)
+        return result
+
+
+def _copy(value):
+    # static containers are copied so callers may modify the result
+    if isinstance(value, dict):
+        return {k: _copy(v) for k, v in value.iteritems()}
+    if isinstance(value, list):
+        return [_copy(v) for v in value]
+    return value
+
+
+def _env(context, args):
+    if not isinstance(args, list):
+        args = [args]
+    return os.environ.get(*args)
+
+
+def _arg(context, args):
+    return context.args[args]
+
+
+def _user_config(context, args):
+    return getattr(context.loader.user_config, args)
+
+
+def _loader(context, args):
+    return getattr(context.loader, args)
+
+
+def _func(context, args):
+    policy = args.get('cache')
+    if policy is None:
+        return _call_func(context, args)
+    if policy not in _FUNC_CACHE_POLICIES:
+        raise argh.CommandError('Unknown func cache policy: {}. Valid '
+                                'policies: {}'.format(
+                                    policy, ', '.join(_FUNC_CACHE_POLICIES)))
+    try:
+        key = json.dumps([args['name'], args.get('kwargs', {})],
+                         sort_keys=True)
+    except (TypeError, ValueError):
+        raise argh.CommandError('func {} is cached but its kwargs are not '
+                                'JSON serializable'.format(args['name']))
+    if policy == 'storage':
+        func_cache = _StorageFuncCache(_storage_dir(context, args['name']))
+    else:
+        func_cache = _func_caches[policy]
+    found, value = func_cache.get(key, ttl=args.get('ttl'))
+    if not found:
+        value = _call_func(context, args)
+        func_cache.set(key, value)
+    # cached values are copied so callers may modify the result
+    return _copy(value)
+
+
+def _call_func(context, args):
+    kwargs = dict(args.get('kwargs', {}))
+    kwargs['loader'] = context.loader
+    function = module.load_attribute(args['name'])
+    return function(**kwargs)
+
+
+def _storage_dir(context, name):
+    storage_dir = context.loader and context.loader.user_config.storage_dir
+    if not storage_dir:
+        raise argh.CommandError('func {} is cached in the storage dir but no '
+                                'env is configured'.format(name))
+    return storage_dir
+
+
+@contextmanager
+def invocation():
+    # funcs cached with the invocation policy are called at most once
+    # within a dispatched command (e.g. in all steps of a macro). nested
+    # invocations (commands run by shell and batch) start a fresh cache
+    previous = _func_caches['invocation']
+    _func_caches['invocation'] = _FuncCache()
     try:
-        return dsl_functions.evaluate_functions(parameters,
-                                                None, None, None, None)
+        yield
     finally:
-        for name in functions.keys():
-            dsl_functions.unregister(name)
+        _func_caches['invocation'] = previous
+
+
+class _FuncCache(object):
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, ttl=None):
+        with self._lock:
+            entry = self._entries.get(key)
+        return _valid(entry, ttl)
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = {'time': time.time(), 'value': value}
+
+
+class _StorageFuncCache(object):
+
+    # read and written on each access, other clash processes using the same
+    # env may update it in between
+
+    def __init__(self, storage_dir):
+        self.cache_path = storage_dir / _FUNC_CACHE_FILE
+
+    def get(self, key, ttl=None):
+        return _valid(self._read().get(key), ttl)
+
+    def set(self, key, value):
+        entries = self._read()
+        entries[key] = {'time': time.time(), 'value': value}
+        try:
+            content = json.dumps(entries)
+        except (TypeError, ValueError):
+            raise argh.CommandError('func result cached in the storage dir '
+                                    'is not JSON serializable: {}'
+                                    .format(value))
+        cache.write_atomic(self.cache_path, content)
+
+    def _read(self):
+        try:
+            return json.loads(self.cache_path.text())
+        except (IOError, OSError, ValueError):
+            return {}
+
+
+def _valid(entry, ttl):
+    # returns (found, value), expired entries are not found
+    if not entry:
+        return False, None
+    if ttl is not None and time.time() - entry['time'] >= ttl:
+        return False, None
+    return True, entry['value']
+
+
+_func_caches = {
+    'invocation': _FuncCache(),
+    'process': _FuncCache()
+}
 
 
-def _function(process):
-    class Function(dsl_functions.Function):
-        validate = None
-        evaluate = None
-        function_args = None
+def _dsl_function(name, args, raw):
+    from dsl_parser import functions as dsl_functions
+    function = dsl_functions.TEMPLATE_FUNCTIONS[name](args, raw=raw)
+    storage = dsl_functions.RuntimeEvaluationStorage(
+        get_node_instances_method=None,
+        get_node_instance_method=None,
+        get_node_method=None)
+    return function.evaluate_runtime(storage=storage)
 
-        def parse_args(self, args):
-            self.function_args = args
 
-        def evaluate_runtime(self, **_):
-            result = process(self.function_args)
-            if result is _RAW:
-                return self.raw
-            return result
-    return Function
+_RUNTIME_FUNCTIONS = {
+    'env': _env,
+    'arg': _arg,
+    'user_config': _user_config,
+    'loader': _loader,
+    'func': _func
+}
@@ -0,0 +1,244 @@
+########
+# Copyright (c) 2016 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+############
+
+import json
+import re
+import sqlite3
+import sys
+import time
+from contextlib import contextmanager
+
+import argh
+
+DB_NAME = 'history.sqlite'
+MAX_EVENTS = 10000
+
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+_SCHEMA = [
+    'CREATE TABLE IF NOT EXISTS executions ('
+    'id INTEGER PRIMARY KEY, command TEXT, workflow TEXT, parameters TEXT, '
+    'started_at REAL, ended_at REAL, status TEXT, error TEXT, '
+    'event_count INTEGER)',
+    'CREATE TABLE IF NOT EXISTS events ('
+    'id INTEGER PRIMARY KEY, execution_id INTEGER, timestamp REAL, '
+    'type TEXT, event_type TEXT, node_name TEXT, data TEXT)',
+    'CREATE INDEX IF NOT EXISTS executions_started_at '
+    'ON executions (started_at)',
+    'CREATE INDEX IF NOT EXISTS executions_workflow '
+    'ON executions (workflow, started_at)',
+    'CREATE INDEX IF NOT EXISTS events_execution_id '
+    'ON events (execution_id)',
+    'CREATE INDEX IF NOT EXISTS events_timestamp ON events (timestamp)',
+    'CREATE INDEX IF NOT EXISTS events_node_name '
+    'ON events (node_name, timestamp)',
+    'CREATE INDEX IF NOT EXISTS events_event_type '
+    'ON events (event_type, timestamp)'
+]
+
+_TIME_UNITS = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 24 * 60 * 60}
+_TIME_FORMATS = ['%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S',
+                 '%Y-%m-%d %H:%M', '%Y-%m-%d']
+
+
+@contextmanager
+def record(db_path, command, workflow, parameters, max_events=None):
+    # yields a recorder to pass events to, the execution and its events are
+    # saved when it ends. nothing is recorded when db_path is None
+    if db_path is None:
+        yield None
+        return
+    recorder = Recorder(max_events=max_events or MAX_EVENTS)
+    started_at = time.time()
+    status = SUCCEEDED
+    error = None
+    try:
+        yield recorder
+    except BaseException as e:
+        status = CANCELLED if isinstance(e, KeyboardInterrupt) else FAILED
+        error = str(e)
+        raise
+    finally:
+        # the execution's own outcome is kept if it can't be saved
+        try:
+            History(db_path).save(command=command,
+                                  workflow=workflow,
+                                  parameters=parameters,
+                                  started_at=started_at,
+                                  ended_at=time.time(),
+                                  status=status,
+                                  error=error,
+                                  events=recorder.recorded())
+        except Exception as e:
+            sys.stderr.write('warning: Failed saving the execution to the '
+                             'history: {}: {}\n'.format(type(e).__name__, e))
+
+
+def parse_time(value):
+    # either a duration back from now (30s, 15m, 2h, 7d) or a local time
+    if value is None:
+        return None
+    match = re.match(r'^(\d+)([smhd])$', value)
+    if match:
+        return time.time() - int(match.group(1)) * _TIME_UNITS[
+            match.group(2)]
+    for time_format in _TIME_FORMATS:
+        try:
+            return time.mktime(time.strptime(value, time_format))
+        except ValueError:
+            pass
+    raise argh.CommandError('Invalid time: {}. Use a duration such as 2h or '
+                            'a time such as "2016-01-01 10:00"'
+                            .format(value))
+
+
+class Recorder(object):
+
+    # events are put by the task threads, list.append is atomic. events
+    # beyond max_events are dropped, and their number is recorded, like the
+    # event sink does when its queue is full
+
+    def __init__(self, max_events=None):
+        self.max_events = max_events
+        self.events = []
+        self.dropped = 0
+
+    def put(self, item):
+        if self.max_events and len(self.events) >= self.max_events:
+            self.dropped += 1
+            return
+        self.events.append((time.time(), item))
+
+    def recorded(self):
+        if not self.dropped:
+            return self.events
+        return self.events + [(time.time(), {'type': 'clash_events_dropped',
+                                             'count': self.dropped})]
+
+
+class History(object):
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+
+    def save(self, command, workflow, parameters, started_at, ended_at,
+             status, error, events):
+        connection = self._connect()
+        try:
+            with connection:
+                cursor = connection.execute(
+                    'INSERT INTO executions (command, workflow, parameters, '
+                    'started_at, ended_at, status, error, event_count) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                    (command, workflow, json.dumps(parameters, default=str),
+                     started_at, ended_at, status, error, len(events)))
+                execution_id = cursor.lastrowid
+                connection.executemany(
+                    'INSERT INTO events (execution_id, timestamp, type, '
+                    'event_type, node_name, data) VALUES (?, ?, ?, ?, ?, ?)',
+                    [(execution_id, timestamp, item.get('type'),
+                      item.get('event_type'), _node_name(item),
+                      json.dumps(item, default=str))
+                     for timestamp, item in events])
+            return execution_id
+        finally:
+            connection.close()
+
+    def executions(self, workflow=None, node=None, event_type=None,
+                   since=None, until=None, limit=None):
+        # the last executions started in the time range, oldest first.
+        # node and event_type select executions that had such events
+        conditions, params = [], []
+        _filter(conditions, params, 'workflow = ?', workflow)
+        _filter(conditions, params, 'started_at >= ?', since)
+        _filter(conditions, params, 'started_at <= ?', until)
+        if node or event_type:
+            event_conditions, event_params = [], []
+            _filter(event_conditions, event_params, 'node_name = ?', node)
+            _filter(event_conditions, event_params, 'event_type = ?',
+                    event_type)
+            conditions.append(
+                'id IN (SELECT execution_id FROM events WHERE {})'
+                .format(' AND '.join(event_conditions)))
+            params += event_params
+        rows = self._query(
+            'SELECT id, command, workflow, parameters, started_at, '
+            'ended_at, status, error, event_count FROM executions',
+            conditions, params, order='id', limit=limit)
+        return [{
+            'id': row[0],
+            'command': row[1],
+            'workflow': row[2],
+            'parameters': json.loads(row[3]),
+            'started_at': row[4],
+            'ended_at': row[5],
+            'status': row[6],
+            'error': row[7],
+            'event_count': row[8]
+        } for row in rows]
+
+    def events(self, workflow=None, node=None, event_type=None, since=None,
+               until=None, execution_id=None, limit=None):
+        # the last events recorded in the time range, oldest first, as
+        # (execution id, event) pairs
+        conditions, params = [], []
+        _filter(conditions, params, 'events.execution_id = ?', execution_id)
+        _filter(conditions, params, 'events.node_name = ?', node)
+        _filter(conditions, params, 'events.event_type = ?', event_type)
+        _filter(conditions, params, 'events.timestamp >= ?', since)
+        _filter(conditions, params, 'events.timestamp <= ?', until)
+        query = 'SELECT events.execution_id, events.data FROM events'
+        if workflow:
+            query += (' JOIN executions ON '
+                      'executions.id = events.execution_id')
+            _filter(conditions, params, 'executions.workflow = ?', workflow)
+        rows = self._query(query, conditions, params, order='events.id',
+                           limit=limit)
+        return [(row[0], json.loads(row[1])) for row in rows]
+
+    def _query(self, query, conditions, params, order, limit):
+        if conditions:
+            query += ' WHERE {}'.format(' AND '.join(conditions))
+        query += ' ORDER BY {} DESC'.format(order)
+        if limit:
+            query += ' LIMIT ?'
+            params = params + [limit]
+        connection = self._connect()
+        try:
+            return list(reversed(connection.execute(query,
+                                                    params).fetchall()))
+        finally:
+            connection.close()
+
+    def _connect(self):
+        connection = sqlite3.connect(self.db_path, timeout=60)
+        connection.execute('PRAGMA journal_mode=WAL')
+        for statement in _SCHEMA:
+            connection.execute(statement)
+        return connection
+
+
+def _filter(conditions, params, condition, value):
+    if value is not None:
+        conditions.append(condition)
+        params.append(value)
+
+
+def _node_name(item):
+    context = item.get('context') or {}
+    return context.get('node_name') or context.get('source_name')
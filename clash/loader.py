@@ -15,24 +15,37 @@
 ############
 
 import argparse
+import errno
+import itertools
 import sys
 import os
 import shutil
 import tempfile
+import threading
+import time
+import types
 import json as _json
 import StringIO
-import copy
 
 import yaml
 import argh
+import argcomplete
 from path import path
 
-from cloudify.workflows import local
-
-from clash import output
+# cloudify.workflows.local and clash.output (cloudify.logs) are imported
+# where they are used so that commands that never run a workflow (env
+# commands, completion) don't pay for importing the cloudify stack
+from clash import cache
+from clash import completion
 from clash import functions
+from clash import history
 from clash import module
 from clash import config
+from clash import daemon
+from clash import deployment
+from clash import lock
+from clash import macros
+from clash import plan
 from clash import state
 
 
@@ -40,44 +53,121 @@ class Loader(object):
 
     _name = '.local'
 
-    def __init__(self, config_path):
+    def __init__(self, config_path, argv=None, lazy=True):
         self.config = config.Config(config_path)
         self.user_config = self.config.user_config
-        self.user_commands = {}
-        self._parser = argh.ArghParser()
-        env_commands = [self._parse_env_create_command()]
+        self.user_commands = _LazyCommands()
+        self._argv = argv
+        self._selected = _selected_path(argv) if lazy else None
+        self._load_completers = True
+        self._parser = None
+        self._env = None
+        self._env_lock = threading.RLock()
+        self._storage_locks = {}
+        self._step_parsers = {}
+        self._preload = None
+        self.affected_node_ids = None
+        if not completion.requested(argv):
+            self._start_preload()
+            # when completing, the parser is only built if the completion
+            # index cannot answer
+            self._parser = self._build_parser()
+
+    @property
+    def parser(self):
+        if self._parser is None:
+            self._parser = self._build_parser()
+        return self._parser
+
+    def _build_parser(self):
+        parser = argh.ArghParser()
+        env_commands = [self._command(
+            _Lazy(self._parse_env_create_command),
+            name='create', namespace='env')]
         if self.user_config.storage_dir:
             env_commands += self._parse_env_subcommands()
-            self._parse_commands(commands=self.config.commands,
-                                 macros=self.user_config.macros)
-            self._parser.add_commands(functions=[self._init_command,
-                                                 self._status_command,
-                                                 self._apply_command])
-        self._parser.add_commands(functions=env_commands, namespace='env')
-
-    def _parse_commands(self, commands, macros, namespace=None):
+            tree = self._command_tree()
+            _check_builtin_names(tree)
+            for namespace in tree:
+                self._parse_commands(parser=parser, **namespace)
+            parser.add_commands(functions=[self._init_command,
+                                           self._status_command,
+                                           self._history_command,
+                                           self._apply_command,
+                                           self._migrate_storage_command])
+        parser.add_commands(functions=env_commands, namespace='env')
+        parser.add_commands(functions=[self._shell_command,
+                                       self._batch_command])
+        self.config.cache.save()
+        return parser
+
+    def _tree_sources(self):
+        sources = [self.config.config_path,
+                   self.user_config.user_config_path,
+                   self.user_config.macros_path]
+        return [source for source in sources if source]
+
+    def _command_tree(self):
+        sources = self._tree_sources()
+        tree = self.config.cache.get('command_tree', sources)
+        if tree is None:
+            tree = _json.loads(_json.dumps(_command_tree(
+                commands=self.config.commands,
+                macros=self.user_config.macros)))
+            self.config.cache.set('command_tree', sources, tree)
+        return tree
+
+    def _completion_index(self):
+        # built-in commands and options are defined by clash itself, an
+        # upgraded (or edited) clash must not be answered from an old index
+        import clash
+        key = 'completion_index-{}'.format(clash.__version__)
+        sources = self._tree_sources() + _builtin_command_sources()
+        index = self.config.cache.get(key, sources)
+        if index is None:
+            selected, self._selected = self._selected, None
+            self._load_completers = False
+            try:
+                index = completion.build_index(self._build_parser())
+            finally:
+                self._selected = selected
+                self._load_completers = True
+            self.config.cache.set(key, sources, index)
+            self.config.cache.save()
+        return index
+
+    def _parse_commands(self, parser, namespace, commands, macros):
         functions = []
-        for name, command in commands.items():
-            if 'workflow' not in command and 'function' not in command:
-                self._parse_commands(commands=command, namespace=name,
-                                     macros=macros.get(name, {}))
-                continue
-            functions.append(self._parse_command(name=name, command=command))
-        for function in functions:
-            name = function.argh_name
+        for name, command in commands:
+            lazy_command = _Lazy(self._parse_command,
+                                 name=name, command=command)
+            full_name = name
             if namespace:
-                name = '{}.{}'.format(namespace, name)
-            self.user_commands[name] = function
-        for name, macro in macros.items():
-            if 'commands' not in macro:
-                if name in commands:
-                    # namespace already handled by existing commands namespace
-                    continue
-                self._parse_commands(commands={}, namespace=name,
-                                     macros=macro)
-                continue
-            functions.append(self._parse_macro(name=name, macro=macro))
-        self._parser.add_commands(functions=functions, namespace=namespace)
+                full_name = '{}.{}'.format(namespace, name)
+            self.user_commands[full_name] = lazy_command
+            functions.append(self._command(lazy_command,
+                                           name=name,
+                                           namespace=namespace))
+        for name, macro in macros:
+            functions.append(self._command(
+                _Lazy(self._parse_macro, name=name, macro=macro),
+                name=name,
+                namespace=namespace))
+        if namespace and not self._is_selected([namespace]):
+            # commands of namespaces not selected by argv are never parsed
+            functions = []
+        parser.add_commands(functions=functions, namespace=namespace)
+
+    def _command(self, lazy_command, name, namespace=None):
+        command_path = [namespace, name] if namespace else [name]
+        if self._is_selected(command_path):
+            return lazy_command.get()
+        return _stub(name)
+
+    def _is_selected(self, command_path):
+        if self._selected is None:
+            return True
+        return self._selected[:len(command_path)] == command_path
 
     def _parse_command(self, name, command):
         if 'function' in command:
@@ -90,19 +180,21 @@ class Loader(object):
                 kwargs.pop('_functions_stack', None)
                 state.current_loader.set(self)
                 try:
-                    return function(**kwargs)
+                    with self.storage_lock.exclusive():
+                        return function(**kwargs)
                 finally:
                     state.current_loader.clear()
         else:
+            parameters_template = functions.compile_parameters(
+                command.get('parameters', {}))
+
             @argh.expects_obj
             @argh.named(name)
             @argh.arg('-v', '--verbose', default=False)
             def func(args):
                 self._set_paths()
-                parameters = functions.parse_parameters(
-                    loader=self,
-                    parameters=copy.deepcopy(command.get('parameters', {})),
-                    args=vars(args))
+                parameters = parameters_template.evaluate(loader=self,
+                                                          args=vars(args))
                 task_config = {
                     'retries': 0,
                     'retry_interval': 1,
@@ -112,53 +204,189 @@ class Loader(object):
                 command_task_config = command.get('task', {})
                 task_config.update(global_task_config)
                 task_config.update(command_task_config)
-                env = self.env
-
-                event_cls = command.get('event_cls',
-                                        self.config.event_cls)
-                output.setup_output(event_cls=event_cls,
-                                    verbose=args.verbose,
-                                    env=env,
-                                    command=command)
+                with self.storage_lock.exclusive():
+                    return self._execute_workflow(name=name,
+                                                  command=command,
+                                                  parameters=parameters,
+                                                  task_config=task_config,
+                                                  verbose=args.verbose)
+        self._add_args_to_func(func, command.get('args', []), skip_env=False)
+        return func
 
+    def _execute_workflow(self, name, command, parameters, task_config,
+                          verbose):
+        env = self.env
+        workflow_parameters = env.plan['workflows'].get(
+            command['workflow'], {}).get('parameters', {})
+        if (self.affected_node_ids is not None and
+                'node_ids' in workflow_parameters and
+                'node_ids' not in parameters):
+            # the command after init on apply runs on the affected nodes
+            parameters = dict(parameters, node_ids=self.affected_node_ids)
+        event_cls = command.get('event_cls', self.config.event_cls)
+        event_log = command.get('event_log', self.config.event_log)
+        output_config = dict(self.config.output)
+        output_config.update(command.get('output', {}))
+        # history is either true or a dict with max_events
+        history_config = self.config.history
+        history_path = None
+        max_events = None
+        if history_config:
+            history_path = self.user_config.storage_dir / history.DB_NAME
+            if isinstance(history_config, dict):
+                max_events = history_config.get('max_events')
+        from clash import output
+        with history.record(history_path,
+                            command=name,
+                            workflow=command['workflow'],
+                            parameters=parameters,
+                            max_events=max_events) as recorder:
+            output.setup_output(
+                event_cls=event_cls,
+                verbose=verbose,
+                env=env,
+                command=command,
+                event_types=output_config.get('event_types'),
+                log_level=output_config.get('log_level'),
+                mode=output_config.get('mode'),
+                refresh_interval=output_config.get('refresh_interval'),
+                event_log=self._event_log_config(event_log),
+                sinks=[recorder] if recorder else [])
+            try:
                 return env.execute(
                     workflow=command['workflow'],
                     parameters=parameters,
                     task_retries=task_config['retries'],
                     task_retry_interval=task_config['retry_interval'],
                     task_thread_pool_size=task_config['thread_pool_size'])
-        self._add_args_to_func(func, command.get('args', []), skip_env=False)
-        return func
+            finally:
+                output.close_output()
+
+    def _event_log_config(self, event_log):
+        # event_log is either true or a dict of the sink settings, its path
+        # is relative to the storage dir
+        if not event_log:
+            return None
+        event_log = dict(event_log) if isinstance(event_log, dict) else {}
+        event_log['path'] = (self.user_config.storage_dir /
+                             event_log.get('path', 'events.jsonl'))
+        return event_log
 
     def _parse_macro(self, name, macro):
+        args_templates = [functions.compile_parameters(c.get('args', []))
+                          for c in macro['commands']]
+
         @argh.expects_obj
         @argh.named(name)
         def func(args):
             self._set_paths()
             args = vars(args)
-            for user_command in macro['commands']:
-                user_command_name = user_command['name']
-                user_command_args = functions.parse_parameters(
-                    loader=self,
-                    parameters=user_command.get('args', []),
-                    args=args)
-                print '==> {0}: {1}'.format(user_command_name,
-                                            user_command_args)
-                user_command_func = self.user_commands[user_command_name]
-                argh.dispatch_command(user_command_func,
-                                      argv=user_command_args)
+            # held across steps so no other process runs in between
+            with self.storage_lock.exclusive():
+                steps = zip(macro['commands'], args_templates)
+                if macros.is_parallel(macro):
+                    from clash import output
+                    # each step sets up and records the output of its own
+                    # execution
+                    with output.per_thread():
+                        macros.run([self._macro_step(user_command, template,
+                                                     args)
+                                    for user_command, template in steps],
+                                   concurrency=macro.get('concurrency'))
+                    return
+                for user_command, template in steps:
+                    user_command_name = user_command['name']
+                    user_command_args = template.evaluate(loader=self,
+                                                          args=args)
+                    print '==> {0}: {1}'.format(user_command_name,
+                                                user_command_args)
+                    self._macro_step_call(user_command_name,
+                                          user_command_args)()
         self._add_args_to_func(func, macro.get('args', []), skip_env=False)
         return func
 
+    def _macro_step(self, user_command, args_template, args):
+        user_command_name = user_command['name']
+        step_id = user_command.get('id', user_command_name)
+
+        def prepare():
+            # intrinsic functions are evaluated on the dispatching thread,
+            # after the steps this one depends on completed
+            user_command_args = args_template.evaluate(loader=self,
+                                                       args=args)
+            print '==> {0}: {1}'.format(step_id, user_command_args)
+            return self._macro_step_call(user_command_name,
+                                         user_command_args)
+        return macros.Step(step_id=step_id,
+                           depends_on=user_command.get('depends_on', []),
+                           prepare=prepare,
+                           run=lambda call: call())
+
+    def _macro_step_call(self, user_command_name, user_command_args):
+        # steps call the user command function directly. args given as a
+        # mapping are passed as is, args given as a list are parsed as
+        # argv by a parser built once per command
+        user_command_func = self.user_commands[user_command_name]
+        parser = self._step_parsers.get(user_command_name)
+        if parser is None:
+            parser = argh.ArghParser(prog=user_command_name)
+            parser.set_default_command(user_command_func)
+            self._step_parsers[user_command_name] = parser
+        if isinstance(user_command_args, dict):
+            namespace = _namespace(parser, user_command_name,
+                                   user_command_args)
+        else:
+            namespace = parser.parse_args(user_command_args)
+
+        def call():
+            _write_result(user_command_func(namespace))
+        return call
+
     @property
     def env(self):
         return self._load_env()
 
     def _load_env(self):
-        return local.load_env(name=self._name, storage=self._storage())
+        # loaded once and reused until init/apply (also by another process,
+        # which rewrites the init fingerprint) or a switch to another
+        # storage dir invalidates it
+        storage_dir = self.user_config.storage_dir
+        key = (storage_dir, self._init_stamp(storage_dir))
+        with self._env_lock:
+            if self._env is None or self._env[0] != key:
+                from cloudify.workflows import local
+                env = local.load_env(name=self._name,
+                                     storage=self._storage())
+                self._env = (key, env)
+            return self._env[1]
+
+    @staticmethod
+    def _init_stamp(storage_dir):
+        try:
+            stat = (storage_dir / '.init_fingerprint').stat()
+        except (OSError, TypeError):
+            return None
+        return stat.st_ino, stat.st_mtime
+
+    def _invalidate_env(self):
+        with self._env_lock:
+            self._env = None
+
+    @property
+    def storage_lock(self):
+        # shared for commands that only read storage, exclusive for
+        # commands that modify it
+        storage_dir = self.user_config.storage_dir
+        if storage_dir not in self._storage_locks:
+            self._storage_locks[storage_dir] = lock.FileLock(
+                storage_dir / '.clash.lock',
+                timeout=self.config.lock_timeout)
+        return self._storage_locks[storage_dir]
 
     def _storage(self):
-        return local.FileStorage(storage_dir=self.user_config.storage_dir)
+        from clash import storage
+        return storage.create(self.config.storage,
+                              storage_dir=self.user_config.storage_dir)
 
     def _parse_env_create_command(self):
         env_create = self.config.env_create
@@ -166,14 +394,15 @@ class Loader(object):
         @argh.expects_obj
         @argh.named('create')
         def func(args):
-            if (self.user_config.current == args.name and
-                    self.user_config.storage_dir and not args.reset):
-                raise argh.CommandError('storage dir already configured. pass '
-                                        '--reset to override.')
-            storage_dir = args.storage_dir or os.getcwd()
-            self.user_config.current = args.name
-            self.user_config.editable = args.editable
-            self.user_config.storage_dir = storage_dir
+            with self.user_config.locked():
+                if (self.user_config.current == args.name and
+                        self.user_config.storage_dir and not args.reset):
+                    raise argh.CommandError('storage dir already configured. '
+                                            'pass --reset to override.')
+                storage_dir = args.storage_dir or os.getcwd()
+                self.user_config.current = args.name
+                self.user_config.editable = args.editable
+                self.user_config.storage_dir = storage_dir
             self.user_config.storage_dir.mkdir_p()
             self._create_inputs(args, env_create.get('inputs', {}))
             self.user_config.macros_path.touch()
@@ -252,43 +481,93 @@ class Loader(object):
         self.user_config.inputs_path.write_lines(new_input_lines)
 
     @argh.named('init')
-    def _init_command(self, reset=False):
+    def _init_command(self, reset=False, skip_unchanged=False):
+        with self.storage_lock.exclusive():
+            if not self._init(reset=reset, skip_unchanged=skip_unchanged):
+                return _UNCHANGED
+
+    def _init(self, reset, skip_unchanged=False):
+        # returns whether the env was initialized, it is not when
+        # skip_unchanged is passed and nothing changed since the previous
+        # init
         local_dir = self.user_config.storage_dir / self._name
-        if local_dir.exists():
-            if reset:
-                shutil.rmtree(local_dir)
-            else:
-                raise argh.CommandError('Already initialized, pass --reset '
-                                        'to re-initialize.')
+        if local_dir.exists() and not reset:
+            raise argh.CommandError('Already initialized, pass --reset '
+                                    'to re-initialize.')
         inputs = self.user_config.inputs
+        blueprint = None
+        before_init_func = self.config.hooks.before_init
+        if before_init_func:
+            blueprint = yaml.safe_load(self.config.blueprint_path.text())
+            if self.config.blueprint_dir not in sys.path:
+                sys.path.append(self.config.blueprint_dir)
+            before_init = module.load_attribute(before_init_func)
+            before_init(blueprint=blueprint,
+                        inputs=inputs,
+                        loader=self)
+        fingerprint_path = self.user_config.storage_dir / '.init_fingerprint'
+        resources_fingerprint_path = self._resources_fingerprint_path()
+        # the blueprint dir without the blueprint itself, whose changes show
+        # in the plan
+        resources_fingerprint = cache.dir_fingerprint(
+            self.config.blueprint_dir,
+            exclude=[self.user_config.storage_dir, cache.cache_dir(),
+                     self.config.blueprint_path])
+        fingerprint = cache.sha1(yaml.safe_dump({
+            'blueprint_path': str(self.config.blueprint_path),
+            'blueprint_file': cache.sha1(self.config.blueprint_path.text()),
+            'resources': resources_fingerprint,
+            'blueprint': blueprint,
+            'inputs': inputs,
+            'editable': bool(self.user_config.editable),
+            'ignored_modules': self.config.ignored_modules,
+            'storage': self.config.storage
+        }))
+        if (local_dir.exists() and skip_unchanged and fingerprint_path.exists()
+                and fingerprint_path.text() == fingerprint):
+            return False
+        fingerprint_path.remove_p()
+        resources_fingerprint_path.remove_p()
+        self._invalidate_env()
+        if local_dir.exists():
+            shutil.rmtree(local_dir)
+        # staged in the storage dir which is more likely than the system temp
+        # dir to be on the file system of the blueprint dir
         temp_dir = path(tempfile.mkdtemp(
-            prefix='{}-blueprint-dir-'.format(self.config.name)))
+            prefix='.{}-blueprint-dir-'.format(self.config.name),
+            dir=self.user_config.storage_dir))
         blueprint_dir = temp_dir / 'blueprint'
         try:
-            shutil.copytree(self.config.blueprint_dir, blueprint_dir)
+            _stage_dir(self.config.blueprint_dir, blueprint_dir,
+                       exclude=temp_dir)
             sys.path.append(blueprint_dir)
             blueprint_path = (blueprint_dir /
                               self.config.blueprint_path.basename())
-            before_init_func = self.config.hooks.before_init
-            if before_init_func:
-                blueprint = yaml.safe_load(blueprint_path.text())
-                before_init = module.load_attribute(before_init_func)
-                before_init(blueprint=blueprint,
-                            inputs=inputs,
-                            loader=self)
+            if blueprint is not None:
+                # unlinked first, the staged file may be a hardlink to the
+                # original blueprint
+                blueprint_path.remove()
                 blueprint_path.write_text(yaml.safe_dump(blueprint))
-            local.init_env(blueprint_path=blueprint_path,
-                           inputs=inputs,
-                           name=self._name,
-                           storage=self._storage(),
-                           ignored_modules=self.config.ignored_modules)
+            plan.init_env(blueprint_path=blueprint_path,
+                          inputs=inputs,
+                          name=self._name,
+                          storage=self._storage(),
+                          ignored_modules=self.config.ignored_modules)
         finally:
             shutil.rmtree(temp_dir, ignore_errors=True)
+            # hooks may have loaded the env before storage was replaced
+            self._invalidate_env()
         if self.user_config.editable:
             resources_path = (self.user_config.storage_dir / self._name /
                               'resources')
             shutil.rmtree(resources_path, ignore_errors=True)
             os.symlink(self.config.blueprint_dir, resources_path)
+        fingerprint_path.write_text(fingerprint)
+        resources_fingerprint_path.write_text(resources_fingerprint)
+        return True
+
+    def _resources_fingerprint_path(self):
+        return self.user_config.storage_dir / '.resources_fingerprint'
 
     def _parse_env_subcommands(self):
         configuration_names = self.user_config.configuration_names
@@ -298,17 +577,19 @@ class Loader(object):
 
         @argh.named('use')
         def _use_command(name):
-            if name not in configuration_names:
-                raise argh.CommandError('No such configuration: {}'
-                                        .format(name))
-            self.user_config.current = name
+            with self.user_config.locked():
+                if name not in self.user_config.configuration_names:
+                    raise argh.CommandError('No such configuration: {}'
+                                            .format(name))
+                self.user_config.current = name
         argh.arg('name', completer=name_completer)(_use_command)
 
         @argh.named('remove')
         def _remove_command(name):
-            if name not in configuration_names:
-                raise argh.CommandError('No such configuration: {}')
-            self.user_config.remove_configuration(name)
+            with self.user_config.locked():
+                if name not in self.user_config.configuration_names:
+                    raise argh.CommandError('No such configuration: {}')
+                self.user_config.remove_configuration(name)
         argh.arg('name', completer=name_completer)(_remove_command)
 
         @argh.named('list')
@@ -320,7 +601,10 @@ class Loader(object):
     @argh.named('status')
     def _status_command(self, json=False):
         try:
-            outputs = self.env.outputs()
+            with self.storage_lock.shared():
+                outputs = self.env.outputs()
+        except lock.LockTimeout:
+            raise
         except Exception as e:
             outputs = {'error': str(e)}
         status = {
@@ -336,19 +620,136 @@ class Loader(object):
         else:
             return yaml.safe_dump(status, default_flow_style=False)
 
+    @argh.named('history')
+    @argh.arg('-w', '--workflow')
+    @argh.arg('-n', '--node')
+    @argh.arg('-t', '--event-type')
+    @argh.arg('-s', '--since', help='e.g. 2h, 7d or "2016-01-01 10:00"')
+    @argh.arg('-u', '--until', help='e.g. 2h, 7d or "2016-01-01 10:00"')
+    @argh.arg('-x', '--execution', type=int)
+    @argh.arg('-l', '--limit', type=int)
+    def _history_command(self, workflow=None, node=None, event_type=None,
+                         since=None, until=None, execution=None,
+                         events=False, limit=20, json=False):
+        # lists recorded executions, or their events when events, node,
+        # event_type or execution are passed
+        history_path = self.user_config.storage_dir / history.DB_NAME
+        if not history_path.exists():
+            if not self.config.history:
+                return ('No executions recorded. Set history: true in the '
+                        'config to record them.')
+            return 'No executions recorded.'
+        records = history.History(history_path)
+        since = history.parse_time(since)
+        until = history.parse_time(until)
+        if events or node or event_type or execution:
+            result = records.events(workflow=workflow,
+                                    node=node,
+                                    event_type=event_type,
+                                    since=since,
+                                    until=until,
+                                    execution_id=execution,
+                                    limit=limit)
+            if json:
+                return _json.dumps([dict(event, execution_id=execution_id)
+                                    for execution_id, event in result],
+                                   sort_keys=True, indent=2)
+            from clash import output
+            return '\n'.join('#{} {}'.format(execution_id,
+                                             output.Event(event))
+                             for execution_id, event in result)
+        result = records.executions(workflow=workflow,
+                                    since=since,
+                                    until=until,
+                                    limit=limit)
+        if json:
+            return _json.dumps(result, sort_keys=True, indent=2)
+        return '\n'.join(
+            '#{:<5} {} {:>8.1f}s {:<10} {} ({}), {} events'.format(
+                e['id'],
+                time.strftime('%Y-%m-%d %H:%M:%S',
+                              time.localtime(e['started_at'])),
+                e['ended_at'] - e['started_at'],
+                e['status'],
+                e['workflow'],
+                e['command'],
+                e['event_count'])
+            for e in result)
+
+    @argh.named('migrate-storage')
+    def _migrate_storage_command(self):
+        # moves a deployment kept by the default file storage to the
+        # storage configured in the config
+        from clash import storage
+        if self.config.storage == storage.FILE:
+            raise argh.CommandError('File storage is configured, nothing to '
+                                    'migrate.')
+        with self.storage_lock.exclusive():
+            target = self._storage()
+            if not hasattr(target, 'import_deployment'):
+                raise argh.CommandError('Storage {} does not support '
+                                        'migration.'
+                                        .format(self.config.storage))
+            storage.migrate(self.user_config.storage_dir, self._name, target)
+            self._invalidate_env()
+
     @argh.named('apply')
-    def _apply_command(self, verbose=False):
-        self._init_command(reset=True)
-        user_command = self.config.command_after_init_on_apply
-        if user_command:
-            user_command_func = self.user_commands[user_command]
-            user_command_func(argparse.Namespace(verbose=verbose))
+    def _apply_command(self, verbose=False, force=False, incremental=False,
+                       skip_unchanged=False):
+        with self.storage_lock.exclusive():
+            snapshot = None
+            resources_fingerprint = None
+            # --force applies from scratch
+            if incremental and not force and (self.user_config.storage_dir /
+                                              self._name).exists():
+                try:
+                    snapshot = deployment.Snapshot(self.env)
+                except Exception:
+                    # e.g. a previous init failed midway, apply from scratch
+                    pass
+                resources_fingerprint_path = self._resources_fingerprint_path()
+                if resources_fingerprint_path.exists():
+                    resources_fingerprint = resources_fingerprint_path.text()
+            # an incremental apply skips init when nothing changed, any
+            # apply does when asked to
+            initialized = self._init(
+                reset=True,
+                skip_unchanged=(snapshot is not None or skip_unchanged) and
+                not force)
+            if not initialized and not snapshot:
+                return _UNCHANGED
+            try:
+                if snapshot and not initialized:
+                    self.affected_node_ids = []
+                elif snapshot and resources_fingerprint == (
+                        self._resources_fingerprint_path().text()):
+                    # runtime state of nodes that did not change is kept, the
+                    # command after init gets the nodes that did as node_ids
+                    self.affected_node_ids = deployment.affected_nodes(
+                        snapshot, self.env.plan)
+                    deployment.restore(snapshot, self.env,
+                                       self.affected_node_ids)
+                else:
+                    # a changed script or other resource may be used by any
+                    # node
+                    self.affected_node_ids = sorted(
+                        node['id'] for node in self.env.plan['nodes'])
+                user_command = self.config.command_after_init_on_apply
+                if user_command and snapshot and not self.affected_node_ids:
+                    return 'No node changed, skipping {}.'.format(
+                        user_command)
+                if user_command:
+                    user_command_func = self.user_commands[user_command]
+                    user_command_func(argparse.Namespace(verbose=verbose))
+            finally:
+                self.affected_node_ids = None
 
     def _add_args_to_func(self, func, args, skip_env):
         for arg in reversed(args):
+            arg = dict(arg)
             name = arg.pop('name')
             completer = arg.pop('completer', None)
-            if completer:
+            if completer and self._load_completers:
                 completer = module.load_attribute(completer)
                 completer = Completer(None if skip_env else self._load_env,
                                       completer)
@@ -356,9 +757,85 @@ class Loader(object):
             name = name if isinstance(name, list) else [name]
             argh.arg(*name, **arg)(func)
 
-    def dispatch(self):
+    @argh.named('shell')
+    def _shell_command(self):
+        from clash import shell
+        shell.Shell(self).loop()
+
+    @argh.named('batch')
+    @argh.arg('script', nargs='?', default='-')
+    def _batch_command(self, script, keep_going=False):
+        # one command per line, read from stdin if script is -
+        from clash import shell
+        batch = shell.Batch(self)
+        if script == '-':
+            succeeded = batch.run(sys.stdin, keep_going=keep_going)
+        else:
+            with open(script) as f:
+                succeeded = batch.run(f, keep_going=keep_going)
+        if not succeeded:
+            raise argh.CommandError('batch failed')
+
+    def reload(self, argv=None):
+        # rebuild the parser, re-reading the command tree and macros, for
+        # processes that dispatch many commands. all commands are built
+        # unless argv is passed
+        self._argv = argv
+        self._selected = None if argv is None else _selected_path(argv)
+        self.user_commands = _LazyCommands()
+        self._step_parsers = {}
+        self._invalidate_env()
+        module.invalidate()
+        self._start_preload()
+        self._parser = self._build_parser()
+
+    def _start_preload(self):
+        if not self.config.preload:
+            return
+        # references may point at modules in the storage dir and the staged
+        # blueprint resources, so nothing is preloaded before init
+        storage_dir = self.user_config.storage_dir
+        if not storage_dir or not (storage_dir / self._name /
+                                   'resources').isdir():
+            return
+        self._set_paths()
+        references = set()
+        _attribute_references(self.config.commands, references)
+        _attribute_references(self.user_config.macros, references)
+        # before_init is only used by init, which runs before the resources
+        # are staged
+        references.update(r for r in [self.config.hooks.after_env_create,
+                                      self.config.event_cls] if r)
+        self._preload = module.Preload(references)
+
+    def _check_preload(self):
+        if not self._preload:
+            return
+        errors = self._preload.wait()
+        self._preload = None
+        # failed references are not cached, they are imported again (and
+        # fail) only if the command uses them
+        if errors:
+            sys.stderr.write(
+                'warning: Failed preloading referenced attributes:\n{}\n'
+                .format('\n'.join('  {}: {}: {}'.format(
+                    reference, type(e).__name__, e)
+                    for reference, e in sorted(errors.items()))))
+
+    def dispatch(self, argv=None):
+        if argv is None:
+            argv = self._argv
+        if completion.requested(argv):
+            completion.autocomplete(index=self._completion_index(),
+                                    parser_factory=lambda: self.parser)
+        self._check_preload()
+        try:
+            parser = self.parser
+        except argh.CommandError as e:
+            sys.exit('error: {}'.format(e))
         errors = StringIO.StringIO()
-        self._parser.dispatch(errors_file=errors)
+        with self.user_config.transaction(), functions.invocation():
+            parser.dispatch(argv=argv, errors_file=errors)
         errors_value = errors.getvalue()
         if errors_value:
             errors_value = errors_value.replace('CommandError',
@@ -367,10 +844,197 @@ class Loader(object):
 
 
 def dispatch(config_path):
-    loader = Loader(config_path=config_path)
+    argv = sys.argv[1:]
+    # shell and batch read stdin and already run many commands in one
+    # process, they are never forwarded
+    if (daemon.enabled() and not completion.requested() and
+            argv[:1] not in (['shell'], ['batch'])):
+        code = daemon.forward(config_path, argv)
+        if code is not None:
+            sys.exit(code)
+    try:
+        loader = Loader(config_path=config_path)
+    except argh.CommandError as e:
+        sys.exit('error: {}'.format(e))
     loader.dispatch()
 
 
+_NO_HARDLINK_ERRNOS = [errno.EXDEV, errno.EPERM, errno.EMLINK,
+                       errno.EOPNOTSUPP]
+
+_BUILTIN_COMMANDS = ['init', 'status', 'history', 'apply', 'migrate-storage',
+                     'env', 'shell', 'batch']
+
+_UNCHANGED = ('Blueprint, inputs and before_init output are unchanged since '
+              'the last init, skipping.')
+
+
+def _stage_dir(source, target, exclude=None):
+    # like shutil.copytree, except that files are hardlinked. files are
+    # copied once hardlinks turn out to be unsupported (e.g. across file
+    # systems)
+    source = path(source)
+    link = True
+    for root, dirs, files in os.walk(source, followlinks=True):
+        root = path(root)
+        if exclude:
+            dirs[:] = [d for d in dirs if (root / d).realpath() !=
+                       path(exclude).realpath()]
+        target_root = target / source.relpathto(root)
+        target_root.makedirs_p()
+        for name in files:
+            source_file = (root / name).realpath()
+            target_file = target_root / name
+            if link:
+                try:
+                    os.link(source_file, target_file)
+                    continue
+                except OSError as e:
+                    if e.errno not in _NO_HARDLINK_ERRNOS:
+                        raise
+                    link = False
+            shutil.copy2(source_file, target_file)
+
+
+def _attribute_references(value, references):
+    # function commands, completers and func intrinsics with a static name
+    if isinstance(value, dict):
+        for key, item in value.items():
+            is_reference = isinstance(item, basestring)
+            if key in ('function', 'completer') and is_reference:
+                references.add(item)
+            elif (key == 'func' and isinstance(item, dict) and
+                  isinstance(item.get('name'), basestring)):
+                references.add(item['name'])
+            _attribute_references(item, references)
+    elif isinstance(value, list):
+        for item in value:
+            _attribute_references(item, references)
+
+
+def _builtin_command_sources():
+    return [path(os.path.splitext(m.__file__)[0] + '.py')
+            for m in [sys.modules[__name__], completion]]
+
+
+def _check_builtin_names(tree):
+    # argh registers the built-in commands last, a user command, macro or
+    # namespace with the same name would be silently shadowed
+    names = set()
+    for namespace in tree:
+        if namespace['namespace']:
+            names.add(namespace['namespace'])
+        else:
+            names.update(name for name, _ in
+                         namespace['commands'] + namespace['macros'])
+    conflicts = names & set(_BUILTIN_COMMANDS)
+    if conflicts:
+        raise argh.CommandError(
+            'Commands, macros and namespaces may not use the name of a '
+            'built-in command: {}'.format(', '.join(sorted(conflicts))))
+
+
+def _command_tree(commands, macros, namespace=None, tree=None):
+    if tree is None:
+        tree = []
+    namespace_commands = []
+    namespace_macros = []
+    for name, command in commands.items():
+        if 'workflow' not in command and 'function' not in command:
+            _command_tree(commands=command, macros=macros.get(name, {}),
+                          namespace=name, tree=tree)
+            continue
+        namespace_commands.append([name, command])
+    for name, macro in macros.items():
+        if 'commands' not in macro:
+            if name in commands:
+                # namespace already handled by existing commands namespace
+                continue
+            _command_tree(commands={}, macros=macro, namespace=name,
+                          tree=tree)
+            continue
+        namespace_macros.append([name, macro])
+    tree.append({
+        'namespace': namespace,
+        'commands': namespace_commands,
+        'macros': namespace_macros
+    })
+    return tree
+
+
+class _Lazy(object):
+
+    def __init__(self, factory, **kwargs):
+        self._factory = factory
+        self._kwargs = kwargs
+        self._result = None
+
+    def get(self):
+        if self._result is None:
+            self._result = self._factory(**self._kwargs)
+        return self._result
+
+
+class _LazyCommands(dict):
+
+    def __getitem__(self, name):
+        return super(_LazyCommands, self).__getitem__(name).get()
+
+
+def _namespace(parser, name, kwargs):
+    kwargs = {key.lstrip('-').replace('-', '_'): value
+              for key, value in kwargs.items()}
+    namespace = argparse.Namespace()
+    dests = set()
+    for action in parser._actions:
+        if action.dest in (argparse.SUPPRESS, 'help'):
+            continue
+        dests.add(action.dest)
+        if action.required and action.dest not in kwargs:
+            raise argh.CommandError('{}: missing argument: {}'
+                                    .format(name, action.dest))
+        if action.default is not argparse.SUPPRESS:
+            setattr(namespace, action.dest, action.default)
+    unknown = set(kwargs) - dests
+    if unknown:
+        raise argh.CommandError('{}: unknown arguments: {}'
+                                .format(name, ', '.join(sorted(unknown))))
+    for key, value in kwargs.items():
+        setattr(namespace, key, value)
+    return namespace
+
+
+def _write_result(result):
+    # same output argh produces when dispatching a command
+    if result is None:
+        return
+    if not isinstance(result, (types.GeneratorType, list, tuple)):
+        result = [result]
+    for line in result:
+        sys.stdout.write('{}\n'.format(line))
+
+
+def _stub(name):
+    @argh.named(name)
+    def stub():
+        pass
+    return stub
+
+
+def _selected_path(argv):
+    if argv is None:
+        if '_ARGCOMPLETE' in os.environ:
+            comp_words = argcomplete.split_line(
+                os.environ['COMP_LINE'], int(os.environ['COMP_POINT']))[3]
+            argv = comp_words[int(os.environ['_ARGCOMPLETE']):]
+        else:
+            argv = sys.argv[1:]
+    if argv[:1] == ['help']:
+        argv = argv[1:]
+    selected = itertools.takewhile(lambda arg: not arg.startswith('-'), argv)
+    return list(selected)[:2]
+
+
 class Completer(object):
 
     def __init__(self, env_loader, completer):
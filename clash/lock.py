@@ -0,0 +1,115 @@
+########
+# Copyright (c) 2016 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+############
+
+import errno
+import fcntl
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import argh
+from path import path
+
+LOCK_TIMEOUT = 'CLASH_LOCK_TIMEOUT'
+
+_POLL_INTERVAL = 0.1
+
+
+class LockTimeout(argh.CommandError):
+    pass
+
+
+def lock_timeout(default=None):
+    # None waits forever, 0 fails immediately if the lock is held
+    value = os.environ.get(LOCK_TIMEOUT, default)
+    if value is None or value == '':
+        return None
+    return float(value)
+
+
+class FileLock(object):
+
+    def __init__(self, lock_path, timeout=None):
+        self.lock_path = path(lock_path)
+        self.timeout = timeout
+        self._fd = None
+        self._mode = None
+        self._holders = {fcntl.LOCK_SH: 0, fcntl.LOCK_EX: 0}
+        self._lock = threading.RLock()
+
+    @contextmanager
+    def shared(self):
+        with self._acquire(fcntl.LOCK_SH):
+            yield
+
+    @contextmanager
+    def exclusive(self):
+        with self._acquire(fcntl.LOCK_EX):
+            yield
+
+    @contextmanager
+    def _acquire(self, mode):
+        # reentrant within a process: nested acquisitions (and other threads
+        # of the same command) reuse the held lock, upgrading a shared lock
+        # to an exclusive one while an exclusive holder exists
+        with self._lock:
+            if self._mode is None:
+                self._fd = os.open(self.lock_path,
+                                   os.O_RDWR | os.O_CREAT, 0o644)
+            if self._mode != fcntl.LOCK_EX and self._mode != mode:
+                try:
+                    self._flock(mode)
+                except Exception:
+                    if self._mode is None:
+                        self._close()
+                    raise
+                self._mode = mode
+            self._holders[mode] += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._holders[mode] -= 1
+                if not any(self._holders.values()):
+                    self._close()
+                elif (self._mode == fcntl.LOCK_EX and
+                        not self._holders[fcntl.LOCK_EX]):
+                    self._flock(fcntl.LOCK_SH)
+                    self._mode = fcntl.LOCK_SH
+
+    def _flock(self, mode):
+        if self.timeout is None:
+            fcntl.flock(self._fd, mode)
+            return
+        deadline = time.time() + self.timeout
+        while True:
+            try:
+                fcntl.flock(self._fd, mode | fcntl.LOCK_NB)
+                return
+            except IOError as e:
+                if e.errno not in (errno.EAGAIN, errno.EACCES):
+                    raise
+            if time.time() >= deadline:
+                raise LockTimeout(
+                    '{} is held by another clash process (set {} to wait '
+                    'longer)'.format(self.lock_path, LOCK_TIMEOUT))
+            time.sleep(_POLL_INTERVAL)
+
+    def _close(self):
+        os.close(self._fd)
+        self._fd = None
+        self._mode = None
@@ -0,0 +1,191 @@
+########
+# Copyright (c) 2016 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+############
+
+import Queue
+import sys
+import threading
+from contextlib import contextmanager
+
+import argh
+
+from clash import threads
+
+_POLL_INTERVAL = 0.1
+
+
+def is_parallel(macro):
+    return 'concurrency' in macro or any('depends_on' in command
+                                         for command in macro['commands'])
+
+
+class Step(object):
+
+    def __init__(self, step_id, depends_on, prepare, run):
+        self.id = step_id
+        self.depends_on = depends_on
+        # prepare is called from the dispatching thread once all
+        # dependencies completed, its result is passed to run on a worker
+        self.prepare = prepare
+        self.run = run
+
+
+def run(steps, concurrency=None):
+    _validate(steps)
+    if concurrency is not None and concurrency < 1:
+        raise argh.CommandError('Macro concurrency must be at least 1, got '
+                                '{}'.format(concurrency))
+    concurrency = concurrency or len(steps)
+    pending = list(steps)
+    completed = set()
+    finished = Queue.Queue()
+    running = 0
+    error = None
+    with _prefixed_stdout() as output:
+        while pending or running:
+            if error is None:
+                ready = [step for step in pending
+                         if completed.issuperset(step.depends_on)]
+                for step in ready[:concurrency - running]:
+                    pending.remove(step)
+                    try:
+                        prepared = step.prepare()
+                    except Exception:
+                        error = sys.exc_info()
+                        break
+                    thread = threading.Thread(
+                        target=_run_step,
+                        args=(step, prepared, output, finished))
+                    thread.daemon = True
+                    thread.start()
+                    running += 1
+            if not running:
+                break
+            try:
+                step, exc_info = finished.get(timeout=_POLL_INTERVAL)
+            except Queue.Empty:
+                continue
+            running -= 1
+            if exc_info:
+                # fail fast: steps already running are waited for, no new
+                # steps are started
+                error = error or exc_info
+            else:
+                completed.add(step.id)
+    if error:
+        raise error[0], error[1], error[2]
+
+
+def _run_step(step, prepared, output, finished):
+    output.set_prefix('[{}] '.format(step.id))
+    try:
+        step.run(prepared)
+        exc_info = None
+    except BaseException:
+        exc_info = sys.exc_info()
+    finally:
+        output.set_prefix(None)
+    finished.put((step, exc_info))
+
+
+def _validate(steps):
+    ids = [step.id for step in steps]
+    duplicates = sorted(set(i for i in ids if ids.count(i) > 1))
+    if duplicates:
+        raise argh.CommandError('Duplicate macro step ids: {}. Set an id on '
+                                'steps that run the same command.'
+                                .format(', '.join(duplicates)))
+    for step in steps:
+        missing = [d for d in step.depends_on if d not in ids]
+        if missing:
+            raise argh.CommandError('Macro step {} depends on unknown steps: '
+                                    '{}'.format(step.id, ', '.join(missing)))
+    resolved = set()
+    remaining = list(steps)
+    while remaining:
+        ready = [s for s in remaining if resolved.issuperset(s.depends_on)]
+        if not ready:
+            raise argh.CommandError(
+                'Macro steps have circular dependencies: {}'.format(
+                    ', '.join(s.id for s in remaining)))
+        for step in ready:
+            remaining.remove(step)
+            resolved.add(step.id)
+
+
+@contextmanager
+def _prefixed_stdout():
+    stdout = sys.stdout
+    output = _PrefixedOutput(stdout)
+    sys.stdout = output
+    try:
+        # threads started by a step (e.g. the task thread pool of a
+        # workflow) write with the step's prefix
+        with threads.inheriting(output.capture):
+            yield output
+    finally:
+        sys.stdout = stdout
+
+
+class _PrefixedOutput(object):
+
+    def __init__(self, stream):
+        self._stream = stream
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def set_prefix(self, prefix):
+        if prefix is None:
+            self._write_line(getattr(self._local, 'line', ''))
+        self._local.prefix = prefix
+        self._local.line = ''
+
+    def capture(self):
+        prefix = getattr(self._local, 'prefix', None)
+        if prefix is None:
+            return None
+        return self._prefixed(prefix)
+
+    @contextmanager
+    def _prefixed(self, prefix):
+        self.set_prefix(prefix)
+        try:
+            yield
+        finally:
+            self.set_prefix(None)
+
+    def write(self, data):
+        prefix = getattr(self._local, 'prefix', None)
+        if prefix is None:
+            with self._lock:
+                self._stream.write(data)
+            return
+        lines = (self._local.line + data).split('\n')
+        self._local.line = lines.pop()
+        for line in lines:
+            self._write_line(line + '\n')
+
+    def _write_line(self, line):
+        if not line:
+            return
+        with self._lock:
+            self._stream.write('{}{}'.format(self._local.prefix, line))
+            self._stream.flush()
+
+    def flush(self):
+        self._stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
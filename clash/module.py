@@ -15,9 +15,82 @@
 ############
 
 import importlib
+import os
+import sys
+import threading
+
+_attributes = {}
+# module name -> modification time of its source when it was imported
+_modules = {}
 
 
 def load_attribute(attribute_path):
+    try:
+        return _attributes[attribute_path]
+    except KeyError:
+        pass
     module, attr = attribute_path.split(':')
-    module = importlib.import_module(module)
-    return getattr(module, attr)
+    module_name = module
+    module = importlib.import_module(module_name)
+    _modules.setdefault(module_name, _mtime(module))
+    attribute = getattr(module, attr)
+    _attributes[attribute_path] = attribute
+    return attribute
+
+
+def invalidate():
+    # for processes that dispatch many commands (shell, batch, daemon), so
+    # that edited modules of referenced attributes are picked up
+    _attributes.clear()
+    for module_name, mtime in list(_modules.items()):
+        module = sys.modules.get(module_name)
+        if module is None:
+            del _modules[module_name]
+            continue
+        current_mtime = _mtime(module)
+        if current_mtime == mtime:
+            continue
+        del _modules[module_name]
+        try:
+            reload(module)
+        except Exception:
+            # imported again, and failing, when an attribute is used
+            del sys.modules[module_name]
+            continue
+        _modules[module_name] = current_mtime
+
+
+def _mtime(module):
+    module_path = getattr(module, '__file__', None)
+    if not module_path:
+        return None
+    source_path = '{}.py'.format(os.path.splitext(module_path)[0])
+    try:
+        return os.path.getmtime(source_path)
+    except OSError:
+        return None
+
+
+class Preload(object):
+
+    # loads attributes in a background thread, e.g. while the parser is
+    # built, so that bad references are known before a command runs
+
+    def __init__(self, attribute_paths):
+        self.errors = {}
+        self._thread = threading.Thread(target=self._load,
+                                        args=(sorted(set(attribute_paths)),))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _load(self, attribute_paths):
+        for attribute_path in attribute_paths:
+            try:
+                load_attribute(attribute_path)
+            except Exception as e:
+                self.errors[attribute_path] = e
+
+    def wait(self):
+        # returns the errors, keyed by attribute path
+        self._thread.join()
+        return self.errors
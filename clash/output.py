@@ -14,11 +14,22 @@
 # limitations under the License.
 ############
 
+import Queue
+import json
+import logging
+import os
+import sys
+import threading
+
+import argh
 import colors
 
+from contextlib import contextmanager
+
 from cloudify import logs
 
 from clash import module
+from clash import threads
 
 _task_event_color = {
     'workflow_started': 13,
@@ -39,152 +50,256 @@ _log_level_color = {
     'info': 'green'
 }
 
+LIVE = 'live'
+
+# (running, succeeded, failed) deltas per task event type
+_task_transitions = {
+    'task_started': (1, 0, 0),
+    'task_succeeded': (-1, 1, 0),
+    'task_failed': (-1, 0, 1),
+    'task_rescheduled': (-1, 0, 0),
+}
+
+_CLEAR_LINE = '\r\x1b[K'
+
+
+class Event(object):
 
-class Event(dict):
+    # a mapping view of the raw event, which is referenced, not copied. the
+    # context is looked up once, accessors read from it. the raw event is
+    # shared with the other handlers of the event, it is only copied when
+    # the view is changed, e.g. by event_cls subclasses
+
+    __slots__ = ('_event', '_context', '_copied')
 
     def __init__(self, event):
-        self.update(event)
+        self._event = event
+        self._context = event.get('context') or {}
+        self._copied = False
 
     def __str__(self):
         operation = self.operation
         if operation:
             operation = operation.split('.')[-1]
-            operation = colors.magenta(operation)
+            operation = _color(operation, 'magenta')
         if self.source_node_name:
-            source_name = colors.cyan(self.source_node_name)
-            target_name = colors.cyan(self.target_node_name)
+            source_name = _color(self.source_node_name, 'cyan')
+            target_name = _color(self.target_node_name, 'cyan')
             context = '{}->{}|{}'.format(source_name, target_name, operation)
         elif self.node_name:
-            node_name = colors.cyan(self.node_name)
+            node_name = _color(self.node_name, 'cyan')
             context = node_name
             if operation:
                 context = '{}.{}'.format(node_name, operation)
         else:
-            context = colors.cyan(self.workflow_id)
-        message = colors.color(
-            self.message,
-            fg=_task_event_color.get(self.event_type, 15))
+            context = _color(self.workflow_id, 'cyan')
+        message = _color(self.message,
+                         _task_event_color.get(self.event_type, 15))
         if self.level:
-            level = colors.color(
-                self.level.upper(),
-                fg=_log_level_color.get(self.level, 15))
+            level = _color(self.level.upper(),
+                           _log_level_color.get(self.level, 15))
             message = '{}: {}'.format(level, message)
         return '[{}] {}'.format(context, message)
 
+    def __getitem__(self, key):
+        return self._event[key]
+
+    def __contains__(self, key):
+        return key in self._event
+
+    def __iter__(self):
+        return iter(self._event)
+
+    def __len__(self):
+        return len(self._event)
+
+    def __eq__(self, other):
+        return self._event == (other._event if isinstance(other, Event)
+                               else other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def get(self, key, default=None):
+        return self._event.get(key, default)
+
+    def keys(self):
+        return self._event.keys()
+
+    def values(self):
+        return self._event.values()
+
+    def items(self):
+        return self._event.items()
+
+    def __setitem__(self, key, value):
+        self._writable()[key] = value
+        self._update_context()
+
+    def __delitem__(self, key):
+        del self._writable()[key]
+        self._update_context()
+
+    def update(self, *args, **kwargs):
+        self._writable().update(*args, **kwargs)
+        self._update_context()
+
+    def setdefault(self, key, default=None):
+        value = self._writable().setdefault(key, default)
+        self._update_context()
+        return value
+
+    def pop(self, key, *default):
+        value = self._writable().pop(key, *default)
+        self._update_context()
+        return value
+
+    def copy(self):
+        return self.as_dict()
+
+    def as_dict(self):
+        # a plain dict copy, e.g. for json.dumps
+        return dict(self._event)
+
+    def _writable(self):
+        if not self._copied:
+            self._event = dict(self._event)
+            self._copied = True
+        return self._event
+
+    def _update_context(self):
+        self._context = self._event.get('context') or {}
+
     @property
     def context(self):
-        return self.get('context', {})
+        return self._context
 
     @property
-    def blueprint_id(self):
-        return self.context.get('blueprint_id')
+    def operation(self):
+        return self._context.get('operation')
 
     @property
-    def deployment_id(self):
-        return self.context.get('deployment_id')
+    def node_name(self):
+        return self._context.get('node_name')
 
     @property
-    def execution_id(self):
-        return self.context.get('execution_id')
+    def source_node_name(self):
+        return self._context.get('source_name')
+
+    @property
+    def target_node_name(self):
+        return self._context.get('target_name')
 
     @property
     def workflow_id(self):
-        return self.context.get('workflow_id')
+        return self._context.get('workflow_id')
+
+    @property
+    def event_type(self):
+        return self._event.get('event_type')
+
+    @property
+    def level(self):
+        return self._event.get('level')
+
+    @property
+    def blueprint_id(self):
+        return self._context.get('blueprint_id')
+
+    @property
+    def deployment_id(self):
+        return self._context.get('deployment_id')
+
+    @property
+    def execution_id(self):
+        return self._context.get('execution_id')
 
     @property
     def task_id(self):
-        return self.context.get('task_id')
+        return self._context.get('task_id')
 
     @property
     def task_name(self):
-        return self.context.get('task_name')
+        return self._context.get('task_name')
 
     @property
     def task_target(self):
-        return self.context.get('task_target')
-
-    @property
-    def operation(self):
-        return self.context.get('operation')
+        return self._context.get('task_target')
 
     @property
     def plugin(self):
-        return self.context.get('plugin')
+        return self._context.get('plugin')
 
     @property
     def node_instance_id(self):
-        return self.context.get('node_id')
+        return self._context.get('node_id')
 
     @property
     def node_id(self):
         return self.node_name
 
-    @property
-    def node_name(self):
-        return self.context.get('node_name')
-
     @property
     def source_node_instance_id(self):
-        return self.context.get('source_id')
+        return self._context.get('source_id')
 
     @property
     def source_node_id(self):
-        return self.source_node_id
-
-    @property
-    def source_node_name(self):
-        return self.context.get('source_name')
+        return self.source_node_name
 
     @property
     def target_node_instance_id(self):
-        return self.context.get('target_id')
+        return self._context.get('target_id')
 
     @property
     def target_node_id(self):
         return self.target_node_name
 
-    @property
-    def target_node_name(self):
-        return self.context.get('target_name')
-
     @property
     def logger(self):
-        return self.get('logger')
-
-    @property
-    def level(self):
-        return self.get('level')
+        return self._event.get('logger')
 
     @property
     def message(self):
-        return self.get('message', {}).get('text', '').encode('utf-8')
+        message = self._event.get('message') or {}
+        return message.get('text', '').encode('utf-8')
 
     @property
     def timestamp(self):
-        return self.get('@timestamp') or self.get('timestamp')
+        return self._event.get('@timestamp') or self._event.get('timestamp')
 
     @property
     def message_code(self):
-        return self.get('message_code')
+        return self._event.get('message_code')
 
     @property
     def type(self):
-        return self.get('type')
-
-    @property
-    def event_type(self):
-        return self.get('event_type')
+        return self._event.get('type')
 
     @property
     def task_current_retries(self):
-        return self.context.get('task_current_retries')
+        return self._context.get('task_current_retries')
 
     @property
     def task_total_retries(self):
-        return self.context.get('task_total_retries')
+        return self._context.get('task_total_retries')
+
+
+def _color(text, fg):
+    # escape sequences are computed by colors once per color
+    try:
+        prefix, suffix = _color_escapes[fg]
+    except KeyError:
+        prefix, suffix = colors.color('\0', fg=fg).split('\0')
+        _color_escapes[fg] = prefix, suffix
+    return '%s%s%s' % (prefix, text, suffix)
+
+
+_color_escapes = {}
 
 
-def setup_output(event_cls, verbose, env, command):
+def setup_output(event_cls, verbose, env, command, event_types=None,
+                 log_level=None, mode=None, refresh_interval=None,
+                 event_log=None, sinks=()):
     if event_cls is None:
         event_cls = Event
     else:
@@ -193,9 +308,435 @@ def setup_output(event_cls, verbose, env, command):
             event_cls = event_cls.factory(env=env,
                                           verbose=verbose,
                                           command=command)
-    logs.EVENT_CLASS = event_cls
 
+    # filters replace the output functions, events and logs they reject
+    # are never passed to EVENT_CLASS. the original functions are restored
+    # when no filtering is needed, for processes that run several commands
+    # (e.g. clash shell)
+    close_output()
+    _hook_send_event()
+    stdout_event_out = _unfiltered(logs.stdout_event_out)
+    stdout_log_out = _unfiltered(logs.stdout_log_out)
+    renderer = None
+    if mode == LIVE:
+        renderer = _LiveRenderer(refresh_interval or 0.2)
+        stdout_event_out = _Rendered(stdout_event_out, renderer,
+                                     'cloudify_event')
+        stdout_log_out = _Rendered(stdout_log_out, renderer, 'cloudify_log')
+    elif mode is not None:
+        raise argh.CommandError('Unknown output mode: {}'.format(mode))
     if not verbose:
-        def stub(*_):
-            pass
-        logs.stdout_event_out = stub
+        stdout_event_out = _EventFilter(stdout_event_out, event_types=())
+    elif event_types is not None:
+        stdout_event_out = _EventFilter(stdout_event_out, event_types)
+    if renderer:
+        # task events are counted before they are filtered
+        stdout_event_out = _TaskCounter(stdout_event_out, renderer)
+    if log_level is not None:
+        stdout_log_out = _LogFilter(stdout_log_out, log_level)
+    # sinks (objects with put) record every event and log, shown or not
+    sinks = list(sinks)
+    sink = None
+    if event_log is not None:
+        sink = EventSink(**event_log)
+        sinks.append(sink)
+    if sinks:
+        stdout_event_out = _Recorded(stdout_event_out, sinks,
+                                     'cloudify_event')
+        stdout_log_out = _Recorded(stdout_log_out, sinks, 'cloudify_log')
+    if _per_thread:
+        # a parallel macro step, the dispatchers installed by per_thread
+        # pass the events and logs of this thread to its own functions
+        _local.output = _Output(event_cls, stdout_event_out,
+                                stdout_log_out, renderer, sink)
+    else:
+        logs.EVENT_CLASS = event_cls
+        logs.stdout_event_out = stdout_event_out
+        logs.stdout_log_out = stdout_log_out
+    global _renderer, _sink
+    if renderer:
+        if not _per_thread:
+            _renderer = renderer
+        renderer.start()
+    if sink:
+        if not _per_thread:
+            _sink = sink
+        sink.start()
+
+
+def close_output():
+    # writes what the renderer and event sink (if any) still buffer and
+    # stops them. within a parallel macro step, only those of the step
+    thread_output = getattr(_local, 'output', None)
+    if thread_output is not None:
+        _local.output = None
+        thread_output.close()
+        return
+    global _renderer, _sink
+    renderer, _renderer = _renderer, None
+    sink, _sink = _sink, None
+    if renderer:
+        renderer.close()
+    if sink:
+        sink.close()
+
+
+class EventSink(object):
+
+    # events are queued by the task threads and written as json lines by a
+    # background thread. when the queue is full, events are dropped rather
+    # than block the workflow, and the number dropped is recorded when the
+    # sink is closed. the file is rotated when it reaches max_bytes
+
+    def __init__(self, path, max_bytes=10 * 1024 * 1024, backup_count=5,
+                 queue_size=10000):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.dropped = 0
+        self._queue = Queue.Queue(maxsize=queue_size)
+        self._file = None
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+
+    def put(self, item):
+        try:
+            self._queue.put_nowait(item)
+        except Queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+
+    def _run(self):
+        parent = os.path.dirname(self.path)
+        if parent and not os.path.isdir(parent):
+            os.makedirs(parent)
+        self._file = open(self.path, 'a')
+        try:
+            closed = False
+            while not closed:
+                items = [self._queue.get()]
+                # whatever else is queued is written along with it
+                while True:
+                    try:
+                        items.append(self._queue.get_nowait())
+                    except Queue.Empty:
+                        break
+                if None in items:
+                    closed = True
+                    items = [i for i in items if i is not None]
+                    if self.dropped:
+                        items.append({'type': 'clash_events_dropped',
+                                      'count': self.dropped})
+                for item in items:
+                    self._write(json.dumps(item, default=str) + '\n')
+                self._file.flush()
+        finally:
+            self._file.close()
+
+    def _write(self, line):
+        if (self.max_bytes and self._file.tell() and
+                self._file.tell() + len(line) > self.max_bytes):
+            self._rotate()
+        self._file.write(line)
+
+    def _rotate(self):
+        self._file.close()
+        for index in range(self.backup_count - 1, 0, -1):
+            source = '{}.{}'.format(self.path, index)
+            if os.path.exists(source):
+                os.rename(source, '{}.{}'.format(self.path, index + 1))
+        if self.backup_count:
+            os.rename(self.path, '{}.1'.format(self.path))
+        else:
+            os.remove(self.path)
+        self._file = open(self.path, 'a')
+
+
+class _OutFunc(object):
+
+    def __init__(self, out_func):
+        self.out_func = out_func
+
+
+class _EventFilter(_OutFunc):
+
+    def __init__(self, out_func, event_types):
+        super(_EventFilter, self).__init__(out_func)
+        self.event_types = frozenset(event_types)
+
+    def accepts(self, event_type):
+        return event_type in self.event_types
+
+    def __call__(self, event):
+        if self.accepts(event.get('event_type')):
+            self.out_func(event)
+
+
+class _LogFilter(_OutFunc):
+
+    def __init__(self, out_func, log_level):
+        super(_LogFilter, self).__init__(out_func)
+        self.log_level = _level_number(log_level)
+
+    def __call__(self, log):
+        if _level_number(log.get('level')) >= self.log_level:
+            self.out_func(log)
+
+
+def _level_number(level):
+    number = logging.getLevelName(str(level).upper())
+    return number if isinstance(number, int) else logging.NOTSET
+
+
+class _TaskCounter(_OutFunc):
+
+    def __init__(self, out_func, renderer):
+        super(_TaskCounter, self).__init__(out_func)
+        self.renderer = renderer
+
+    def __call__(self, event):
+        self.renderer.count(event)
+        self.out_func(event)
+
+
+class _Rendered(_OutFunc):
+
+    # out_func is the replaced output function, kept to be restored
+
+    def __init__(self, out_func, renderer, message_type):
+        super(_Rendered, self).__init__(out_func)
+        self.renderer = renderer
+        self.message_type = message_type
+
+    def __call__(self, item):
+        self.renderer.write(item, self.message_type)
+
+
+class _Recorded(_OutFunc):
+
+    def __init__(self, out_func, sinks, message_type):
+        super(_Recorded, self).__init__(out_func)
+        self.sinks = sinks
+        self.message_type = message_type
+
+    def __call__(self, item):
+        # output functions add the same base fields, sinks get a copy so
+        # writer threads don't read a dict that is being updated
+        logs.populate_base_item(item, self.message_type)
+        for sink in self.sinks:
+            sink.put(dict(item))
+        self.out_func(item)
+
+
+class _LiveRenderer(object):
+
+    # rendered lines are buffered and written in a single write per
+    # refresh interval. on a terminal they are followed by a summary line
+    # of task counts per node, which is rewritten in place
+
+    def __init__(self, refresh_interval, stream=None):
+        self.refresh_interval = refresh_interval
+        self.stream = stream or sys.stdout
+        isatty = getattr(self.stream, 'isatty', None)
+        self.live = bool(isatty and isatty())
+        self._lines = []
+        # node name -> [running, succeeded, failed]
+        self._tasks = {}
+        self._lock = threading.Lock()
+        self._shown_summary = None
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+
+    def write(self, item, message_type):
+        logs.populate_base_item(item, message_type)
+        line = logs.create_event_message_prefix(item)
+        with self._lock:
+            self._lines.append(line)
+
+    def count(self, event):
+        transition = _task_transitions.get(event.get('event_type'))
+        node_name = (event.get('context') or {}).get('node_name')
+        if not transition or not node_name:
+            return
+        with self._lock:
+            counts = self._tasks.setdefault(node_name, [0, 0, 0])
+            for index, delta in enumerate(transition):
+                counts[index] += delta
+
+    def summary(self):
+        with self._lock:
+            tasks = sorted(self._tasks.items())
+        if not tasks:
+            return ''
+        totals = [sum(counts[i] for _, counts in tasks) for i in range(3)]
+        return 'running {}, succeeded {}, failed {} | {}'.format(
+            totals[0], totals[1], totals[2],
+            ' '.join('{}:{}/{}/{}'.format(node_name, *counts)
+                     for node_name, counts in tasks))
+
+    def flush(self):
+        with self._lock:
+            lines, self._lines = self._lines, []
+        summary = self.summary() if self.live else None
+        if not lines and summary == self._shown_summary:
+            return
+        chunks = []
+        if self._shown_summary:
+            chunks.append(_CLEAR_LINE)
+        chunks.extend('{}\n'.format(line) for line in lines)
+        if summary:
+            chunks.append(summary)
+        self._shown_summary = summary
+        self.stream.write(''.join(chunks))
+        self.stream.flush()
+
+    def close(self):
+        self._closed.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        self.flush()
+        summary = self.summary()
+        if self._shown_summary:
+            self.stream.write(_CLEAR_LINE)
+        if summary:
+            self.stream.write('{}\n'.format(summary))
+        self._shown_summary = None
+        self.stream.flush()
+
+    def _run(self):
+        while not self._closed.wait(self.refresh_interval):
+            self.flush()
+
+
+@contextmanager
+def per_thread():
+    # for parallel macro steps: each thread that sets up output gets its own
+    # output functions, renderer and event sink, which threads it starts
+    # (e.g. the task thread pool of a workflow) inherit. threads that set
+    # up nothing keep using the output in place when entering
+    global _per_thread
+    event_cls = logs.EVENT_CLASS
+    stdout_event_out = logs.stdout_event_out
+    stdout_log_out = logs.stdout_log_out
+    logs.EVENT_CLASS = _ThreadEventClass(event_cls)
+    logs.stdout_event_out = _ThreadOut(stdout_event_out, 'event_out')
+    logs.stdout_log_out = _ThreadOut(stdout_log_out, 'log_out')
+    _per_thread += 1
+    try:
+        with threads.inheriting(_capture):
+            yield
+    finally:
+        _per_thread -= 1
+        logs.EVENT_CLASS = event_cls
+        logs.stdout_event_out = stdout_event_out
+        logs.stdout_log_out = stdout_log_out
+
+
+def _capture():
+    thread_output = getattr(_local, 'output', None)
+    if thread_output is None:
+        return None
+    return _using(thread_output)
+
+
+@contextmanager
+def _using(thread_output):
+    _local.output = thread_output
+    try:
+        yield
+    finally:
+        _local.output = None
+
+
+class _Output(object):
+
+    # the output of a parallel macro step
+
+    def __init__(self, event_cls, event_out, log_out, renderer, sink):
+        self.event_cls = event_cls
+        self.event_out = event_out
+        self.log_out = log_out
+        self.renderer = renderer
+        self.sink = sink
+
+    def close(self):
+        if self.renderer:
+            self.renderer.close()
+        if self.sink:
+            self.sink.close()
+
+
+class _ThreadOut(_OutFunc):
+
+    # passes events or logs to the output functions of the current thread,
+    # or to out_func if it has none
+
+    def __init__(self, out_func, name):
+        super(_ThreadOut, self).__init__(out_func)
+        self.name = name
+
+    def current(self):
+        thread_output = getattr(_local, 'output', None)
+        if thread_output is None:
+            return self.out_func
+        return getattr(thread_output, self.name)
+
+    def __call__(self, item):
+        self.current()(item)
+
+
+class _ThreadEventClass(object):
+
+    def __init__(self, event_cls):
+        self.event_cls = event_cls
+
+    def __call__(self, event):
+        thread_output = getattr(_local, 'output', None)
+        if thread_output is None:
+            return self.event_cls(event)
+        return thread_output.event_cls(event)
+
+
+def _unfiltered(out_func):
+    while isinstance(out_func, _OutFunc):
+        out_func = out_func.out_func
+    return out_func
+
+
+def _hook_send_event():
+    global _original_send_event
+    if logs._send_event is not _send_event:
+        _original_send_event = logs._send_event
+        logs._send_event = _send_event
+
+
+def _send_event(ctx, context_type, event_type, message, args,
+                additional_context, out_func):
+    # events rejected by type are dropped before their message context is
+    # even built
+    accepting = out_func
+    if isinstance(accepting, _ThreadOut):
+        accepting = accepting.current()
+    if isinstance(accepting, _EventFilter) and not accepting.accepts(
+            event_type):
+        return
+    _original_send_event(ctx, context_type, event_type, message, args,
+                         additional_context, out_func)
+
+
+_original_send_event = None
+_renderer = None
+_sink = None
+_per_thread = 0
+_local = threading.local()
@@ -0,0 +1,118 @@
+########
+# Copyright (c) 2016 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+############
+
+import json
+import os
+import urlparse
+
+import yaml
+from path import path
+
+from clash import cache
+
+_MAX_CACHED_PLANS = 20
+
+
+def init_env(blueprint_path, inputs, name, storage, ignored_modules):
+    # equivalent to cloudify.workflows.local.init_env, except that the
+    # prepared deployment plan is read from a content addressed cache
+    from cloudify.workflows import local
+    plan = prepared_plan(blueprint_path, inputs)
+    nodes = [local.Node(node) for node in plan['nodes']]
+    node_instances = [local.NodeInstance(instance)
+                      for instance in plan['node_instances']]
+    local._prepare_nodes_and_instances(nodes, node_instances,
+                                       ignored_modules)
+    storage.init(name=name,
+                 plan=plan,
+                 nodes=nodes,
+                 node_instances=node_instances,
+                 blueprint_path=blueprint_path,
+                 provider_context=None)
+
+
+def prepared_plan(blueprint_path, inputs):
+    key = _key(blueprint_path, inputs)
+    plan_path = cache.cache_dir() / 'plans' / '{}.json'.format(key)
+    try:
+        plan = json.loads(plan_path.text())
+        # recently used plans are kept when pruning
+        plan_path.utime(None)
+        return plan
+    except (IOError, OSError, ValueError):
+        pass
+    from dsl_parser import parser as dsl_parser
+    from dsl_parser import tasks as dsl_tasks
+    plan = dsl_tasks.prepare_deployment_plan(
+        dsl_parser.parse_from_path(dsl_file_path=blueprint_path),
+        inputs=inputs)
+    content = json.dumps(plan)
+    try:
+        plan_path.dirname().makedirs_p()
+        cache.write_atomic(plan_path, content)
+        _prune(plan_path.dirname())
+    except (IOError, OSError):
+        # caching is best effort
+        pass
+    # parsed from the cached content to return the same result on hits
+    # and misses
+    return json.loads(content)
+
+
+def _key(blueprint_path, inputs):
+    from dsl_parser import parser as dsl_parser
+    parser_path = path(dsl_parser.__file__)
+    blueprint_path = path(blueprint_path).abspath()
+    return cache.sha1(json.dumps({
+        'blueprint': _blueprint_digests(blueprint_path,
+                                        blueprint_path.dirname(), {}),
+        'inputs': inputs,
+        # plans prepared by a different dsl_parser may differ
+        'parser': [str(parser_path), parser_path.mtime]
+    }, sort_keys=True))
+
+
+def _blueprint_digests(blueprint_path, root, digests):
+    # digests of the blueprint and the files it imports, recursively, keyed
+    # by their path relative to the (possibly staged) blueprint dir. non
+    # local imports are keyed by their url
+    key = str(root.relpathto(blueprint_path))
+    if key in digests:
+        return digests
+    content = blueprint_path.bytes()
+    digests[key] = cache.sha1(content)
+    imports = (yaml.safe_load(content) or {}).get('imports') or []
+    for import_url in imports:
+        parsed = urlparse.urlparse(import_url)
+        if parsed.scheme and parsed.scheme != 'file':
+            digests[import_url] = None
+            continue
+        import_path = path(parsed.path if parsed.scheme else import_url)
+        if not import_path.isabs():
+            import_path = blueprint_path.dirname() / import_path
+        import_path = import_path.abspath()
+        if import_path.isfile():
+            _blueprint_digests(import_path, root, digests)
+        else:
+            digests[import_url] = None
+    return digests
+
+
+def _prune(plans_dir):
+    plans = sorted(plans_dir.files('*.json'), key=os.path.getmtime,
+                   reverse=True)
+    for plan_path in plans[_MAX_CACHED_PLANS:]:
+        plan_path.remove_p()
@@ -0,0 +1,137 @@
+########
+# Copyright (c) 2016 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+############
+
+import shlex
+import sys
+import time
+import traceback
+
+import argcomplete
+
+try:
+    import readline
+except ImportError:
+    readline = None
+
+_EXIT = ['exit', 'quit']
+_RELOAD = 'reload'
+_NESTED = ['shell', 'batch']
+
+
+class Shell(object):
+
+    def __init__(self, loader, input_func=raw_input):
+        self.loader = loader
+        self.input_func = input_func
+        self.prompt = '{}> '.format(loader.config.name)
+
+    def loop(self):
+        self._reload()
+        while True:
+            try:
+                line = self.input_func(self.prompt)
+            except EOFError:
+                print
+                return
+            except KeyboardInterrupt:
+                print
+                continue
+            try:
+                argv = shlex.split(line)
+            except ValueError as e:
+                print >> sys.stderr, 'error: {}'.format(e)
+                continue
+            if not argv:
+                continue
+            if argv[0] in _EXIT:
+                return
+            if argv[0] == _RELOAD:
+                self._reload()
+                continue
+            self.execute(argv)
+
+    def execute(self, argv):
+        # returns whether the command succeeded
+        if argv[0] in _NESTED:
+            print >> sys.stderr, 'error: {} cannot be nested'.format(argv[0])
+            return False
+        succeeded = False
+        try:
+            self.loader.dispatch(argv)
+            succeeded = True
+        except SystemExit as e:
+            # argparse errors, --help and command errors
+            if e.code and not isinstance(e.code, int):
+                print >> sys.stderr, e.code
+            succeeded = not e.code
+        except KeyboardInterrupt:
+            print >> sys.stderr, 'interrupted'
+        except Exception:
+            traceback.print_exc()
+        finally:
+            # the shell itself runs inside the transaction of the command
+            # that started it, persist each command's changes as it ends
+            self.loader.user_config.flush()
+        if argv[0] == 'env':
+            # env commands may change the storage dir and therefore the
+            # available commands
+            self._reload()
+        return succeeded
+
+    def _reload(self):
+        self.loader.reload()
+        if readline:
+            # the parser's argcomplete completers (including env aware
+            # completers which reuse the loaded env) serve tab completion
+            finder = argcomplete.CompletionFinder(self.loader.parser)
+            readline.set_completer_delims('')
+            readline.set_completer(finder.rl_complete)
+            readline.parse_and_bind('tab: complete')
+
+
+class Batch(Shell):
+
+    def run(self, lines, keep_going=False):
+        # returns whether all commands succeeded
+        self._reload()
+        timings = []
+        for line in lines:
+            try:
+                argv = shlex.split(line, comments=True)
+            except ValueError as e:
+                print >> sys.stderr, 'error: {}'.format(e)
+                argv = None
+            if argv == []:
+                continue
+            start = time.time()
+            succeeded = argv is not None and self.execute(argv)
+            timings.append((line.strip(), succeeded, time.time() - start))
+            if not succeeded and not keep_going:
+                break
+        _print_summary(timings)
+        return all(succeeded for _, succeeded, _ in timings)
+
+    def _reload(self):
+        self.loader.reload()
+
+
+def _print_summary(timings):
+    print >> sys.stderr, ''
+    for line, succeeded, duration in timings:
+        print >> sys.stderr, '{:>8.3f}s  {:<6}  {}'.format(
+            duration, 'ok' if succeeded else 'failed', line)
+    print >> sys.stderr, '{:>8.3f}s  total'.format(
+        sum(duration for _, _, duration in timings))
@@ -0,0 +1,245 @@
+########
+# Copyright (c) 2016 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+############
+
+# imports the cloudify stack, imported by the loader where used
+
+import json
+import os
+import shutil
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+import argh
+from path import path
+
+from cloudify.workflows import local
+
+from clash import module
+
+FILE = 'file'
+SQLITE = 'sqlite'
+
+_DB_NAME = 'storage.sqlite'
+_SCHEMA = [
+    'CREATE TABLE IF NOT EXISTS data (key TEXT PRIMARY KEY, value TEXT)',
+    'CREATE TABLE IF NOT EXISTS node_instances '
+    '(id TEXT PRIMARY KEY, node_id TEXT, data TEXT)',
+    'CREATE INDEX IF NOT EXISTS node_instances_node_id '
+    'ON node_instances (node_id)'
+]
+
+
+def create(backend, storage_dir):
+    # backend is one of the built in backends or a path to a storage class
+    if backend == FILE:
+        return local.FileStorage(storage_dir=storage_dir)
+    if backend == SQLITE:
+        return SQLiteStorage(storage_dir=storage_dir)
+    return module.load_attribute(backend)(storage_dir=storage_dir)
+
+
+def migrate(storage_dir, name, target):
+    # copies a deployment kept by FileStorage into target. resources are
+    # left in place, all backends keep them in the same location
+    local_dir = path(storage_dir) / name
+    if not (local_dir / 'data').isfile():
+        raise argh.CommandError('No file storage found in {}'
+                                .format(local_dir))
+    source = local.FileStorage(storage_dir=storage_dir)
+    source.load(name)
+    with source.payload() as payload:
+        payload = dict(payload)
+    target.import_deployment(
+        name=name,
+        plan=source.plan,
+        nodes=source.get_nodes(),
+        node_instances=source.get_node_instances(),
+        blueprint_filename=path(source.get_blueprint_path()).basename(),
+        provider_context=source.get_provider_context(),
+        payload=payload)
+
+
+class SQLiteStorage(local._Storage):
+
+    # node instances are rows of a single sqlite database (in WAL mode)
+    # instead of a file each. the storage dir layout is otherwise the same
+    # as FileStorage's
+
+    def __init__(self, storage_dir='/tmp/cloudify-workflows'):
+        super(SQLiteStorage, self).__init__()
+        self._root_storage_dir = storage_dir
+        self._storage_dir = None
+        self._blueprint_path = None
+        # sqlite connections can't be shared between threads, workflow
+        # tasks run in a thread pool
+        self._local = threading.local()
+
+    def init(self, name, plan, nodes, node_instances, blueprint_path,
+             provider_context):
+        storage_dir = os.path.join(self._root_storage_dir, name)
+        os.makedirs(storage_dir)
+        resources_root = os.path.dirname(os.path.abspath(blueprint_path))
+        self.resources_root = os.path.join(storage_dir, 'resources')
+
+        def ignore(src, names):
+            return names if os.path.abspath(self.resources_root) == src \
+                else set()
+        shutil.copytree(resources_root, self.resources_root, ignore=ignore)
+        self.import_deployment(
+            name=name,
+            plan=plan,
+            nodes=nodes,
+            node_instances=node_instances,
+            blueprint_filename=os.path.basename(blueprint_path),
+            provider_context=provider_context,
+            payload={})
+
+    def import_deployment(self, name, plan, nodes, node_instances,
+                          blueprint_filename, provider_context, payload):
+        self._storage_dir = os.path.join(self._root_storage_dir, name)
+        with self.batch() as connection:
+            for statement in _SCHEMA:
+                connection.execute(statement)
+            connection.executemany(
+                'INSERT OR REPLACE INTO data (key, value) VALUES (?, ?)', [
+                    (key, json.dumps(value)) for key, value in [
+                        ('plan', plan),
+                        ('blueprint_filename', blueprint_filename),
+                        ('nodes', nodes),
+                        ('provider_context', provider_context or {}),
+                        ('payload', payload)]])
+            connection.execute('DELETE FROM node_instances')
+            connection.executemany(
+                'INSERT INTO node_instances (id, node_id, data) '
+                'VALUES (?, ?, ?)',
+                [(i.id, i.node_id, json.dumps(i)) for i in node_instances])
+        self.load(name)
+
+    def load(self, name):
+        storage_dir = os.path.join(self._root_storage_dir, name)
+        # checked before connecting, which would create an empty database
+        if not os.path.isfile(os.path.join(storage_dir, _DB_NAME)):
+            if os.path.isfile(os.path.join(storage_dir, 'data')):
+                raise argh.CommandError(
+                    '{} holds a file storage deployment, run '
+                    'migrate-storage to import it into sqlite storage.'
+                    .format(storage_dir))
+            raise argh.CommandError('No sqlite storage found in {}'
+                                    .format(storage_dir))
+        self.name = name
+        self._storage_dir = storage_dir
+        self.plan = self._get_data('plan')
+        self.resources_root = os.path.join(self._storage_dir, 'resources')
+        self._blueprint_path = os.path.join(
+            self.resources_root, self._get_data('blueprint_filename'))
+        self._provider_context = self._get_data('provider_context')
+        nodes = [local.Node(node) for node in self._get_data('nodes')]
+        self._init_locks_and_nodes(nodes)
+
+    @contextmanager
+    def payload(self):
+        with self.batch():
+            payload = self._get_data('payload')
+            yield payload
+            self._connection().execute(
+                'UPDATE data SET value = ? WHERE key = ?',
+                (json.dumps(payload), 'payload'))
+
+    @contextmanager
+    def batch(self):
+        # writes made by the current thread within a batch are committed
+        # in a single transaction
+        connection = self._connection()
+        depth = getattr(self._local, 'batch_depth', 0)
+        self._local.batch_depth = depth + 1
+        try:
+            yield connection
+        except BaseException:
+            if not depth:
+                connection.rollback()
+            raise
+        else:
+            if not depth:
+                connection.commit()
+        finally:
+            self._local.batch_depth = depth
+
+    def get_blueprint_path(self):
+        return self._blueprint_path
+
+    def update_node_instance(self, node_instance_id, version,
+                             runtime_properties=None, state=None):
+        # the read and the write of the instance in one transaction, and
+        # part of the enclosing batch if there is one
+        with self.batch():
+            super(SQLiteStorage, self).update_node_instance(
+                node_instance_id,
+                version=version,
+                runtime_properties=runtime_properties,
+                state=state)
+
+    def get_node_instance(self, node_instance_id):
+        return self._get_node_instance(node_instance_id)
+
+    def _load_instance(self, node_instance_id):
+        with self._lock(node_instance_id):
+            row = self._connection().execute(
+                'SELECT data FROM node_instances WHERE id = ?',
+                (node_instance_id,)).fetchone()
+        return local.NodeInstance(json.loads(row[0])) if row else None
+
+    def _store_instance(self, node_instance, lock=True):
+        instance_lock = self._lock(node_instance.id) if lock else None
+        if instance_lock:
+            instance_lock.acquire()
+        try:
+            with self.batch() as connection:
+                connection.execute(
+                    'UPDATE node_instances SET data = ? WHERE id = ?',
+                    (json.dumps(node_instance), node_instance.id))
+        finally:
+            if instance_lock:
+                instance_lock.release()
+
+    def get_node_instances(self, node_id=None):
+        query = 'SELECT data FROM node_instances'
+        params = ()
+        if node_id:
+            query += ' WHERE node_id = ?'
+            params = (node_id,)
+        return [local.NodeInstance(json.loads(row[0]))
+                for row in self._connection().execute(query, params)]
+
+    def _instance_ids(self):
+        return [row[0] for row in self._connection().execute(
+            'SELECT id FROM node_instances')]
+
+    def _get_data(self, key):
+        row = self._connection().execute(
+            'SELECT value FROM data WHERE key = ?', (key,)).fetchone()
+        return json.loads(row[0])
+
+    def _connection(self):
+        db_path = os.path.join(self._storage_dir, _DB_NAME)
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.db_path != db_path:
+            connection = sqlite3.connect(db_path, timeout=60)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+            self._local.db_path = db_path
+        return connection
@@ -27,6 +27,7 @@ from path import path
 from cloudify.workflows import local
 
 import clash
+from clash import cache
 from clash import dispatch
 from clash.tests import resources
 
@@ -39,12 +40,15 @@ class BaseTest(unittest.TestCase):
     def setUp(self):
         self.workdir = path(tempfile.mkdtemp(prefix='clash-tests-'))
         self.user_conf_path = self.workdir / 'user_conf'
+        self.cache_dir = self.workdir / 'cache'
         os.environ[USER_CONF_PATH] = self.user_conf_path
+        os.environ[cache.CACHE_DIR] = self.cache_dir
         self.addCleanup(self.cleanup)
 
     def cleanup(self):
         shutil.rmtree(self.workdir, ignore_errors=True)
         os.environ.pop(USER_CONF_PATH, None)
+        os.environ.pop(cache.CACHE_DIR, None)
 
     def dispatch(self, config_path, *args, **kwargs):
         # for tox
@@ -17,9 +17,11 @@
 import os
 import json
 
+import yaml
 from mock import patch
 
 from clash import tests
+from clash.tests import resources
 
 
 class TestApply(tests.BaseTest):
@@ -33,6 +35,79 @@ class TestApply(tests.BaseTest):
     def test_nested(self):
         self._test(config_path='apply_nested.yaml')
 
+    def test_incremental_unchanged(self):
+        config_path = 'apply.yaml'
+        output_path = self.workdir / 'output.json'
+        with patch.dict(os.environ, {'test_output_path': output_path}):
+            self.dispatch(config_path, 'env', 'create')
+            self.dispatch(config_path, 'apply', incremental=True)
+            self.assertTrue(output_path.exists())
+            output_path.remove()
+            output = self.dispatch(config_path, 'apply',
+                                   incremental=True).stdout
+            self.assertIn('No node changed', output)
+            self.assertFalse(output_path.exists())
+            self.dispatch(config_path, 'apply')
+            self.assertTrue(output_path.exists())
+            output_path.remove()
+            self.dispatch(config_path, 'apply', incremental=True, force=True)
+            self.assertTrue(output_path.exists())
+
+    def test_skip_unchanged(self):
+        config_path = 'apply.yaml'
+        output_path = self.workdir / 'output.json'
+        with patch.dict(os.environ, {'test_output_path': output_path}):
+            self.dispatch(config_path, 'env', 'create')
+            self.dispatch(config_path, 'apply', skip_unchanged=True)
+            self.assertTrue(output_path.exists())
+            output_path.remove()
+            output = self.dispatch(config_path, 'apply',
+                                   skip_unchanged=True).stdout
+            self.assertIn('skipping', output)
+            self.assertFalse(output_path.exists())
+            self.dispatch(config_path, 'apply', skip_unchanged=True,
+                          force=True)
+            self.assertTrue(output_path.exists())
+
+    def test_incremental_affected_nodes(self):
+        config_path = self._incremental_config()
+        output_path = self.workdir / 'output.json'
+        with patch.dict(os.environ, {'test_output_path': output_path}):
+            self.dispatch(config_path, 'env', 'create')
+            self.set_inputs({'port': 1})
+            self.dispatch(config_path, 'apply', incremental=True)
+            self.assertEqual(['app', 'db', 'other'],
+                             json.loads(output_path.text()))
+            self.set_inputs({'port': 2})
+            self.dispatch(config_path, 'apply', incremental=True)
+            self.assertEqual(['app', 'db'], json.loads(output_path.text()))
+
+    def test_incremental_changed_resource(self):
+        config_path = self._incremental_config()
+        output_path = self.workdir / 'output.json'
+        with patch.dict(os.environ, {'test_output_path': output_path}):
+            self.dispatch(config_path, 'env', 'create')
+            self.set_inputs({'port': 1})
+            self.dispatch(config_path, 'apply', incremental=True)
+            output_path.remove()
+            script_path = (self.workdir / 'blueprint' / 'blueprint_workflows' /
+                           'nodes.py')
+            script_path.write_text(script_path.text() + '\n# edited\n')
+            self.dispatch(config_path, 'apply', incremental=True)
+            self.assertEqual(['app', 'db', 'other'],
+                             json.loads(output_path.text()))
+
+    def _incremental_config(self):
+        # the blueprint is copied, the tests change its resources
+        blueprint_dir = self.workdir / 'blueprint'
+        (resources.DIR / 'blueprints' / 'incremental_apply').copytree(
+            blueprint_dir)
+        config = self.config('apply_incremental.yaml')
+        config['blueprint_path'] = str(blueprint_dir / 'blueprint.yaml')
+        config_path = self.workdir / 'apply_incremental.yaml'
+        config_path.write_text(yaml.safe_dump(config))
+        return os.path.relpath(config_path, resources.DIR / 'configs')
+
     def _test(self, verbose=False, config_path='apply.yaml'):
         output_path = self.workdir / 'output.json'
         expected = {
@@ -0,0 +1,62 @@
+########
+# Copyright (c) 2016 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+############
+
+import json
+
+import sh
+
+from clash import tests
+
+
+class TestBatch(tests.BaseTest):
+
+    config_path = 'end_to_end.yaml'
+
+    def test_script_file(self):
+        output_path = self.workdir / 'output.json'
+        script_path = self.workdir / 'script'
+        script_path.write_lines([
+            '# comment',
+            'env create',
+            '',
+            'init',
+            'command1 value --output-path {}  # trailing'.format(output_path)
+        ])
+        result = self.dispatch(self.config_path, 'batch', script_path)
+        self.assertEqual('value', json.loads(output_path.text())['param1'])
+        self.assertIn('from workflow1', result.stdout)
+        self.assertIn('ok      init', result.stderr)
+        self.assertIn('total', result.stderr)
+
+    def test_stdin(self):
+        self.dispatch(self.config_path, 'batch',
+                      _in='env create\ninit\n')
+        self.assertEqual('main', self.current())
+
+    def test_stop_on_error(self):
+        with self.assertRaises(sh.ErrorReturnCode) as c:
+            self.dispatch(self.config_path, 'batch',
+                          _in='env create\nenv use no_such_env\nenv list\n')
+        stderr = c.exception.stderr
+        self.assertIn('failed  env use no_such_env', stderr)
+        self.assertNotIn('env list', stderr)
+
+    def test_keep_going(self):
+        with self.assertRaises(sh.ErrorReturnCode) as c:
+            self.dispatch(self.config_path, 'batch', keep_going=True,
+                          _in='env create\nenv use no_such_env\nenv list\n')
+        self.assertIn('ok      env list', c.exception.stderr)
+        self.assertIn('main', c.exception.stdout)
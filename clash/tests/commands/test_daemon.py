@@ -0,0 +1,91 @@
+########
+# Copyright (c) 2016 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+############
+
+import json
+import os
+import StringIO
+import sys
+import time
+
+import sh
+import yaml
+from mock import patch
+
+import clash
+from clash import daemon
+from clash import tests
+from clash.tests import resources
+
+
+class TestDaemon(tests.BaseTest):
+
+    config_path = 'end_to_end.yaml'
+
+    def setUp(self):
+        super(TestDaemon, self).setUp()
+        os.environ[daemon.DAEMON] = '1'
+        self.addCleanup(os.environ.pop, daemon.DAEMON, None)
+
+    def test_no_daemon_falls_back(self):
+        self.assertIsNone(self._forward(['env', 'list']))
+        self.dispatch(self.config_path, 'env', 'create')
+        self.assertEqual('main', self.current())
+
+    def test_commands(self):
+        self._start_daemon()
+        self.dispatch(self.config_path, 'env', 'create')
+        self.dispatch(self.config_path, 'init')
+        output_path = self.workdir / 'output.json'
+        output = self.dispatch(self.config_path, 'command1', 'value',
+                               output_path=output_path).stdout
+        self.assertIn('from workflow1', output)
+        self.assertEqual('value', json.loads(output_path.text())['param1'])
+        with self.assertRaises(sh.ErrorReturnCode) as c:
+            self.dispatch(self.config_path, 'env', 'use', 'no_such_env')
+        self.assertEqual(1, c.exception.exit_code)
+        self.assertIn('No such configuration', c.exception.stderr)
+        stdout = StringIO.StringIO()
+        with patch('sys.stdout', stdout):
+            self.assertEqual(0, self._forward(['env', 'list']))
+        self.assertEqual('main', stdout.getvalue().strip())
+
+    def test_invalidated_on_macros_change(self):
+        self._start_daemon()
+        self.dispatch(self.config_path, 'env', 'create')
+        (self.workdir / 'macros.yaml').write_text(yaml.safe_dump({
+            'macro1': {'commands': []}}))
+        self.dispatch(self.config_path, 'macro1')
+
+    def _forward(self, argv):
+        config_path = resources.DIR / 'configs' / self.config_path
+        with self.workdir:
+            return daemon.forward(config_path, argv)
+
+    def _start_daemon(self):
+        python_path = '{0}{1}{2}'.format(
+            os.path.dirname(os.path.dirname(clash.__file__)),
+            os.pathsep,
+            os.environ.get('PYTHONPATH', '.'))
+        env = os.environ.copy()
+        env['PYTHONPATH'] = python_path
+        process = sh.Command(sys.executable)('-m', 'clash.daemon',
+                                             _bg=True, _env=env)
+        self.addCleanup(process.terminate)
+        socket_path = daemon.socket_path()
+        deadline = time.time() + 30
+        while not socket_path.exists():
+            self.assertLess(time.time(), deadline)
+            time.sleep(0.1)
@@ -0,0 +1,107 @@
+########
+# Copyright (c) 2016 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+############
+
+import json
+import os
+
+import sh
+import yaml
+from mock import patch
+
+from clash import tests
+
+
+class TestHistory(tests.BaseTest):
+
+    config_path = 'output_filter.yaml'
+
+    def setUp(self):
+        super(TestHistory, self).setUp()
+        self.dispatch(self.config_path, 'env', 'create')
+        self.dispatch(self.config_path, 'init')
+
+    def test_no_history(self):
+        self.assertIn('No executions recorded',
+                      self.dispatch(self.config_path, 'history').stdout)
+
+    def test_executions(self):
+        self._run('command1')
+        self._run('command2')
+        executions = self._history()
+        self.assertEqual(['command1', 'command2'],
+                         [e['command'] for e in executions])
+        self.assertEqual(['succeeded'] * 2, [e['status'] for e in executions])
+        self.assertEqual('workflow1', executions[0]['workflow'])
+        self.assertEqual('param1_value',
+                         executions[0]['parameters']['param1'])
+        self.assertEqual(1, len(self._history(limit=1)))
+        self.assertEqual([], self._history(workflow='other'))
+        output = self.dispatch(self.config_path, 'history').stdout
+        self.assertIn('workflow1 (command2)', output)
+
+    def test_events(self):
+        self._run('command1')
+        self._run('command2')
+        events = self._history(event_type='workflow_succeeded')
+        self.assertEqual([1, 2], [e['execution_id'] for e in events])
+        self.assertEqual([], self._history(event_type='workflow_succeeded',
+                                           since='2000-01-01',
+                                           until='2000-01-02'))
+        output = self.dispatch(self.config_path, 'history',
+                               execution=2).stdout
+        self.assertIn('workflow execution succeeded', output)
+        self.assertTrue(all(line.startswith('#2 ')
+                            for line in output.splitlines()))
+
+    def test_parallel_macro(self):
+        self._run('command1')
+        event_count = self._history()[0]['event_count']
+        macros = {
+            'parallel-macro': {
+                'concurrency': 2,
+                'commands': [{'name': 'command1', 'id': 'first'},
+                             {'name': 'command3', 'id': 'second'}]
+            }
+        }
+        (self.workdir / 'macros.yaml').write_text(yaml.safe_dump(macros))
+        self._run('parallel-macro')
+        executions = self._history()[1:]
+        self.assertEqual(['command1', 'command3'],
+                         sorted(e['command'] for e in executions))
+        self.assertEqual([event_count] * 2,
+                         [e['event_count'] for e in executions])
+
+    def test_failed(self):
+        with self.assertRaises(sh.ErrorReturnCode):
+            self._run('command1', output_path=self.workdir / 'no' / 'file')
+        execution, = self._history()
+        self.assertEqual('failed', execution['status'])
+        self.assertIn('No such file', execution['error'])
+
+    def test_invalid_time(self):
+        self._run('command1')
+        with self.assertRaises(sh.ErrorReturnCode) as c:
+            self._history(since='yesterday')
+        self.assertIn('Invalid time', c.exception.stderr)
+
+    def _run(self, command, output_path=None):
+        output_path = output_path or self.workdir / 'output.json'
+        with patch.dict(os.environ, {'test_output_path': output_path}):
+            self.dispatch(self.config_path, command)
+
+    def _history(self, **kwargs):
+        return json.loads(self.dispatch(self.config_path, 'history',
+                                        json=True, **kwargs).stdout)
@@ -53,6 +53,39 @@ class TestInit(tests.BaseTest):
         self.test_basic()
         self.test_basic(env_create=False, reset=True)
 
+    def test_reset_unchanged(self):
+        self.test_basic()
+        marker = self.workdir / '.local' / 'marker'
+        marker.touch()
+        self.dispatch('basic.yaml', 'init', reset=True)
+        self.assertFalse(marker.exists())
+
+    def test_reset_skip_unchanged(self):
+        self.test_basic()
+        marker = self.workdir / '.local' / 'marker'
+        marker.touch()
+        output = self.dispatch('basic.yaml', 'init', reset=True,
+                               skip_unchanged=True).stdout
+        self.assertIn('skipping', output)
+        self.assertTrue(marker.exists())
+        inputs = self.inputs()
+        inputs['input'] = 'NEW_INPUT_VALUE'
+        self.set_inputs(inputs)
+        self.dispatch('basic.yaml', 'init', reset=True, skip_unchanged=True)
+        self.assertFalse(marker.exists())
+        self.assertEqual(self.env().outputs()['output'], 'NEW_INPUT_VALUE')
+
+    def test_reset_changed_inputs(self):
+        self.test_basic()
+        marker = self.workdir / '.local' / 'marker'
+        marker.touch()
+        inputs = self.inputs()
+        inputs['input'] = 'NEW_INPUT_VALUE'
+        self.set_inputs(inputs)
+        self.dispatch('basic.yaml', 'init', reset=True)
+        self.assertFalse(marker.exists())
+        self.assertEqual(self.env().outputs()['output'], 'NEW_INPUT_VALUE')
+
     def test_inputs(self):
         env = self.test_basic()
         self.assertEqual(env.outputs()['output'], self.INPUT)
@@ -67,7 +100,11 @@ class TestInit(tests.BaseTest):
 
     def test_before_init(self):
         config_path = 'before_init.yaml'
+        blueprint_path = (resources.DIR / 'configs' /
+                          self.config(config_path)['blueprint_path'])
+        blueprint = blueprint_path.text()
         env = self.test_basic(config_path=config_path)
+        self.assertEqual(blueprint, blueprint_path.text())
         self.assertEqual(env.outputs(), {
             'input': self.INPUT,
             'from_before_init': self.config(config_path)['name']
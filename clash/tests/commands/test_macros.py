@@ -51,6 +51,74 @@ class TestMacros(tests.BaseTest):
         self.assertIn('from workflow1', c.exception.stdout)
         self.assertIn('EXPECTED', c.exception.stderr)
 
+    def test_builtin_name(self):
+        config_path = 'end_to_end.yaml'
+        self.dispatch(config_path, 'env', 'create')
+        macros = {
+            'shell': {'commands': [{'name': 'command1', 'args': ['a']}]},
+            'history': {'macro4': {'commands': [{'name': 'command1'}]}}
+        }
+        macros_path = self.workdir / 'macros.yaml'
+        macros_path.write_text(yaml.safe_dump(macros))
+        with self.assertRaises(sh.ErrorReturnCode) as c:
+            self.dispatch(config_path, 'init')
+        self.assertIn('error: Commands, macros and namespaces may not use '
+                      'the name of a built-in command: history, shell',
+                      c.exception.stderr)
+
+    def test_parallel_macro(self):
+        config_path = 'end_to_end.yaml'
+        self.dispatch(config_path, 'env', 'create')
+        self.dispatch(config_path, 'init')
+        outputs = [str(self.workdir / 'output{}.json'.format(i))
+                   for i in range(3)]
+        macros = {
+            'parallel-macro': {
+                'concurrency': 2,
+                'commands': [
+                    {'name': 'command1', 'id': 'first',
+                     'args': ['a', '--output-path', outputs[0]]},
+                    {'name': 'command1', 'id': 'second',
+                     'args': ['b', '--output-path', outputs[1]]},
+                    {'name': 'command1', 'id': 'last',
+                     'depends_on': ['first', 'second'],
+                     'args': ['c', '--output-path', outputs[2]]}
+                ]
+            }
+        }
+        macros_path = self.workdir / 'macros.yaml'
+        macros_path.write_text(yaml.safe_dump(macros))
+        output = self.dispatch(config_path, 'parallel-macro').stdout
+        for output_path, param1 in zip(outputs, ['a', 'b', 'c']):
+            with open(output_path) as f:
+                self.assertEqual(json.load(f)['param1'], param1)
+        self.assertIn('[last] ', output)
+
+    def test_macro_kwargs(self):
+        config_path = 'end_to_end.yaml'
+        output_path = self.workdir / 'output.json'
+        self.dispatch(config_path, 'env', 'create')
+        self.dispatch(config_path, 'init')
+        macros = {
+            'kwargs-macro': {
+                'args': [{'name': '--out'}],
+                'commands': [
+                    {'name': 'command1',
+                     'args': {'arg1': 1,
+                              'arg3': [1, 2],
+                              'output-path': {'arg': 'out'}}}
+                ]
+            }
+        }
+        macros_path = self.workdir / 'macros.yaml'
+        macros_path.write_text(yaml.safe_dump(macros))
+        self.dispatch(config_path, 'kwargs-macro', out=output_path)
+        self.assertEqual(json.loads(output_path.text()), {
+            'param1': 1,
+            'param2': 'arg2_default',
+            'param3': [1, 2]
+        })
+
     def test_update_python_path(self):
         config_path = 'pythonpath.yaml'
         storage_dir_functions = self.workdir / 'storage_dir_functions'
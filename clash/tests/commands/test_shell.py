@@ -0,0 +1,61 @@
+########
+# Copyright (c) 2016 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+############
+
+import json
+
+from clash import tests
+
+
+class TestShell(tests.BaseTest):
+
+    def test_env_commands(self):
+        config_path = 'end_to_end.yaml'
+        output = self._shell(config_path, [
+            'env create',
+            'init',
+            'status --json'
+        ]).stdout
+        self.assertEqual('main', self.current())
+        self.assertIn('"current": "main"', output)
+
+    def test_workflow_commands(self):
+        config_path = 'end_to_end.yaml'
+        self.dispatch(config_path, 'env', 'create')
+        self.dispatch(config_path, 'init')
+        output1_path = self.workdir / 'output1.json'
+        output2_path = self.workdir / 'output2.json'
+        self._shell(config_path, [
+            'command1 one --output-path {}'.format(output1_path),
+            'command1 two --output-path {}'.format(output2_path)
+        ])
+        self.assertEqual('one', json.loads(output1_path.text())['param1'])
+        self.assertEqual('two', json.loads(output2_path.text())['param1'])
+
+    def test_errors_do_not_exit(self):
+        config_path = 'end_to_end.yaml'
+        self.dispatch(config_path, 'env', 'create')
+        result = self._shell(config_path, [
+            'no-such-command',
+            'env use no_such_env',
+            'command1 "unterminated',
+            'env list'
+        ])
+        self.assertIn('No such configuration', result.stderr)
+        self.assertIn('main', result.stdout)
+
+    def _shell(self, config_path, lines):
+        return self.dispatch(config_path, 'shell',
+                             _in='\n'.join(lines + ['exit']) + '\n')
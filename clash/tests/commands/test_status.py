@@ -15,7 +15,12 @@
 ############
 
 import json as _json
+import os
 
+import sh
+from mock import patch
+
+from clash import lock
 from clash import tests
 
 
@@ -38,6 +43,16 @@ class TestStatus(tests.BaseTest):
         }
         self.assertEqual(expected, actual)
 
+    def test_lock_timeout(self):
+        self._test(json=False)
+        storage_lock = lock.FileLock(self.storage_dir() / '.clash.lock')
+        with storage_lock.exclusive():
+            with patch.dict(os.environ, {lock.LOCK_TIMEOUT: '0'}):
+                with self.assertRaises(sh.ErrorReturnCode) as c:
+                    self.dispatch('outputs.yaml', 'status')
+        self.assertIn('is held by another clash process', c.exception.stderr)
+        self.assertNotIn('outputs:', c.exception.stdout)
+
     def _test(self, json):
         config_path = 'outputs.yaml'
         self.dispatch(config_path, 'env', 'create')
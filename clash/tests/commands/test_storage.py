@@ -0,0 +1,62 @@
+########
+# Copyright (c) 2016 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+############
+
+import json
+
+import sh
+
+from clash import tests
+
+
+class TestStorage(tests.BaseTest):
+
+    INPUT = 'INPUT_VALUE'
+
+    def test_sqlite(self):
+        self._create('sqlite.yaml')
+        self.dispatch('sqlite.yaml', 'init')
+        self.assertTrue((self.workdir / '.local' / 'storage.sqlite').isfile())
+        self.assertFalse((self.workdir / '.local' / 'node-instances').exists())
+        self.assertEqual({'output': self.INPUT}, self._outputs('sqlite.yaml'))
+
+    def test_migrate(self):
+        self._create('basic.yaml')
+        self.dispatch('basic.yaml', 'init')
+        self.dispatch('sqlite.yaml', 'migrate-storage')
+        self.assertEqual({'output': self.INPUT}, self._outputs('sqlite.yaml'))
+
+    def test_sqlite_not_migrated(self):
+        self._create('basic.yaml')
+        self.dispatch('basic.yaml', 'init')
+        self.assertIn('run migrate-storage',
+                      self._outputs('sqlite.yaml')['error'])
+
+    def test_migrate_file_storage_configured(self):
+        self._create('basic.yaml')
+        self.dispatch('basic.yaml', 'init')
+        with self.assertRaises(sh.ErrorReturnCode) as c:
+            self.dispatch('basic.yaml', 'migrate-storage')
+        self.assertIn('nothing to migrate', c.exception.stderr)
+
+    def _create(self, config_path):
+        self.dispatch(config_path, 'env', 'create')
+        inputs = self.inputs()
+        inputs['input'] = self.INPUT
+        self.set_inputs(inputs)
+
+    def _outputs(self, config_path):
+        output = self.dispatch(config_path, 'status', json=True).stdout
+        return json.loads(output)['outputs']
@@ -18,6 +18,8 @@ import os
 import sys
 import json
 
+from mock import patch
+
 from clash import tests
 
 
@@ -49,6 +51,38 @@ class TestUserCommands(tests.BaseTest):
         assertion = self.assertIn if verbose else self.assertNotIn
         assertion("Starting 'workflow1'", output)
 
+    def test_output_filter(self):
+        config_path = 'output_filter.yaml'
+        output_path = self.workdir / 'output.json'
+        self.dispatch(config_path, 'env', 'create')
+        self.dispatch(config_path, 'init')
+        with patch.dict(os.environ, {'test_output_path': output_path}):
+            output = self.dispatch(config_path, 'command1',
+                                   verbose=True).stdout
+            self.assertIn('from workflow1', output)
+            self.assertIn('workflow execution succeeded', output)
+            self.assertNotIn("Starting 'workflow1'", output)
+            output = self.dispatch(config_path, 'command2',
+                                   verbose=True).stdout
+            self.assertNotIn('from workflow1', output)
+            self.assertIn('workflow execution succeeded', output)
+            output = self.dispatch(config_path, 'command3',
+                                   verbose=True).stdout
+            self.assertIn('workflow execution succeeded', output)
+
+    def test_event_log(self):
+        config_path = 'output_filter.yaml'
+        output_path = self.workdir / 'output.json'
+        self.dispatch(config_path, 'env', 'create')
+        self.dispatch(config_path, 'init')
+        with patch.dict(os.environ, {'test_output_path': output_path}):
+            self.dispatch(config_path, 'command4')
+        event_log = self.storage_dir() / 'logs' / 'command4.jsonl'
+        events = [json.loads(line) for line in event_log.lines()]
+        self.assertIn('workflow_succeeded',
+                      [e.get('event_type') for e in events])
+        self.assertIn('cloudify_log', [e['type'] for e in events])
+
     def test_task_config_default(self):
         config_path = 'task_config_default.yaml'
         counts = (0, 1, 1)
@@ -88,6 +122,20 @@ class TestUserCommands(tests.BaseTest):
         self.assertIn('all good', output)
         self.assertIn('param1: 1, param2: 2', output)
 
+    def test_update_python_path_preload(self):
+        config_path = 'pythonpath_preload.yaml'
+        storage_dir_functions = self.workdir / 'storage_dir_functions'
+        storage_dir_functions.mkdir_p()
+        (storage_dir_functions / '__init__.py').touch()
+        script_path = storage_dir_functions / 'functions.py'
+        script_path.write_text('def func2(**_): return 2')
+        self.dispatch(config_path, 'env', 'create')
+        self.dispatch(config_path, 'init')
+        result = self.dispatch(config_path, 'command1')
+        self.assertIn('all good', result.stdout)
+        self.assertIn('param1: 1, param2: 2', result.stdout)
+        self.assertNotIn('warning', result.stderr)
+
     def test_env_path(self):
         config_path = 'envpath.yaml'
         self.dispatch(config_path, 'env', 'create')
@@ -104,10 +152,13 @@ class TestUserCommands(tests.BaseTest):
         output2 = self.dispatch(config_path, 'command2').stdout
         output3 = self.dispatch(config_path, 'command3',
                                 verbose=True).stdout
+        output4 = self.dispatch(config_path, 'command4',
+                                verbose=True).stdout
         self.assertIn('EVENT1', output1)
         self.assertIn('EVENT2', output2)
         self.assertIn('EVENT3 env: .local, verbose: True, '
                       'workflow: workflow4', output3)
+        self.assertIn('EVENT4 Starting', output4)
 
     def test_functions(self):
         config_path = 'functions.yaml'
@@ -13,6 +13,16 @@ class Event2(output.Event):
         return 'EVENT2'
 
 
+class Event4(output.Event):
+
+    # written against the dict based event, changes the event it renders
+    def __init__(self, event):
+        super(Event4, self).__init__(event)
+        message = self.get('message') or {}
+        self['message'] = dict(message,
+                               text='EVENT4 {}'.format(message.get('text')))
+
+
 class Event3Factory(object):
 
     @staticmethod
@@ -0,0 +1,6 @@
+import json
+
+from cloudify.workflows import parameters
+
+with open(parameters.output_path, 'w') as f:
+    f.write(json.dumps(sorted(parameters.node_ids)))
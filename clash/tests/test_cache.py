@@ -0,0 +1,124 @@
+########
+# Copyright (c) 2016 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+############
+
+import os
+
+from clash import cache
+from clash import tests
+
+
+class TestCache(tests.BaseTest):
+
+    def setUp(self):
+        super(TestCache, self).setUp()
+        self.cache_path = self.workdir / 'cache.json'
+        self.source = self.workdir / 'source.yaml'
+        self.source.write_text('content')
+
+    def test_get_set(self):
+        c = cache.Cache(self.cache_path)
+        self.assertIsNone(c.get('key', [self.source]))
+        c.set('key', [self.source], {'value': 1})
+        self.assertEqual({'value': 1}, c.get('key', [self.source]))
+        c.save()
+        self.assertEqual({'value': 1},
+                         self._cache().get('key', [self.source]))
+
+    def test_changed_source(self):
+        self._save('key', [self.source], 'value')
+        self.source.write_text('changed')
+        self.assertIsNone(self._cache().get('key', [self.source]))
+
+    def test_touched_source(self):
+        self._save('key', [self.source], 'value')
+        stat = self.source.stat()
+        os.utime(self.source, (stat.st_atime, stat.st_mtime + 10))
+        self.assertEqual('value', self._cache().get('key', [self.source]))
+
+    def test_different_sources(self):
+        other = self.workdir / 'other.yaml'
+        self._save('key', [self.source], 'value')
+        self.assertIsNone(self._cache().get('key', [self.source, other]))
+
+    def test_missing_source(self):
+        missing = self.workdir / 'missing.yaml'
+        self._save('key', [missing], 'value')
+        self.assertEqual('value', self._cache().get('key', [missing]))
+        missing.write_text('exists')
+        self.assertIsNone(self._cache().get('key', [missing]))
+
+    def test_corrupted_cache(self):
+        self.cache_path.write_text('{not json')
+        self.assertIsNone(self._cache().get('key', [self.source]))
+        self._save('key', [self.source], 'value')
+        self.assertEqual('value', self._cache().get('key', [self.source]))
+
+    def test_for_config(self):
+        config_cache = cache.Cache.for_config(self.source)
+        self.assertEqual(self.cache_dir, config_cache.cache_path.dirname()
+                         .dirname())
+
+    def test_write_atomic(self):
+        target = self.workdir / 'target.yaml'
+        cache.write_atomic(target, 'one')
+        cache.write_atomic(target, 'two')
+        self.assertEqual('two', target.text())
+        self.assertEqual([target.basename()],
+                         [f.basename() for f in self.workdir.files('t*')])
+        self.assertEqual([], self.workdir.files('.target.yaml-*'))
+
+    def test_write_atomic_mode(self):
+        target = self.workdir / 'target.yaml'
+        cache.write_atomic(target, 'one')
+        self.assertEqual(0o666 & ~self._umask(), target.stat().st_mode & 0o777)
+        target.chmod(0o640)
+        cache.write_atomic(target, 'two')
+        self.assertEqual(0o640, target.stat().st_mode & 0o777)
+
+    def test_write_atomic_symlink(self):
+        target = self.workdir / 'target.yaml'
+        target.write_text('one')
+        target.chmod(0o644)
+        link = self.workdir / 'link.yaml'
+        target.symlink(link)
+        cache.write_atomic(link, 'two')
+        self.assertTrue(link.islink())
+        self.assertEqual('two', target.text())
+        self.assertEqual(0o644, target.stat().st_mode & 0o777)
+
+    def test_dir_fingerprint_exclude(self):
+        directory = self.workdir / 'blueprint'
+        storage_dir = directory / 'storage'
+        storage_dir.makedirs_p()
+        (directory / 'blueprint.yaml').write_text('blueprint')
+        fingerprint = cache.dir_fingerprint(directory, exclude=[storage_dir])
+        (storage_dir / 'state').write_text('state')
+        self.assertEqual(fingerprint, cache.dir_fingerprint(
+            directory, exclude=[storage_dir]))
+        self.assertNotEqual(fingerprint, cache.dir_fingerprint(directory))
+
+    def _umask(self):
+        umask = os.umask(0)
+        os.umask(umask)
+        return umask
+
+    def _save(self, key, sources, value):
+        c = self._cache()
+        c.set(key, sources, value)
+        c.save()
+
+    def _cache(self):
+        return cache.Cache(self.cache_path)
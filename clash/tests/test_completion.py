@@ -22,6 +22,7 @@ import sh
 import yaml
 
 import clash
+from clash import completion
 from clash import tests
 from clash.tests import resources
 
@@ -34,12 +35,15 @@ class TestCompletion(tests.BaseTest):
     help_args = ['-h', '--help']
 
     def test_basic(self):
-        self.assert_completion(expected=['env'] + self.help_args)
+        self.assert_completion(expected=['env', 'shell', 'batch'] +
+                               self.help_args)
 
     def test_basic_after_initial_create(self):
         self.dispatch(CONFIG_PATH, 'env', 'create', 'arg1')
         self.assert_completion(expected=['env', 'apply', 'init', 'status',
-                                         'command1'] + self.help_args)
+                                         'history', 'migrate-storage',
+                                         'shell', 'batch', 'command1'] +
+                               self.help_args)
 
     def test_env_create(self):
         base_env_create_options = ['-r', '--reset',
@@ -59,12 +63,17 @@ class TestCompletion(tests.BaseTest):
 
     def test_init(self):
         self.dispatch(CONFIG_PATH, 'env', 'create', 'arg')
-        self.assert_completion(expected=['-r', '--reset'] + self.help_args,
+        self.assert_completion(expected=['-r', '--reset',
+                                         '-s', '--skip-unchanged'] +
+                               self.help_args,
                                args=['init'])
 
     def test_apply(self):
         self.dispatch(CONFIG_PATH, 'env', 'create', 'arg')
-        self.assert_completion(expected=['-v', '--verbose'] + self.help_args,
+        self.assert_completion(expected=['-v', '--verbose', '-f', '--force',
+                                         '-i', '--incremental',
+                                         '-s', '--skip-unchanged'] +
+                               self.help_args,
                                args=['apply'])
 
     def test_status(self):
@@ -121,8 +130,45 @@ class TestCompletion(tests.BaseTest):
         self.assert_completion(expected=expected,
                                args=['nested', 'macro2'])
 
+    def test_user_command_options(self):
+        self.dispatch(CONFIG_PATH, 'env', 'create', 'arg')
+        self.assert_completion(expected=['--verbose', '--arg2', '--help'],
+                               args=['command1'], prefix='--')
+
+    def test_index_follows_macros(self):
+        self.dispatch(CONFIG_PATH, 'env', 'create', 'arg')
+        expected = ['env', 'apply', 'init', 'status', 'history',
+                    'migrate-storage', 'shell', 'batch', 'command1']
+        self.assert_completion(expected=expected + self.help_args)
+        macros_path = self.workdir / 'macros.yaml'
+        macros_path.write_text(yaml.safe_dump({
+            'macro1': {'commands': []}
+        }))
+        self.assert_completion(expected=expected + ['macro1'] +
+                               self.help_args)
+
+    def test_index_completions(self):
+        index = {
+            '': {'commands': ['env', 'status'], 'options': ['-h']},
+            'status': {'commands': [], 'options': ['-h', '--json']}
+        }
+        self.assertEqual(['-h', 'env', 'status'],
+                         completion.index_completions(index, [], ''))
+        self.assertEqual(['status'],
+                         completion.index_completions(index, [], 's'))
+        self.assertEqual(['--json'],
+                         completion.index_completions(index, ['status'],
+                                                      '--j'))
+        # positional completers need the parser
+        self.assertIsNone(completion.index_completions(index, ['status'],
+                                                       ''))
+        self.assertIsNone(completion.index_completions(index, ['other'],
+                                                       '-'))
+        self.assertIsNone(completion.index_completions(index, ['status'],
+                                                       '--json='))
+
     def assert_completion(self, expected, args=None,
-                          filter_non_options=False):
+                          filter_non_options=False, prefix="''"):
 
         project_dir = os.path.dirname(os.path.dirname(clash.__file__))
         this_file = os.path.basename(__file__)
@@ -131,7 +177,7 @@ class TestCompletion(tests.BaseTest):
         this_dir = os.path.dirname(__file__)
 
         args = args or []
-        args += ["''"]
+        args += [prefix]
         cmd = [this_file] + list(args)
         partial_word = cmd[-1]
         cmdline = ' '.join(cmd)
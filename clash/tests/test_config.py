@@ -20,6 +20,7 @@ import yaml
 from path import path
 from mock import patch
 
+from clash import cache
 from clash import config
 from clash import tests
 
@@ -104,6 +105,18 @@ class TestConfig(tests.BaseTest):
         self._save({'command_after_init_on_apply': 'my_command'})
         self.assertEqual(self.conf.command_after_init_on_apply, 'my_command')
 
+    def test_lock_timeout(self):
+        self._save({})
+        self.assertIsNone(self.conf.lock_timeout)
+        self._save({'lock_timeout': 30})
+        self.assertEqual(self.conf.lock_timeout, 30)
+
+    def test_history(self):
+        self._save({})
+        self.assertFalse(self.conf.history)
+        self._save({'history': True})
+        self.assertTrue(self.conf.history)
+
     def _save(self, value):
         self.config_path.write_text(yaml.safe_dump(value))
 
@@ -133,6 +146,18 @@ class TestUserConfig(tests.BaseTest):
         # test getter
         self.assertEqual(self.user_config.user_config, user_config)
 
+    def test_symlinked_user_config(self):
+        real_path = self.workdir / 'real-user-config.yaml'
+        real_path.write_text(yaml.safe_dump({'current': 'one'}))
+        real_path.chmod(0o644)
+        self.user_conf_path.remove_p()
+        real_path.symlink(self.user_conf_path)
+        self._reload()
+        self.user_config.current = 'two'
+        self.assertTrue(self.user_conf_path.islink())
+        self.assertEqual('two', yaml.safe_load(real_path.text())['current'])
+        self.assertEqual(0o644, real_path.stat().st_mode & 0o777)
+
     def test_configurations(self):
         configurations = {'hello': 'world'}
         self.user_config.configurations = configurations
@@ -220,3 +245,52 @@ class TestUserConfig(tests.BaseTest):
         }
         self._reload()
         self.assertIs(self.user_config.editable, True)
+
+    def test_transaction(self):
+        self.user_config.user_config = {'current': 'one'}
+        with patch('clash.cache.write_atomic',
+                   wraps=config.cache.write_atomic) as write_atomic:
+            with self.user_config.transaction():
+                self.user_config.current = 'two'
+                self.user_config.storage_dir = self.workdir
+                self.user_config.editable = True
+                with self.user_config.transaction():
+                    self.user_config.current = 'three'
+                self.assertEqual(self.user_conf(), {'current': 'one'})
+        self.assertEqual(1, write_atomic.call_count)
+        self._reload()
+        self.assertEqual(self.user_config.current, 'three')
+
+    def test_transaction_discarded_on_error(self):
+        self.user_config.user_config = {'current': 'one'}
+        with self.assertRaises(RuntimeError):
+            with self.user_config.transaction():
+                self.user_config.current = 'two'
+                raise RuntimeError()
+        self.assertEqual(self.user_config.current, 'one')
+        self.assertEqual(self.user_conf(), {'current': 'one'})
+
+    def test_cached_transaction_discarded_on_error(self):
+        self.user_config.user_config = {'current': 'one'}
+        self.user_config = config.UserConfig(
+            self.user_conf_path, cache=cache.Cache(self.workdir / 'cache'))
+        self.assertEqual(self.user_config.current, 'one')
+        with self.assertRaises(RuntimeError):
+            with self.user_config.transaction():
+                self.user_config.current = 'two'
+                raise RuntimeError()
+        self.assertEqual(self.user_config.current, 'one')
+        self.assertEqual(self.user_conf(), {'current': 'one'})
+
+    def test_locked(self):
+        self.user_config.user_config = {'current': 'one'}
+        self.assertEqual(self.user_config.current, 'one')
+        other = config.UserConfig(self.user_conf_path)
+        other.current = 'two'
+        with self.user_config.transaction():
+            with self.user_config.locked():
+                self.assertEqual(self.user_config.current, 'two')
+                self.user_config.configurations = {'two': {}}
+            # flushed before the lock is released
+            self.assertEqual(self.user_conf(),
+                             {'current': 'two', 'configurations': {'two': {}}})
@@ -0,0 +1,68 @@
+########
+# Copyright (c) 2016 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+############
+
+import unittest
+
+from cloudify.workflows import local
+from mock import MagicMock
+
+from clash import deployment
+from clash.tests import resources
+
+
+class TestDeployment(unittest.TestCase):
+
+    def test_unchanged(self):
+        snapshot = deployment.Snapshot(self._env(port=1))
+        self.assertEqual([], deployment.affected_nodes(snapshot,
+                                                       self._env(port=1).plan))
+
+    def test_changed_node_and_dependents(self):
+        snapshot = deployment.Snapshot(self._env(port=1))
+        self.assertEqual(['app', 'db'], deployment.affected_nodes(
+            snapshot, self._env(port=2).plan))
+
+    def test_restore(self):
+        previous = self._env(port=1)
+        for instance in previous.storage.get_node_instances():
+            previous.storage.update_node_instance(
+                instance.id,
+                version=instance.version,
+                runtime_properties={'node': instance.node_id},
+                state='started')
+        snapshot = deployment.Snapshot(previous)
+        env = self._env(port=2)
+        restored = deployment.restore(snapshot, env, ['app', 'db'])
+        self.assertEqual(['other'], restored)
+        instances = {i.node_id: i for i in env.storage.get_node_instances()}
+        self.assertEqual({'node': 'other'},
+                         instances['other'].runtime_properties)
+        self.assertEqual('started', instances['other'].state)
+        self.assertEqual({}, instances['db'].runtime_properties)
+        self.assertIsNone(instances['app'].state)
+
+    def test_restore_batched(self):
+        snapshot = deployment.Snapshot(self._env(port=1))
+        env = self._env(port=1)
+        env.storage.batch = MagicMock()
+        deployment.restore(snapshot, env, [])
+        self.assertEqual(1, env.storage.batch.call_count)
+
+    def _env(self, port):
+        return local.init_env(resources.DIR / 'blueprints' /
+                              'incremental.yaml',
+                              inputs={'port': port},
+                              storage=local.InMemoryStorage())
@@ -15,7 +15,9 @@
 ############
 
 import os
+import threading
 
+import argh
 from mock import patch
 
 from clash import functions
@@ -78,6 +80,141 @@ class TestFunctions(tests.BaseTest):
             }
         })
 
+    def test_parse_parameters_threads(self):
+        results = {}
+
+        def parse(index):
+            for _ in range(50):
+                result = functions.parse_parameters(
+                    None, {'param': {'concat': [{'arg': 'arg'}, '!']}},
+                    args={'arg': index})
+                results.setdefault(index, set()).add(result['param'])
+        threads = [threading.Thread(target=parse, args=(str(index),))
+                   for index in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual({str(index): {'{}!'.format(index)}
+                          for index in range(4)}, results)
+
+    def test_compiled_template(self):
+        parameters = {
+            'static': {'list': [1, 2], 'value': 'v'},
+            'dynamic': [{'arg': 'arg1'}, {'concat': [{'arg': 'arg1'}, '!']}],
+            'not_a_function': {'arg': 'arg1', 'other': 'value'}
+        }
+        template = functions.compile_parameters(parameters)
+        with patch('dsl_parser.functions.register') as register:
+            for value in ['one', 'two']:
+                result = template.evaluate(loader=None,
+                                           args={'arg1': value})
+                self.assertEqual(result, {
+                    'static': {'list': [1, 2], 'value': 'v'},
+                    'dynamic': [value, '{}!'.format(value)],
+                    'not_a_function': {'arg': 'arg1', 'other': 'value'}
+                })
+                result['static']['list'].append(3)
+        self.assertFalse(register.called)
+        self.assertEqual([{'arg': 'arg1'},
+                          {'concat': [{'arg': 'arg1'}, '!']}],
+                         parameters['dynamic'])
+        self.assertEqual([1, 2], parameters['static']['list'])
+
+    def test_function_result_evaluated(self):
+        func_name = '{}:{}'.format(__name__, nested_func.__name__)
+        result = functions.parse_parameters(None, {
+            'param': {'func': {'name': func_name}}
+        }, args={'arg1': 'arg1_value'})
+        self.assertEqual({'param': {'nested': 'arg1_value'}}, result)
+
+    def test_concurrent_evaluation(self):
+        template = functions.compile_parameters({'param': {'arg': 'arg1'}})
+        results = []
+
+        def evaluate(value):
+            for _ in range(100):
+                results.append(template.evaluate(
+                    loader=None, args={'arg1': value})['param'] == value)
+        threads = [threading.Thread(target=evaluate, args=(str(i),))
+                   for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([True] * 400, results)
+
+    def test_func_cache_invocation(self):
+        template = self._counting_template('invocation', kwargs={'k': 1})
+        with functions.invocation():
+            self.assertEqual(1, template.evaluate(None, {})['param'])
+            self.assertEqual(1, template.evaluate(None, {})['param'])
+        with functions.invocation():
+            self.assertEqual(2, template.evaluate(None, {})['param'])
+
+    def test_func_cache_process(self):
+        template = self._counting_template('process', kwargs={'k': 2})
+        with functions.invocation():
+            self.assertEqual(1, template.evaluate(None, {})['param'])
+        with functions.invocation():
+            self.assertEqual(1, template.evaluate(None, {})['param'])
+        other = self._counting_template('process', kwargs={'k': 3})
+        self.assertEqual(1, other.evaluate(None, {})['param'])
+
+    def test_func_cache_ttl(self):
+        template = self._counting_template('process', kwargs={'k': 4},
+                                           ttl=60)
+        with patch('time.time', return_value=1000):
+            self.assertEqual(1, template.evaluate(None, {})['param'])
+        with patch('time.time', return_value=1059):
+            self.assertEqual(1, template.evaluate(None, {})['param'])
+        with patch('time.time', return_value=1060):
+            self.assertEqual(2, template.evaluate(None, {})['param'])
+
+    def test_func_cache_storage(self):
+        storage_dir = self.workdir / 'storage'
+        storage_dir.mkdir_p()
+
+        class Loader(object):
+            class user_config(object):
+                pass
+        Loader.user_config.storage_dir = storage_dir
+        template = self._counting_template('storage', kwargs={'k': 5})
+        self.assertEqual(1, template.evaluate(Loader, {})['param'])
+        self.assertEqual(1, template.evaluate(Loader, {})['param'])
+        self.assertTrue((storage_dir / '.func_cache.json').isfile())
+        Loader.user_config.storage_dir = None
+        with self.assertRaises(argh.CommandError):
+            template.evaluate(Loader, {})
+
+    def test_func_cache_invalid_policy(self):
+        template = self._counting_template('forever')
+        with self.assertRaises(argh.CommandError):
+            template.evaluate(None, {})
+
+    def _counting_template(self, policy, kwargs=None, ttl=None):
+        del _calls[:]
+        func = {
+            'name': '{}:{}'.format(__name__, counting_func.__name__),
+            'cache': policy,
+            'kwargs': kwargs or {}
+        }
+        if ttl is not None:
+            func['ttl'] = ttl
+        return functions.compile_parameters({'param': {'func': func}})
+
+
+_calls = []
+
+
+def counting_func(**kwargs):
+    _calls.append(kwargs)
+    return len(_calls)
+
+
+def nested_func(**_):
+    return {'nested': {'arg': 'arg1'}}
+
 
 def custom_func(loader, kwarg=None, **_):
     return {
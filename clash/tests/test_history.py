@@ -0,0 +1,177 @@
+########
+# Copyright (c) 2016 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+############
+
+import StringIO
+import sqlite3
+import time
+
+import argh
+from mock import patch
+
+from clash import history
+from clash import tests
+
+
+class TestHistory(tests.BaseTest):
+
+    def setUp(self):
+        super(TestHistory, self).setUp()
+        self.db_path = self.workdir / history.DB_NAME
+        self.history = history.History(self.db_path)
+
+    def test_record(self):
+        with history.record(self.db_path, command='command',
+                            workflow='install',
+                            parameters={'key': 'value'}) as recorder:
+            recorder.put(_event('task_started', 'node1'))
+            recorder.put(_event('task_succeeded', 'node1'))
+        execution, = self.history.executions()
+        self.assertEqual('command', execution['command'])
+        self.assertEqual('install', execution['workflow'])
+        self.assertEqual({'key': 'value'}, execution['parameters'])
+        self.assertEqual(history.SUCCEEDED, execution['status'])
+        self.assertIsNone(execution['error'])
+        self.assertEqual(2, execution['event_count'])
+        self.assertLessEqual(execution['started_at'], execution['ended_at'])
+        self.assertEqual(['task_started', 'task_succeeded'],
+                         [e['event_type'] for _, e in self.history.events()])
+
+    def test_record_failed(self):
+        with self.assertRaises(RuntimeError):
+            with history.record(self.db_path, command='command',
+                                workflow='install', parameters={}):
+                raise RuntimeError('error')
+        execution, = self.history.executions()
+        self.assertEqual(history.FAILED, execution['status'])
+        self.assertEqual('error', execution['error'])
+
+    def test_record_max_events(self):
+        with history.record(self.db_path, command='command',
+                            workflow='install', parameters={},
+                            max_events=2) as recorder:
+            for _ in range(5):
+                recorder.put(_event('task_started', 'node1'))
+        execution, = self.history.executions()
+        self.assertEqual(3, execution['event_count'])
+        events = [e for _, e in self.history.events()]
+        self.assertEqual({'type': 'clash_events_dropped', 'count': 3},
+                         events[-1])
+
+    def test_record_save_failed(self):
+        stderr = StringIO.StringIO()
+        with patch.object(history.History, 'save',
+                          side_effect=sqlite3.OperationalError('locked')), \
+                patch('sys.stderr', stderr):
+            with history.record(self.db_path, command='command',
+                                workflow='install', parameters={}):
+                pass
+            with self.assertRaises(RuntimeError):
+                with history.record(self.db_path, command='command',
+                                    workflow='install', parameters={}):
+                    raise RuntimeError('error')
+        self.assertIn('warning: Failed saving the execution to the history: '
+                      'OperationalError: locked', stderr.getvalue())
+
+    def test_record_disabled(self):
+        with history.record(None, command='command', workflow='install',
+                            parameters={}) as recorder:
+            self.assertIsNone(recorder)
+        self.assertFalse(self.db_path.exists())
+
+    def test_executions_filters(self):
+        self._save('install', [_event('task_started', 'node1')],
+                   started_at=100)
+        self._save('uninstall', [_event('task_failed', 'node2')],
+                   started_at=200)
+        self._save('install', [_event('task_started', 'node2')],
+                   started_at=300)
+        self.assertEqual([1, 3], self._ids(workflow='install'))
+        self.assertEqual([2, 3], self._ids(node='node2'))
+        self.assertEqual([3], self._ids(node='node2',
+                                        event_type='task_started'))
+        self.assertEqual([2], self._ids(since=150, until=250))
+        self.assertEqual([2, 3], self._ids(limit=2))
+
+    def test_events_filters(self):
+        self._save('install', [_event('task_started', 'node1', 100),
+                               _event('task_succeeded', 'node1', 110)])
+        self._save('uninstall', [_event('task_started', 'node2', 200),
+                                 _event('task_failed', 'node2', 210)])
+
+        def events(**kwargs):
+            return [(execution_id, e['event_type'], e['node'])
+                    for execution_id, e in self.history.events(**kwargs)]
+        self.assertEqual([(2, 'task_started', 'node2'),
+                          (2, 'task_failed', 'node2')],
+                         events(workflow='uninstall'))
+        self.assertEqual([(1, 'task_started', 'node1'),
+                          (2, 'task_started', 'node2')],
+                         events(event_type='task_started'))
+        self.assertEqual([(2, 'task_failed', 'node2')],
+                         events(node='node2', since=205))
+        self.assertEqual([(1, 'task_succeeded', 'node1')],
+                         events(execution_id=1, until=200, limit=1))
+
+    def test_indexes_used(self):
+        self._save('install', [_event('task_started', 'node1')])
+        connection = self.history._connect()
+        for query, index in [
+                ('SELECT * FROM events WHERE node_name = ? AND '
+                 'timestamp >= ?', 'events_node_name'),
+                ('SELECT * FROM events WHERE event_type = ?',
+                 'events_event_type'),
+                ('SELECT * FROM executions WHERE workflow = ?',
+                 'executions_workflow')]:
+            plan = connection.execute('EXPLAIN QUERY PLAN ' + query,
+                                      (1, 2)[:query.count('?')]).fetchall()
+            self.assertIn(index, str(plan))
+        connection.close()
+
+    def test_parse_time(self):
+        with patch('time.time', return_value=10000):
+            self.assertEqual(10000 - 2 * 60 * 60, history.parse_time('2h'))
+            self.assertEqual(10000 - 30, history.parse_time('30s'))
+        self.assertEqual(time.mktime((2016, 1, 2, 10, 30, 0, 0, 0, -1)),
+                         history.parse_time('2016-01-02 10:30'))
+        self.assertIsNone(history.parse_time(None))
+        with self.assertRaises(argh.CommandError):
+            history.parse_time('yesterday')
+
+    def _save(self, workflow, events, started_at=0):
+        self.history.save(command='command',
+                          workflow=workflow,
+                          parameters={},
+                          started_at=started_at,
+                          ended_at=started_at + 1,
+                          status=history.SUCCEEDED,
+                          error=None,
+                          events=[(event.pop('time', started_at), event)
+                                  for event in events])
+
+    def _ids(self, **kwargs):
+        return [e['id'] for e in self.history.executions(**kwargs)]
+
+
+def _event(event_type, node_name, timestamp=None):
+    event = {
+        'type': 'cloudify_event',
+        'event_type': event_type,
+        'node': node_name,
+        'context': {'node_name': node_name}
+    }
+    if timestamp is not None:
+        event['time'] = timestamp
+    return event
@@ -0,0 +1,90 @@
+########
+# Copyright (c) 2016 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+############
+
+import json
+import os
+import sys
+
+import sh
+from path import path
+
+import clash
+from clash import tests
+from clash.tests import resources
+
+HEAVY_MODULES = [
+    'cloudify.workflows.local',
+    'cloudify.workflows.workflow_context',
+    'cloudify.logs',
+    'dsl_parser.functions',
+    'dsl_parser.parser',
+    'networkx',
+    'pika',
+]
+
+SCRIPT = '''
+import json
+import os
+import sys
+
+from clash import loader
+
+config_path, argv = sys.argv[1], sys.argv[2:]
+_loader = loader.Loader(config_path, argv=argv)
+if '_ARGCOMPLETE' not in os.environ:
+    try:
+        _loader.dispatch()
+    except SystemExit:
+        pass
+sys.stderr.write(json.dumps([m for m in json.loads(os.environ['HEAVY'])
+                             if sys.modules.get(m)]))
+'''
+
+
+class TestImports(tests.BaseTest):
+
+    def setUp(self):
+        super(TestImports, self).setUp()
+        self.config_path = resources.DIR / 'configs' / 'completions.yaml'
+        self.dispatch(self.config_path.basename(), 'env', 'create', 'arg')
+
+    def test_env_list(self):
+        self.assert_no_heavy_imports(['env', 'list'])
+
+    def test_env_use(self):
+        self.assert_no_heavy_imports(['env', 'use', 'main'])
+
+    def test_completion(self):
+        comp_line = 'clash env use '
+        self.assert_no_heavy_imports([], env={
+            '_ARGCOMPLETE': '1',
+            'COMP_LINE': comp_line,
+            'COMP_POINT': str(len(comp_line))
+        })
+
+    def assert_no_heavy_imports(self, argv, env=None):
+        process_env = os.environ.copy()
+        process_env.update(env or {})
+        process_env['HEAVY'] = json.dumps(HEAVY_MODULES)
+        process_env['PYTHONPATH'] = '{0}{1}{2}'.format(
+            path(clash.__file__).dirname().dirname(),
+            os.pathsep,
+            os.environ.get('PYTHONPATH', '.'))
+        with self.workdir:
+            result = sh.Command(sys.executable)('-c', SCRIPT,
+                                                self.config_path, *argv,
+                                                _env=process_env)
+        self.assertEqual([], json.loads(result.stderr))
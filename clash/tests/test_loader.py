@@ -0,0 +1,239 @@
+########
+# Copyright (c) 2016 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+############
+
+import errno
+import StringIO
+
+import argh
+import yaml
+from mock import patch
+
+from clash import loader as _loader
+from clash import tests
+from clash.tests import resources
+
+
+class TestLazyLoader(tests.BaseTest):
+
+    def setUp(self):
+        super(TestLazyLoader, self).setUp()
+        self.config_path = self.workdir / 'config.yaml'
+        command = {
+            'workflow': 'workflow1',
+            'args': [{'name': 'arg1',
+                      'completer': '{}:completer'.format(__name__)}]
+        }
+        broken_command = {
+            'workflow': 'workflow1',
+            'args': [{'name': 'arg1',
+                      'completer': 'no_such_module:completer'}]
+        }
+        self.config_path.write_text(yaml.safe_dump({
+            'name': 'lazy',
+            'blueprint_path': str(resources.DIR / 'blueprints' /
+                                  'basic.yaml'),
+            'user_config_path': {'env': tests.USER_CONF_PATH},
+            'commands': {
+                'command1': command,
+                'command2': broken_command,
+                'nested': {
+                    'command3': command,
+                    'command4': broken_command
+                }
+            }
+        }))
+        self.user_conf_path.write_text(yaml.safe_dump({
+            'current': 'main',
+            'configurations': {
+                'main': {'storage_dir': str(self.workdir)}
+            }
+        }))
+
+    def test_unselected_commands_not_built(self):
+        for argv in [['status'], ['command1'], ['nested', 'command3'],
+                     ['help', 'command1'], ['command1', '--help']]:
+            self._loader(argv=argv)
+
+    def test_selected_command_built(self):
+        for argv in [['command2'], ['nested', 'command4']]:
+            with self.assertRaises(ImportError):
+                self._loader(argv=argv)
+
+    def test_eager(self):
+        with self.assertRaises(ImportError):
+            self._loader(argv=['status'], lazy=False)
+
+    def test_user_commands_built_on_access(self):
+        loader = self._loader(argv=['status'])
+        command1 = loader.user_commands['command1']
+        self.assertEqual('command1', command1.argh_name)
+        self.assertIs(loader.user_commands['nested.command3'],
+                      loader.user_commands['nested.command3'])
+        with self.assertRaises(ImportError):
+            loader.user_commands['nested.command4']
+
+    def test_warm_start_skips_yaml(self):
+        macros_path = self.workdir / 'macros.yaml'
+        macros_path.write_text(yaml.safe_dump({'macro1': {'commands': []}}))
+        self._loader(argv=['status'])
+        with patch('yaml.safe_load', side_effect=AssertionError):
+            loader = self._loader(argv=['status'])
+        self.assertEqual('main', loader.user_config.current)
+        macros_path.write_text(yaml.safe_dump({'macro2': {'commands': []}}))
+        with patch('yaml.safe_load', wraps=yaml.safe_load) as safe_load:
+            self._loader(argv=['macro2'])
+        self.assertEqual(1, safe_load.call_count)
+
+    def test_completion_index_follows_clash_version(self):
+        self._loader(argv=['status'])._completion_index()
+        with patch('clash.completion.build_index',
+                   return_value={}) as build_index:
+            self._loader(argv=['status'])._completion_index()
+            self.assertFalse(build_index.called)
+            with patch('clash.__version__', 'next'):
+                self._loader(argv=['status'])._completion_index()
+            self.assertTrue(build_index.called)
+
+    def test_env_cached(self):
+        (self.workdir / 'inputs.yaml').write_text(yaml.safe_dump({
+            'input': 'value'}))
+        loader = self._loader(argv=['status'])
+        loader._init_command()
+        env = loader.env
+        self.assertIs(env, loader.env)
+        self.assertEqual({'output': 'value'}, env.outputs())
+        loader._init_command(reset=True)
+        self.assertIsNot(env, loader.env)
+
+    def test_env_reinitialized_elsewhere(self):
+        inputs_path = self.workdir / 'inputs.yaml'
+        inputs_path.write_text(yaml.safe_dump({'input': 'one'}))
+        loader = self._loader(argv=['status'])
+        loader._init_command()
+        self.assertEqual({'output': 'one'}, loader.env.outputs())
+        inputs_path.write_text(yaml.safe_dump({'input': 'two'}))
+        # e.g. another clash process
+        self._loader(argv=['status'])._init_command(reset=True)
+        self.assertEqual({'output': 'two'}, loader.env.outputs())
+
+    def test_reload_invalidates_env(self):
+        (self.workdir / 'inputs.yaml').write_text(yaml.safe_dump({
+            'input': 'value'}))
+        loader = self._loader(argv=['status'])
+        loader._init_command()
+        env = loader.env
+        loader.reload(['status'])
+        self.assertIsNot(env, loader.env)
+
+    def test_completer_uses_cached_env(self):
+        (self.workdir / 'inputs.yaml').write_text(yaml.safe_dump({
+            'input': 'value'}))
+        loader = self._loader(argv=['command1'])
+        loader._init_command()
+        env = loader.env
+        command1 = loader.user_commands['command1']
+        completer = [a['completer'] for a in command1.argh_args
+                     if 'completer' in a][0]
+        with patch('cloudify.workflows.local.load_env') as load_env:
+            self.assertEqual([], completer(prefix=''))
+        self.assertFalse(load_env.called)
+        self.assertIs(env, loader.env)
+
+    def test_macro_step_parser_cached(self):
+        loader = self._loader(argv=['command1'])
+        loader._macro_step_call('command1', ['value'])
+        parser = loader._step_parsers['command1']
+        with patch('argh.ArghParser') as parser_cls:
+            loader._macro_step_call('command1', ['value2'])
+            loader._macro_step_call('command1', {'arg1': 'value3'})
+        self.assertFalse(parser_cls.called)
+        self.assertIs(parser, loader._step_parsers['command1'])
+
+    def test_macro_step_namespace(self):
+        loader = self._loader(argv=['command1'])
+        loader._macro_step_call('command1', ['value'])
+        parser = loader._step_parsers['command1']
+        namespace = _loader._namespace(parser, 'command1', {'arg1': 1})
+        self.assertEqual(1, namespace.arg1)
+        self.assertFalse(namespace.verbose)
+        namespace = _loader._namespace(parser, 'command1',
+                                       {'arg1': 1, '--verbose': True})
+        self.assertTrue(namespace.verbose)
+        with self.assertRaises(argh.CommandError):
+            _loader._namespace(parser, 'command1', {})
+        with self.assertRaises(argh.CommandError):
+            _loader._namespace(parser, 'command1', {'arg1': 1, 'arg2': 2})
+
+    def test_preload_reports_bad_references(self):
+        config = yaml.safe_load(self.config_path.text())
+        config['preload'] = True
+        self.config_path.write_text(yaml.safe_dump(config))
+        (self.workdir / '.local' / 'resources').makedirs_p()
+        loader = self._loader(argv=['status'])
+        with patch.object(loader.parser, 'dispatch') as dispatch:
+            with patch('sys.stderr', new_callable=StringIO.StringIO) as err:
+                loader.dispatch(['status'])
+        self.assertTrue(dispatch.called)
+        self.assertIn('no_such_module:completer', err.getvalue())
+        self.assertNotIn('{}:completer'.format(__name__), err.getvalue())
+
+    def test_no_preload_before_init(self):
+        config = yaml.safe_load(self.config_path.text())
+        config['preload'] = True
+        self.config_path.write_text(yaml.safe_dump(config))
+        with patch('clash.module.Preload') as preload:
+            self._loader(argv=['status'])
+        self.assertFalse(preload.called)
+
+    def test_reload_invalidates_attributes(self):
+        loader = self._loader(argv=['status'])
+        with patch('clash.module.invalidate') as invalidate:
+            loader.reload(['status'])
+        self.assertTrue(invalidate.called)
+
+    def test_stage_dir_hardlinks(self):
+        source, target = self._stage_source()
+        _loader._stage_dir(source, target, exclude=source / 'excluded')
+        self.assertEqual('content', (target / 'sub' / 'file').text())
+        self.assertEqual((source / 'sub' / 'file').stat().st_ino,
+                         (target / 'sub' / 'file').stat().st_ino)
+        self.assertFalse((target / 'excluded').exists())
+
+    def test_stage_dir_copy_fallback(self):
+        source, target = self._stage_source()
+        error = OSError(errno.EXDEV, 'Invalid cross-device link')
+        with patch('os.link', side_effect=error) as link:
+            _loader._stage_dir(source, target)
+        self.assertEqual(1, link.call_count)
+        self.assertEqual('content', (target / 'sub' / 'file').text())
+        self.assertNotEqual((source / 'sub' / 'file').stat().st_ino,
+                            (target / 'sub' / 'file').stat().st_ino)
+
+    def _stage_source(self):
+        source = self.workdir / 'source'
+        (source / 'sub').makedirs()
+        (source / 'excluded').makedirs()
+        (source / 'sub' / 'file').write_text('content')
+        (source / 'sub' / 'other').write_text('other')
+        (source / 'excluded' / 'file').write_text('content')
+        return source, self.workdir / 'target'
+
+    def _loader(self, argv, lazy=True):
+        return _loader.Loader(self.config_path, argv=argv, lazy=lazy)
+
+
+def completer(*args, **kwargs):
+    return []
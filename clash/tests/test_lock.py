@@ -0,0 +1,84 @@
+########
+# Copyright (c) 2016 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+############
+
+import os
+
+import argh
+from mock import patch
+
+from clash import lock
+from clash import tests
+
+
+class TestFileLock(tests.BaseTest):
+
+    def setUp(self):
+        super(TestFileLock, self).setUp()
+        self.lock_path = self.workdir / '.clash.lock'
+
+    def test_shared_locks_do_not_block(self):
+        with self._lock().shared():
+            with self._lock().shared():
+                pass
+
+    def test_exclusive_blocks(self):
+        with self._lock().exclusive():
+            with self.assertRaises(argh.CommandError):
+                with self._lock().shared():
+                    pass
+        with self._lock().shared():
+            with self.assertRaises(argh.CommandError):
+                with self._lock().exclusive():
+                    pass
+
+    def test_timeout(self):
+        with self._lock().exclusive():
+            with patch('time.sleep') as sleep:
+                with self.assertRaises(lock.LockTimeout):
+                    with self._lock(timeout=0.2).exclusive():
+                        pass
+            self.assertTrue(sleep.called)
+
+    def test_reentrant(self):
+        file_lock = self._lock()
+        with file_lock.exclusive():
+            with file_lock.shared():
+                with file_lock.exclusive():
+                    pass
+            with self.assertRaises(argh.CommandError):
+                with self._lock().shared():
+                    pass
+        with self._lock().exclusive():
+            pass
+
+    def test_upgrade_and_downgrade(self):
+        file_lock = self._lock()
+        with file_lock.shared():
+            with file_lock.exclusive():
+                with self.assertRaises(argh.CommandError):
+                    with self._lock().shared():
+                        pass
+            with self._lock().shared():
+                pass
+
+    def test_lock_timeout(self):
+        self.assertIsNone(lock.lock_timeout())
+        self.assertEqual(5, lock.lock_timeout(default=5))
+        with patch.dict(os.environ, {lock.LOCK_TIMEOUT: '0'}):
+            self.assertEqual(0, lock.lock_timeout(default=5))
+
+    def _lock(self, timeout=0):
+        return lock.FileLock(self.lock_path, timeout=timeout)
@@ -0,0 +1,147 @@
+########
+# Copyright (c) 2016 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+############
+
+import StringIO
+import sys
+import threading
+
+import argh
+from mock import patch
+
+from clash import macros
+from clash import tests
+
+
+class TestMacroGraph(tests.BaseTest):
+
+    def setUp(self):
+        super(TestMacroGraph, self).setUp()
+        self.events = []
+
+    def test_is_parallel(self):
+        self.assertFalse(macros.is_parallel({'commands': [{'name': 'a'}]}))
+        self.assertTrue(macros.is_parallel({'commands': [{'name': 'a'}],
+                                            'concurrency': 2}))
+        self.assertTrue(macros.is_parallel({'commands': [
+            {'name': 'a'}, {'name': 'b', 'depends_on': ['a']}]}))
+
+    def test_dependencies(self):
+        macros.run([self._step('c', ['a', 'b']),
+                    self._step('a'),
+                    self._step('b', ['a'])])
+        self.assertEqual(['a', 'b', 'c'],
+                         [step_id for event, step_id in self.events
+                          if event == 'end'])
+
+    def test_independent_steps_run_concurrently(self):
+        arrived = []
+        both = threading.Event()
+
+        def wait_for_other(step_id):
+            arrived.append(step_id)
+            if len(arrived) == 2:
+                both.set()
+            both.wait(5)
+        macros.run([self._step('a', func=wait_for_other),
+                    self._step('b', func=wait_for_other)])
+        self.assertLess(self.events.index(('start', 'b')),
+                        self.events.index(('end', 'a')))
+
+    def test_concurrency_limit(self):
+        # steps block until a third one runs, which the limit prevents
+        self.assertEqual(2, self._peak(concurrency=2, release_at=3))
+
+    def test_no_concurrency_limit(self):
+        self.assertEqual(5, self._peak(concurrency=None, release_at=5))
+
+    def test_invalid_concurrency(self):
+        for concurrency in [0, -1]:
+            with self.assertRaises(argh.CommandError) as c:
+                macros.run([self._step('a')], concurrency=concurrency)
+            self.assertIn('at least 1', str(c.exception))
+
+    def test_fail_fast(self):
+        def fail(step_id):
+            raise RuntimeError(step_id)
+        with self.assertRaises(RuntimeError):
+            macros.run([self._step('a', func=fail),
+                        self._step('b', ['a'])])
+        self.assertNotIn(('start', 'b'), self.events)
+
+    def test_invalid_graph(self):
+        with self.assertRaises(argh.CommandError):
+            macros.run([self._step('a'), self._step('a')])
+        with self.assertRaises(argh.CommandError):
+            macros.run([self._step('a', ['missing'])])
+        with self.assertRaises(argh.CommandError):
+            macros.run([self._step('a', ['b']), self._step('b', ['a'])])
+
+    def test_prefixed_output(self):
+        stdout = StringIO.StringIO()
+
+        def write(step_id):
+            print 'one'
+            print 'two',
+        with patch('sys.stdout', stdout):
+            macros.run([self._step('a', func=write)])
+        self.assertEqual('[a] one\n[a] two', stdout.getvalue())
+
+    def test_prefixed_output_of_started_threads(self):
+        stdout = StringIO.StringIO()
+        start = threading.Thread.start
+
+        def write(step_id):
+            thread = threading.Thread(target=lambda: sys.stdout.write(
+                'from {}\n'.format(step_id)))
+            thread.start()
+            thread.join()
+        with patch('sys.stdout', stdout):
+            macros.run([self._step('a', func=write),
+                        self._step('b', func=write)])
+        self.assertEqual(['[a] from a', '[b] from b'],
+                         sorted(stdout.getvalue().splitlines()))
+        self.assertEqual(start, threading.Thread.start)
+
+    def _peak(self, concurrency, release_at):
+        # the highest number of steps that ran at once. running steps wait
+        # until release_at steps run at once, or a short timeout
+        lock = threading.Lock()
+        release = threading.Event()
+        state = {'running': 0, 'peak': 0}
+
+        def track(step_id):
+            with lock:
+                state['running'] += 1
+                state['peak'] = max(state['peak'], state['running'])
+                if state['running'] >= release_at:
+                    release.set()
+            release.wait(0.2)
+            with lock:
+                state['running'] -= 1
+        macros.run([self._step(str(i), func=track) for i in range(5)],
+                   concurrency=concurrency)
+        return state['peak']
+
+    def _step(self, step_id, depends_on=None, func=None):
+        def run(prepared):
+            self.events.append(('start', step_id))
+            if func:
+                func(step_id)
+            self.events.append(('end', step_id))
+        return macros.Step(step_id=step_id,
+                           depends_on=depends_on or [],
+                           prepare=lambda: None,
+                           run=run)
@@ -14,8 +14,13 @@
 # limitations under the License.
 ############
 
+import sys
+import tempfile
 import unittest
 
+from mock import patch
+from path import path
+
 from clash import module
 
 TEST_ATTRIBUTE = object()
@@ -27,3 +32,40 @@ class TestModule(unittest.TestCase):
         attribute_path = '{}:TEST_ATTRIBUTE'.format(__name__)
         attribute = module.load_attribute(attribute_path)
         self.assertIs(TEST_ATTRIBUTE, attribute)
+
+    def test_load_attribute_cached(self):
+        attribute_path = '{}:TEST_ATTRIBUTE'.format(__name__)
+        module.load_attribute(attribute_path)
+        with patch('importlib.import_module') as import_module:
+            attribute = module.load_attribute(attribute_path)
+        self.assertFalse(import_module.called)
+        self.assertIs(TEST_ATTRIBUTE, attribute)
+
+    def test_preload(self):
+        attribute_path = '{}:TEST_ATTRIBUTE'.format(__name__)
+        preload = module.Preload([attribute_path,
+                                  'no_such_module:attr',
+                                  '{}:no_such_attr'.format(__name__)])
+        errors = preload.wait()
+        self.assertEqual(['clash.tests.test_module:no_such_attr',
+                          'no_such_module:attr'], sorted(errors))
+        self.assertIsInstance(errors['no_such_module:attr'], ImportError)
+        self.assertIsInstance(
+            errors['clash.tests.test_module:no_such_attr'], AttributeError)
+
+    def test_invalidate(self):
+        module_dir = path(tempfile.mkdtemp(prefix='clash-module-'))
+        self.addCleanup(module_dir.rmtree_p)
+        sys.path.append(module_dir)
+        self.addCleanup(sys.path.remove, module_dir)
+        self.addCleanup(sys.modules.pop, 'edited_module', None)
+        source = module_dir / 'edited_module.py'
+        source.write_text('def func(): return 1')
+        attribute_path = 'edited_module:func'
+        self.assertEqual(1, module.load_attribute(attribute_path)())
+        source.write_text('def func(): return 2')
+        mtime = source.stat().st_mtime + 10
+        source.utime((mtime, mtime))
+        self.assertEqual(1, module.load_attribute(attribute_path)())
+        module.invalidate()
+        self.assertEqual(2, module.load_attribute(attribute_path)())
@@ -14,11 +14,21 @@
 # limitations under the License.
 ############
 
+import json
+import tempfile
+import threading
+import time
 import unittest
-from mock import patch
+from StringIO import StringIO
+
+import argh
+import colors
+from mock import Mock, patch
+from path import path
 
 from cloudify import logs
 
+from clash import output
 from clash.output import Event, setup_output
 
 STUB = object()
@@ -26,8 +36,14 @@ STUB = object()
 
 @patch('cloudify.logs.EVENT_CLASS', STUB)
 @patch('cloudify.logs.stdout_event_out', STUB)
+@patch('cloudify.logs.stdout_log_out', STUB)
+@patch('cloudify.logs._send_event', logs._send_event)
 class TestSetupOutput(unittest.TestCase):
 
+    def setUp(self):
+        self.workdir = path(tempfile.mkdtemp(prefix='clash-tests-'))
+        self.addCleanup(self.workdir.rmtree_p)
+
     def test_no_event_cls(self):
         setup_output(event_cls=None,
                      verbose=False,
@@ -66,6 +82,346 @@ class TestSetupOutput(unittest.TestCase):
                      command={})
         self.assertIsNot(logs.stdout_event_out, STUB)
 
+    def test_verbose_after_none_verbose(self):
+        setup_output(event_cls=None,
+                     verbose=False,
+                     env=None,
+                     command={})
+        setup_output(event_cls=None,
+                     verbose=True,
+                     env=None,
+                     command={})
+        self.assertIs(logs.stdout_event_out, STUB)
+
+    def test_none_verbose_events_dropped_early(self):
+        with patch('cloudify.logs.stdout_event_out', Mock()) as out, \
+                patch('cloudify.logs._send_event', Mock()) as send_event:
+            setup_output(event_cls=None,
+                         verbose=False,
+                         env=None,
+                         command={})
+            self._send_event('task_started')
+            logs.stdout_event_out({'event_type': 'task_started'})
+        self.assertFalse(send_event.called)
+        self.assertFalse(out.called)
+
+    def test_event_types(self):
+        with patch('cloudify.logs.stdout_event_out', Mock()) as out, \
+                patch('cloudify.logs._send_event', Mock()) as send_event:
+            setup_output(event_cls=None,
+                         verbose=True,
+                         env=None,
+                         command={},
+                         event_types=['task_failed'])
+            self._send_event('task_started')
+            self._send_event('task_failed')
+            logs.stdout_event_out({'event_type': 'task_started'})
+            logs.stdout_event_out({'event_type': 'task_failed'})
+        self.assertEqual(1, send_event.call_count)
+        self.assertEqual('task_failed', send_event.call_args[0][2])
+        out.assert_called_once_with({'event_type': 'task_failed'})
+
+    def test_log_level(self):
+        with patch('cloudify.logs.stdout_log_out', Mock()) as out:
+            setup_output(event_cls=None,
+                         verbose=False,
+                         env=None,
+                         command={},
+                         log_level='warning')
+            for level in ['debug', 'info', 'warning', 'error']:
+                logs.stdout_log_out({'level': level})
+            self.assertEqual([{'level': 'warning'}, {'level': 'error'}],
+                             [c[0][0] for c in out.call_args_list])
+            setup_output(event_cls=None,
+                         verbose=False,
+                         env=None,
+                         command={})
+            self.assertIs(out, logs.stdout_log_out)
+
+    def test_live_mode(self):
+        stdout = StringIO()
+        with patch('sys.stdout', stdout):
+            setup_output(event_cls=None,
+                         verbose=False,
+                         env=None,
+                         command={},
+                         mode='live',
+                         refresh_interval=60)
+            self.assertIsInstance(logs.stdout_event_out, output._TaskCounter)
+            logs.stdout_event_out(_task_event('task_started', 'node'))
+            logs.stdout_log_out({'level': 'info',
+                                 'context': {'workflow_id': 'install'},
+                                 'message': {'text': u'hello'}})
+            self.assertEqual('', stdout.getvalue())
+            output.close_output()
+        lines = stdout.getvalue().splitlines()
+        self.assertEqual(2, len(lines))
+        self.assertIn('hello', lines[0])
+        self.assertEqual('running 1, succeeded 0, failed 0 | node:1/0/0',
+                         lines[1])
+
+    def test_live_mode_restored(self):
+        with patch('sys.stdout', StringIO()):
+            setup_output(event_cls=None,
+                         verbose=True,
+                         env=None,
+                         command={},
+                         mode='live')
+            setup_output(event_cls=None,
+                         verbose=True,
+                         env=None,
+                         command={})
+        self.assertIsNone(output._renderer)
+        self.assertIs(logs.stdout_event_out, STUB)
+        self.assertIs(logs.stdout_log_out, STUB)
+
+    def test_event_log(self):
+        event_log = self.workdir / 'events.jsonl'
+        with patch('cloudify.logs.stdout_event_out', Mock()) as out, \
+                patch('cloudify.logs._send_event', Mock()) as send_event:
+            setup_output(event_cls=None,
+                         verbose=False,
+                         env=None,
+                         command={},
+                         event_log={'path': event_log})
+            self._send_event('task_started')
+            self.assertTrue(send_event.called)
+            logs.stdout_event_out({'event_type': 'task_started'})
+            logs.stdout_log_out = Mock()
+            setup_output(event_cls=None,
+                         verbose=True,
+                         env=None,
+                         command={},
+                         event_log={'path': event_log})
+            logs.stdout_log_out({'level': 'info'})
+            output.close_output()
+        self.assertFalse(out.called)
+        events = [json.loads(line) for line in event_log.lines()]
+        self.assertEqual(['cloudify_event', 'cloudify_log'],
+                         [e['type'] for e in events])
+        self.assertEqual('task_started', events[0]['event_type'])
+        self.assertEqual('info', events[1]['level'])
+
+    def test_per_thread(self):
+        sinks = {'first': Mock(), 'second': Mock()}
+
+        def step(name):
+            setup_output(event_cls=None,
+                         verbose=True,
+                         env=None,
+                         command={},
+                         sinks=[sinks[name]])
+            task = threading.Thread(target=logs.stdout_log_out,
+                                    args=({'name': name},))
+            task.start()
+            task.join()
+            output.close_output()
+        with patch('cloudify.logs.stdout_log_out', Mock()) as out:
+            with output.per_thread():
+                steps = [threading.Thread(target=step, args=(name,))
+                         for name in sorted(sinks)]
+                for thread in steps:
+                    thread.start()
+                for thread in steps:
+                    thread.join()
+            self.assertIs(out, logs.stdout_log_out)
+        self.assertIs(STUB, logs.EVENT_CLASS)
+        for name, sink in sinks.items():
+            self.assertEqual([name], [c[0][0]['name']
+                                      for c in sink.put.call_args_list])
+        self.assertEqual(2, out.call_count)
+
+    def test_unknown_mode(self):
+        with self.assertRaises(argh.CommandError):
+            setup_output(event_cls=None,
+                         verbose=True,
+                         env=None,
+                         command={},
+                         mode='unknown')
+
+    def _send_event(self, event_type):
+        logs._send_event(None, 'workflow', event_type, 'message', None, None,
+                         out_func=logs.stdout_event_out)
+
+
+class TestEvent(unittest.TestCase):
+
+    event = {
+        'event_type': 'task_started',
+        'level': 'info',
+        'context': {
+            'node_name': 'node',
+            'operation': 'cloudify.interfaces.lifecycle.create',
+            'workflow_id': 'install'
+        },
+        'message': {'text': u'message \u2713'}
+    }
+
+    def test_str(self):
+        self.assertEqual('[{}.{}] {}: {}'.format(
+            colors.cyan('node'),
+            colors.magenta('create'),
+            colors.color('INFO', fg='green'),
+            colors.color('message \xe2\x9c\x93', fg=13)),
+            str(Event(self.event)))
+
+    def test_mapping(self):
+        event = Event(self.event)
+        self.assertEqual('task_started', event['event_type'])
+        self.assertEqual('info', event.get('level'))
+        self.assertIsNone(event.get('logger'))
+        self.assertIn('context', event)
+        self.assertEqual(sorted(self.event), sorted(event))
+        self.assertEqual('node', event.node_id)
+        self.assertEqual('install', event.workflow_id)
+        self.assertIs(self.event['context'], event.context)
+        self.assertFalse(hasattr(event, '__dict__'))
+
+    def test_subclass(self):
+        class SubEvent(Event):
+            @property
+            def node_name(self):
+                return self.get('context')['node_name'].upper()
+        event = SubEvent(self.event)
+        self.assertEqual('NODE', event.node_name)
+        self.assertIn('NODE', str(event))
+
+    def test_mutating_subclass(self):
+        class SubEvent(Event):
+            def __init__(self, event):
+                super(SubEvent, self).__init__(event)
+                self['level'] = 'warning'
+                self.update(context=dict(self.context, node_name='other'))
+        event = SubEvent(self.event)
+        self.assertEqual('warning', event.level)
+        self.assertEqual('other', event.node_name)
+        self.assertIn('other', str(event))
+        self.assertEqual('info', self.event['level'])
+        self.assertEqual('node', self.event['context']['node_name'])
+        copied = event.copy()
+        self.assertIsInstance(copied, dict)
+        self.assertEqual('warning', json.loads(json.dumps(copied))['level'])
+        self.assertEqual(event.as_dict(), copied)
+
+
+@patch('cloudify.logs.EVENT_CLASS', Event)
+class TestLiveRenderer(unittest.TestCase):
+
+    def test_buffered(self):
+        stream = Mock()
+        renderer = output._LiveRenderer(refresh_interval=60, stream=stream)
+        renderer.write(_task_event('task_started', 'node'), 'cloudify_event')
+        renderer.write(_task_event('task_succeeded', 'node'),
+                       'cloudify_event')
+        self.assertFalse(stream.write.called)
+        renderer.flush()
+        stream.write.assert_called_once_with(
+            '\n'.join(str(Event(_task_event(event_type, 'node')))
+                      for event_type in ['task_started', 'task_succeeded']) +
+            '\n')
+        renderer.flush()
+        self.assertEqual(1, stream.write.call_count)
+
+    def test_refresh(self):
+        stream = StringIO()
+        renderer = output._LiveRenderer(refresh_interval=0.01, stream=stream)
+        renderer.start()
+        renderer.write(_task_event('task_started', 'node'), 'cloudify_event')
+        for _ in range(500):
+            if stream.getvalue():
+                break
+            time.sleep(0.01)
+        renderer.close()
+        self.assertIn('Task started', stream.getvalue())
+
+    def test_summary(self):
+        renderer = output._LiveRenderer(refresh_interval=60,
+                                        stream=StringIO())
+        for event_type, node_name in [('sending_task', 'node1'),
+                                      ('task_started', 'node1'),
+                                      ('task_started', 'node1'),
+                                      ('task_succeeded', 'node1'),
+                                      ('task_started', 'node2'),
+                                      ('task_failed', 'node2'),
+                                      ('task_started', 'node2'),
+                                      ('task_started', None)]:
+            renderer.count(_task_event(event_type, node_name))
+        self.assertEqual('running 2, succeeded 1, failed 1 | '
+                         'node1:1/1/0 node2:1/0/1', renderer.summary())
+
+    def test_live_summary_line(self):
+        stream = StringIO()
+        stream.isatty = lambda: True
+        renderer = output._LiveRenderer(refresh_interval=60, stream=stream)
+        event = _task_event('task_started', 'node')
+        renderer.count(event)
+        renderer.write(event, 'cloudify_event')
+        renderer.flush()
+        summary = 'running 1, succeeded 0, failed 0 | node:1/0/0'
+        self.assertTrue(stream.getvalue().endswith('\n' + summary))
+        stream.truncate(0)
+        event = _task_event('task_succeeded', 'node')
+        renderer.count(event)
+        renderer.flush()
+        self.assertEqual(output._CLEAR_LINE +
+                         'running 0, succeeded 1, failed 0 | node:0/1/0',
+                         stream.getvalue())
+        stream.truncate(0)
+        renderer.close()
+        self.assertEqual(output._CLEAR_LINE +
+                         'running 0, succeeded 1, failed 0 | node:0/1/0\n',
+                         stream.getvalue())
+
+
+class TestEventSink(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = path(tempfile.mkdtemp(prefix='clash-tests-'))
+        self.addCleanup(self.workdir.rmtree_p)
+        self.path = self.workdir / 'logs' / 'events.jsonl'
+
+    def test_write(self):
+        sink = output.EventSink(self.path)
+        sink.start()
+        for index in range(100):
+            sink.put({'index': index})
+        sink.close()
+        self.assertEqual([{'index': index} for index in range(100)],
+                         [json.loads(line) for line in self.path.lines()])
+
+    def test_rotation(self):
+        sink = output.EventSink(self.path, max_bytes=100, backup_count=2)
+        sink.start()
+        for index in range(100):
+            sink.put({'index': index})
+        sink.close()
+        self.assertEqual(['events.jsonl', 'events.jsonl.1',
+                          'events.jsonl.2'],
+                         sorted(f.basename() for f in self.path.dirname()
+                                .files()))
+        for log_path in self.path.dirname().files():
+            self.assertLessEqual(log_path.size, 100)
+        self.assertEqual({'index': 99}, json.loads(self.path.lines()[-1]))
+
+    def test_full_queue(self):
+        sink = output.EventSink(self.path, queue_size=2)
+        for index in range(5):
+            sink.put({'index': index})
+        self.assertEqual(3, sink.dropped)
+        sink.start()
+        sink.close()
+        self.assertEqual([{'index': 0}, {'index': 1},
+                          {'type': 'clash_events_dropped', 'count': 3}],
+                         [json.loads(line) for line in self.path.lines()])
+
+
+def _task_event(event_type, node_name):
+    return {
+        'event_type': event_type,
+        'context': {'node_name': node_name, 'workflow_id': 'install'},
+        'message': {'text': u'Task {}'.format(event_type.split('_')[-1])}
+    }
+
 
 class MockEvent(object):
     pass
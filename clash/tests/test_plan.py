@@ -0,0 +1,69 @@
+########
+# Copyright (c) 2016 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+############
+
+from mock import patch
+
+from dsl_parser import parser as dsl_parser
+
+from clash import plan
+from clash import tests
+
+
+class TestPlan(tests.BaseTest):
+
+    def setUp(self):
+        super(TestPlan, self).setUp()
+        self.imported = (
+            'node_types:\n'
+            '  type: {}\n')
+        self.blueprint = (
+            'tosca_definitions_version: cloudify_dsl_1_2\n'
+            'imports: [types.yaml]\n'
+            'inputs:\n'
+            '  input: {}\n'
+            'node_templates:\n'
+            '  node:\n'
+            '    type: type\n')
+
+    def test_plan_cached(self):
+        first = self._prepared_plan('one', inputs={'input': 'value'})
+        with patch.object(dsl_parser, 'parse_from_path') as parse:
+            # a different (staging) dir with the same content
+            second = self._prepared_plan('two', inputs={'input': 'value'})
+        self.assertFalse(parse.called)
+        self.assertEqual(first, second)
+        self.assertEqual('node', second['nodes'][0]['id'])
+
+    def test_inputs_change(self):
+        self._prepared_plan('one', inputs={'input': 'value'})
+        result = self._prepared_plan('one', inputs={'input': 'other'})
+        self.assertEqual({'input': 'other'}, result['inputs'])
+
+    def test_import_change(self):
+        self._prepared_plan('one', inputs={'input': 'value'})
+        self.imported += '  other_type: {}\n'
+        with patch.object(dsl_parser, 'parse_from_path',
+                          wraps=dsl_parser.parse_from_path) as parse:
+            self._prepared_plan('one', inputs={'input': 'value'})
+        self.assertTrue(parse.called)
+
+    def _prepared_plan(self, name, inputs):
+        blueprint_dir = self.workdir / name
+        blueprint_dir.makedirs_p()
+        (blueprint_dir / 'types.yaml').write_text(self.imported)
+        blueprint_path = blueprint_dir / 'blueprint.yaml'
+        blueprint_path.write_text(self.blueprint)
+        return plan.prepared_plan(blueprint_path, inputs)
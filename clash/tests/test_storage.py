@@ -0,0 +1,146 @@
+########
+# Copyright (c) 2016 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+############
+
+import threading
+
+import argh
+from cloudify.workflows import local
+
+from clash import storage
+from clash import tests
+from clash.tests import resources
+
+
+class TestSQLiteStorage(tests.BaseTest):
+
+    def test_init_and_load(self):
+        env = self._init_env()
+        loaded = local.load_env('test', storage=self._storage())
+        self.assertEqual(env.plan, loaded.plan)
+        instances = loaded.storage.get_node_instances()
+        self.assertEqual(['app', 'db', 'other'],
+                         sorted(i.node_id for i in instances))
+        db = loaded.storage.get_node_instances(node_id='db')
+        self.assertEqual(1, len(db))
+        self.assertEqual('db', loaded.storage.get_node('db').id)
+        self.assertTrue((self.workdir / 'test' / 'resources' /
+                         'incremental.yaml').isfile())
+
+    def test_update_node_instance(self):
+        self._init_env()
+        env = local.load_env('test', storage=self._storage())
+        instance = env.storage.get_node_instances(node_id='db')[0]
+        env.storage.update_node_instance(instance.id,
+                                         version=instance.version,
+                                         runtime_properties={'a': 1})
+        with self.assertRaises(local.StorageConflictError):
+            env.storage.update_node_instance(instance.id,
+                                             version=instance.version,
+                                             runtime_properties={'a': 2})
+        updated = local.load_env('test', storage=self._storage()).storage
+        self.assertEqual({'a': 1},
+                         updated.get_node_instance(instance.id)
+                         .runtime_properties)
+
+    def test_concurrent_updates(self):
+        self._init_env()
+        env = local.load_env('test', storage=self._storage())
+        instance_ids = [i.id for i in env.storage.get_node_instances()]
+
+        def update(instance_id):
+            for i in range(20):
+                instance = env.storage.get_node_instance(instance_id)
+                env.storage.update_node_instance(
+                    instance_id,
+                    version=instance.version,
+                    runtime_properties={'count': i})
+        threads = [threading.Thread(target=update, args=(i,))
+                   for i in instance_ids]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for instance in env.storage.get_node_instances():
+            self.assertEqual(20, instance.version)
+            self.assertEqual({'count': 19}, instance.runtime_properties)
+
+    def test_payload(self):
+        self._init_env()
+        with self._load().payload() as payload:
+            payload['key'] = 'value'
+        with self._load().payload() as payload:
+            self.assertEqual({'key': 'value'}, payload)
+
+    def test_migrate(self):
+        env = local.init_env(self._blueprint_path(),
+                             name='test',
+                             inputs={'port': 1},
+                             storage=local.FileStorage(self.workdir))
+        instance = env.storage.get_node_instances(node_id='db')[0]
+        env.storage.update_node_instance(instance.id,
+                                         version=instance.version,
+                                         runtime_properties={'a': 1},
+                                         state='started')
+        with env.storage.payload() as payload:
+            payload['key'] = 'value'
+        storage.migrate(self.workdir, 'test', self._storage())
+        migrated = self._load()
+        self.assertEqual(env.plan, migrated.plan)
+        instance = migrated.get_node_instance(instance.id)
+        self.assertEqual({'a': 1}, instance.runtime_properties)
+        self.assertEqual('started', instance.state)
+        with migrated.payload() as payload:
+            self.assertEqual({'key': 'value'}, payload)
+        self.assertEqual(env.storage.get_blueprint_path(),
+                         migrated.get_blueprint_path())
+
+    def test_batched_updates(self):
+        self._init_env()
+        env = local.load_env('test', storage=self._storage())
+        instance = env.storage.get_node_instances(node_id='db')[0]
+        with env.storage.batch():
+            env.storage.update_node_instance(instance.id,
+                                             version=instance.version,
+                                             runtime_properties={'a': 1})
+            self.assertEqual({}, self._load().get_node_instance(instance.id)
+                             .runtime_properties)
+        self.assertEqual({'a': 1}, self._load().get_node_instance(instance.id)
+                         .runtime_properties)
+
+    def test_load_file_storage(self):
+        local.init_env(self._blueprint_path(),
+                       name='test',
+                       inputs={'port': 1},
+                       storage=local.FileStorage(self.workdir))
+        with self.assertRaises(argh.CommandError) as c:
+            self._load()
+        self.assertIn('migrate-storage', str(c.exception))
+        self.assertFalse((self.workdir / 'test' / 'storage.sqlite').exists())
+
+    def _init_env(self):
+        return local.init_env(self._blueprint_path(),
+                              name='test',
+                              inputs={'port': 1},
+                              storage=self._storage())
+
+    def _load(self):
+        return local.load_env('test', storage=self._storage()).storage
+
+    def _storage(self):
+        return storage.create(storage.SQLITE, storage_dir=self.workdir)
+
+    def _blueprint_path(self):
+        return resources.DIR / 'blueprints' / 'incremental.yaml'
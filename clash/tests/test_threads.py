@@ -0,0 +1,80 @@
+########
+# Copyright (c) 2016 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+############
+
+import threading
+from contextlib import contextmanager
+
+from clash import tests
+from clash import threads
+
+
+class TestInheriting(tests.BaseTest):
+
+    def setUp(self):
+        super(TestInheriting, self).setUp()
+        self.local = threading.local()
+
+    def test_inherit(self):
+        with threads.inheriting(self._capture('first')):
+            with threads.inheriting(self._capture('second')):
+                self.local.first = 1
+                self.local.second = 2
+                self.assertEqual({'first': 1, 'second': 2},
+                                 self._in_thread())
+            self.assertEqual({'first': 1, 'second': None},
+                             self._in_thread())
+        self.assertEqual({'first': None, 'second': None}, self._in_thread())
+
+    def test_overlapping(self):
+        # contexts of different threads may exit in any order
+        start = threading.Thread.start
+        first = threads.inheriting(self._capture('first'))
+        second = threads.inheriting(self._capture('second'))
+        first.__enter__()
+        second.__enter__()
+        first.__exit__(None, None, None)
+        self.assertIsNot(start, threading.Thread.start)
+        self.local.second = 2
+        self.assertEqual({'first': None, 'second': 2}, self._in_thread())
+        second.__exit__(None, None, None)
+        self.assertEqual(start, threading.Thread.start)
+
+    def _capture(self, name):
+        def capture():
+            value = getattr(self.local, name, None)
+            if value is None:
+                return None
+            return self._setting(name, value)
+        return capture
+
+    @contextmanager
+    def _setting(self, name, value):
+        setattr(self.local, name, value)
+        try:
+            yield
+        finally:
+            setattr(self.local, name, None)
+
+    def _in_thread(self):
+        result = {}
+
+        def read():
+            for name in ['first', 'second']:
+                result[name] = getattr(self.local, name, None)
+        thread = threading.Thread(target=read)
+        thread.start()
+        thread.join()
+        return result
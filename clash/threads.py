@@ -0,0 +1,63 @@
+########
+# Copyright (c) 2016 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+############
+
+import threading
+from contextlib import contextmanager
+
+_lock = threading.Lock()
+_captures = []
+_start = threading.Thread.start
+
+
+@contextmanager
+def inheriting(capture):
+    # while active, threads that are started (e.g. the task thread pool of a
+    # workflow) inherit thread local state of the thread starting them.
+    # capture is called on the starting thread and returns a context manager
+    # the new thread runs in, or None. Thread.start is patched once, for
+    # all the captures active at the same time
+    with _lock:
+        if not _captures:
+            threading.Thread.start = _start_inheriting
+        _captures.append(capture)
+    try:
+        yield
+    finally:
+        with _lock:
+            _captures.remove(capture)
+            if not _captures:
+                threading.Thread.start = _start
+
+
+def _start_inheriting(thread):
+    with _lock:
+        captures = list(_captures)
+    contexts = [c for c in (capture() for capture in captures)
+                if c is not None]
+    if contexts:
+        run = thread.run
+
+        def run_inheriting():
+            _run_within(contexts, run)
+        thread.run = run_inheriting
+    return _start(thread)
+
+
+def _run_within(contexts, run):
+    if not contexts:
+        return run()
+    with contexts[0]:
+        return _run_within(contexts[1:], run)
@@ -14,11 +14,16 @@
 # limitations under the License.
 ############
 
+import re
+
 from setuptools import setup
 
+with open('clash/__init__.py') as f:
+    version = re.search(r"__version__ = '(.+)'", f.read()).group(1)
+
 setup(
     name='clash',
-    version='0.17',
+    version=version,
     author='GigaSpaces',
     author_email='cosmo-admin@gigaspaces.com',
     packages=['clash'],
@@ -26,7 +31,8 @@ setup(
     license='Apache License, Version 2.0',
     zip_safe=False,
     install_requires=[
-        'argcomplete',
+        # completion overrides CompletionFinder._get_completions
+        'argcomplete>=1.12,<2.0',
         'ansicolors',
         'argh',
         'path.py==8.1.2',